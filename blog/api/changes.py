@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+from heapq import merge
+from typing import NamedTuple
+
+from django.utils import timezone
+
+from web.models import Article, ParsingArticle
+from .pagination import CHANGES_SOURCES, after_position
+from .serializers import ArticleChangeSerializer, ParsingArticleChangeSerializer
+
+# Rows from the last CHANGES_LAG are not returned yet, so a transaction that
+# commits a bit later than its timestamp is not skipped by a cursor
+CHANGES_LAG = timedelta(seconds=5)
+
+SOURCES = {
+    'article': (Article, ArticleChangeSerializer, 'publication_date'),
+    'parsingarticle': (ParsingArticle, ParsingArticleChangeSerializer, 'added_date'),
+}
+
+
+class Change(NamedTuple):
+    source: str
+    updated_date: datetime
+    id: int
+    data: dict
+
+    @property
+    def position(self) -> tuple[datetime, int]:
+        return self.updated_date, self.id
+
+
+def head_positions(positions: dict[str, tuple[datetime, int]]) -> dict[str, tuple[datetime, int]]:
+    """The given positions, the newest change for the sources without one"""
+    horizon = timezone.now() - CHANGES_LAG
+    heads = {}
+    for source in CHANGES_SOURCES:
+        if source in positions:
+            heads[source] = positions[source]
+            continue
+        model = SOURCES[source][0]
+        head = model.objects.filter(updated_date__lte=horizon).order_by('-updated_date', '-id') \
+            .values_list('updated_date', 'id').first()
+        heads[source] = head or (horizon, 0)
+    return heads
+
+
+def get_changes(positions: dict[str, tuple[datetime, int]], limit: int,
+                origins: dict[str, tuple[datetime, int]] | None = None) -> tuple[list[Change], bool]:
+    """
+    Up to limit changes of all sources after their positions, oldest first,
+    and whether there are more. A source without a position starts from the beginning.
+
+    A change is `created` when the row was created after the origin of its source,
+    where the client started paging, its position by default. So a row that is
+    created and edited while the client reads, even pages before it, is still new to it.
+    """
+    origins = {**positions, **(origins or {})}
+    horizon = timezone.now() - CHANGES_LAG
+    pages = []
+    for source in CHANGES_SOURCES:
+        model, serializer, created_field = SOURCES[source]
+        queryset = model.objects.filter(updated_date__lte=horizon)
+        if source in positions:
+            queryset = after_position(queryset, *positions[source])
+        rows = queryset.order_by('updated_date', 'id')[:limit + 1]
+        pages.append([(row.updated_date, row.id, source, serializer, getattr(row, created_field), row) for row in rows])
+
+    changes = []
+    rows = list(merge(*pages, key=lambda row: row[:2]))
+    for updated_date, pk, source, serializer, created_date, row in rows[:limit]:
+        data = serializer(row).data
+        data['source'] = source
+        origin = origins.get(source)
+        data['change'] = 'created' if origin is None or (created_date, pk) > origin else 'updated'
+        changes.append(Change(source, updated_date, pk, data))
+
+    return changes, len(rows) > limit
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import logging
+import threading
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.utils import timezone
+
+from . import changes
+from .changes import Change, get_changes
+from .pagination import CHANGES_SOURCES, decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'article_changes'
+CLIENT_BUFFER = 100
+FETCH_LIMIT = 500
+# changes are read at least this often even if no notification came
+POLL_INTERVAL = 60
+# a comment line keeps idle connections open through proxies
+HEARTBEAT_INTERVAL = 15
+RETRY_MS = 5000
+
+OVERFLOW = object()
+
+
+def parse_last_event_id(value: str | None) -> dict[str, tuple[datetime, int]]:
+    """An event id is the cursors of all sources joined with dots, a broken one starts from now"""
+    positions = {}
+    for cursor in (value or '').split('.'):
+        try:
+            cursor = decode_cursor(cursor)
+        except ValueError:
+            continue
+        positions[cursor.source] = cursor.position
+    return positions
+
+
+def event_id(positions: dict[str, tuple[datetime, int]]) -> str:
+    return '.'.join(encode_cursor(source, *positions[source]) for source in CHANGES_SOURCES if source in positions)
+
+
+class Subscriber:
+    """
+    Buffer of one stream. When the client is too slow and the buffer is full
+    the buffered events are dropped for one OVERFLOW mark, the stream then
+    reads what it missed from the database.
+    """
+
+    def __init__(self, size: int):
+        self.queue = asyncio.Queue(size)
+
+    def put(self, item: tuple[Change, str]) -> None:
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+    async def get(self, timeout: float) -> tuple[Change, str] | object:
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class ChangesHub:
+    """
+    Reads new changes once per wake up and fans them out to every open stream.
+
+    It is woken up by post_save through ``wake`` in this process and by
+    Postgres NOTIFY from the others (the parsing command). An idle stream
+    costs one coroutine and an empty queue.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.positions = None
+        self.loop = None
+        self._wakeup = None
+        self._task = None
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def wake(self) -> None:
+        """Thread safe, called after a commit"""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._wakeup.set)
+
+    def subscribe(self) -> Subscriber:
+        self._start()
+        subscriber = Subscriber(CLIENT_BUFFER)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    def _start(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.loop is loop and self._task is not None and not self._task.done():
+                return
+            self.loop = loop
+            self._wakeup = asyncio.Event()
+            # streams subscribe before they read the database, so nothing committed after this is lost
+            start = timezone.now() - changes.CHANGES_LAG
+            self.positions = {source: (start, 0) for source in CHANGES_SOURCES}
+            self._task = loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._listen()
+            except Exception:
+                logger.exception('Listening for article changes failed')
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                # a change is visible to the feed CHANGES_LAG after its commit
+                await asyncio.sleep(changes.CHANGES_LAG.total_seconds())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self._fetch()
+            except Exception:
+                logger.exception('Reading article changes failed')
+
+    async def _fetch(self) -> None:
+        has_more = True
+        origins = dict(self.positions)
+        while has_more:
+            page, has_more = await sync_to_async(get_changes)(self.positions, FETCH_LIMIT, origins)
+            for change in page:
+                self.positions[change.source] = change.position
+                data = encode_data(change)
+                for subscriber in list(self.subscribers):
+                    subscriber.put((change, data))
+
+    async def _listen(self) -> None:
+        """
+        LISTEN on a connection of its own, notifications are read on the event loop.
+        The connection is opened in a thread, the streams go on while the database answers.
+        """
+        if self._listener is not None or connections['default'].vendor != 'postgresql':
+            return
+
+        import psycopg2
+        import psycopg2.extensions
+
+        params = connections['default'].get_connection_params()
+
+        def connect():
+            connection = psycopg2.connect(**params)
+            connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            connection.cursor().execute(f'LISTEN {NOTIFY_CHANNEL};')
+            return connection
+
+        listener = await asyncio.to_thread(connect)
+
+        def on_notify():
+            try:
+                listener.poll()
+            except psycopg2.Error:
+                # the connection is gone, the next round of _run listens again
+                self.loop.remove_reader(listener.fileno())
+                listener.close()
+                self._listener = None
+                return
+            if listener.notifies:
+                listener.notifies.clear()
+                self._wakeup.set()
+
+        self.loop.add_reader(listener.fileno(), on_notify)
+        self._listener = listener
+
+
+hub = ChangesHub()
+
+
+def encode_data(change: Change) -> str:
+    return json.dumps(change.data, cls=DjangoJSONEncoder)
+
+
+def format_event(change: Change, data: str, positions: dict[str, tuple[datetime, int]]) -> str:
+    return f'id: {event_id(positions)}\nevent: {change.data["change"]}\ndata: {data}\n\n'
+
+
+async def stream_changes(positions: dict[str, tuple[datetime, int]]):
+    """
+    Server-Sent Events of the changes after positions: first the ones already
+    in the database, then the live ones of the hub. Positions of the stream only
+    move forward, so an event that is both read and received is sent once.
+    """
+    subscriber = hub.subscribe()
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        catch_up = True
+        while True:
+            if catch_up:
+                has_more = True
+                origins = dict(positions)
+                while has_more:
+                    page, has_more = await sync_to_async(get_changes)(positions, FETCH_LIMIT, origins)
+                    for change in page:
+                        positions[change.source] = change.position
+                        yield format_event(change, encode_data(change), positions)
+                catch_up = False
+
+            try:
+                item = await subscriber.get(HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+
+            if item is OVERFLOW:
+                catch_up = True
+                continue
+            change, data = item
+            if change.position > positions[change.source]:
+                positions[change.source] = change.position
+                yield format_event(change, data, positions)
+    finally:
+        hub.unsubscribe(subscriber)
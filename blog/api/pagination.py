@@ -0,0 +1,48 @@
+import base64
+import json
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from django.db.models import Q, QuerySet
+
+CHANGES_SOURCES = ('article', 'parsingarticle')
+
+
+# the origin of a client that read nothing yet, everything is created after it
+BEGINNING = (datetime.min.replace(tzinfo=timezone.utc), 0)
+
+
+class Cursor(NamedTuple):
+    source: str
+    position: tuple[datetime, int]
+    # where the client started reading the pages that lead to the position
+    origin: tuple[datetime, int]
+
+
+def encode_cursor(source: str, updated_date: datetime, pk: int, origin: tuple[datetime, int] | None = None) -> str:
+    fields = [source, updated_date.isoformat(), pk]
+    if origin is not None and origin != (updated_date, pk):
+        fields += [origin[0].isoformat(), origin[1]]
+    raw = json.dumps(fields, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    """Raises ValueError for anything that is not a cursor made by encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        source, updated_date, pk, *origin = json.loads(raw)
+        position = (datetime.fromisoformat(updated_date), pk)
+        origin = (datetime.fromisoformat(origin[0]), origin[1]) if origin else position
+    except (TypeError, ValueError, IndexError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+    if source not in CHANGES_SOURCES or any(
+            not isinstance(pk, int) or date.tzinfo is None for date, pk in (position, origin)):
+        raise ValueError('Invalid cursor')
+    return Cursor(source, position, origin)
+
+
+def after_position(queryset: QuerySet, updated_date: datetime, pk: int) -> QuerySet:
+    """Rows after (updated_date, pk) in (updated_date, id) order, served by the (updated_date, id) index"""
+    return queryset.filter(Q(updated_date__gt=updated_date) | Q(updated_date=updated_date, pk__gt=pk))
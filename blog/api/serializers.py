@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
 from web.models import Article, ParsingArticle, Profile
+from .pagination import decode_cursor
 
 
 class ArticleSerializer(serializers.ModelSerializer):
@@ -56,3 +57,42 @@ class ArticleParamValidationSerializer(serializers.Serializer):
                                        required=False)
     id_to = serializers.IntegerField(error_messages={'invalid': 'Your id_to must be a number'},
                                      required=False)
+
+
+class ArticleChangeSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+    created_date = serializers.DateTimeField(source='publication_date')
+
+    class Meta:
+        model = Article
+        fields = ('id', 'title', 'url', 'created_date', 'updated_date')
+
+    @staticmethod
+    def get_url(obj):
+        return 'http://127.0.0.1:8000/web/article_detail/' + str(obj.id)
+
+
+class ParsingArticleChangeSerializer(serializers.ModelSerializer):
+    title = serializers.CharField(source='headline')
+    created_date = serializers.DateTimeField(source='added_date')
+
+    class Meta:
+        model = ParsingArticle
+        fields = ('id', 'title', 'url', 'created_date', 'updated_date')
+
+
+class ChangesParamValidationSerializer(serializers.Serializer):
+    cursor = serializers.ListField(child=serializers.CharField(), required=False, default=list)
+    limit = serializers.IntegerField(min_value=1, max_value=500, default=100)
+    start = serializers.ChoiceField(choices=('earliest', 'latest'), default='earliest')
+
+    @staticmethod
+    def validate_cursor(value):
+        cursors = {}
+        for cursor in value:
+            try:
+                cursor = decode_cursor(cursor)
+            except ValueError:
+                raise serializers.ValidationError('Invalid cursor')
+            cursors[cursor.source] = cursor
+        return cursors
@@ -0,0 +1,19 @@
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from web.models import Article, ParsingArticle
+from web.signals import articles_added
+from .events import NOTIFY_CHANNEL, hub
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_save, sender=ParsingArticle)
+@receiver(articles_added, sender=ParsingArticle)
+def notify_article_change(sender, **kwargs):
+    """Wake up the change streams of this process and, through Postgres, of the others once the row is committed"""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            # NOTIFY is delivered on commit and only once per transaction
+            cursor.execute('SELECT pg_notify(%s, %s);', [NOTIFY_CHANNEL, ''])
+    transaction.on_commit(hub.wake)
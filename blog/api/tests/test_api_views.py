@@ -1,3 +1,8 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.db import DatabaseError
+from django.utils import timezone
 from parameterized import parameterized
 from rest_framework.test import APITestCase
 from rest_framework import status
@@ -228,3 +233,134 @@ class GetAllArticlesApiTest(APITestCase):
             self.assertEqual(article['id'], result[index]['id'])
             self.assertEqual(article['title'], result[index]['title'])
             self.assertEqual(article['url'], result[index]['url'])
+
+
+class HealthApiTest(APITestCase):
+
+    def test_health_without_token(self):
+        response = self.client.get(reverse('api_health'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'status': 'ok'})
+
+    def test_health_without_database(self):
+        with patch('api.views.connection.cursor', side_effect=DatabaseError):
+            response = self.client.get(reverse('api_health'))
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@patch('api.changes.CHANGES_LAG', timedelta(0))
+class ChangesApiTest(APITestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(avatar='', email='ankar@gmail.com', username='testuser', password='1234')
+        self.token, created = Token.objects.get_or_create(user=self.profile)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+        self.article = Article.objects.create(title='Test title1', content='Test title1', profile=self.profile)
+        self.parsing_article1 = ParsingArticle.objects.create(headline='Medium article1',
+                                                              url='https://medium_article1.com')
+        self.parsing_article2 = ParsingArticle.objects.create(headline='Medium article2',
+                                                              url='https://medium_article2.com')
+
+    def get_changes(self, **params):
+        response = self.client.get(reverse('changes'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_get_changes_without_cursor(self):
+        data = self.get_changes()
+
+        self.assertEqual(
+            [(change['source'], change['title'], change['change']) for change in data['results']],
+            [('article', 'Test title1', 'created'),
+             ('parsingarticle', 'Medium article1', 'created'),
+             ('parsingarticle', 'Medium article2', 'created')]
+        )
+        self.assertFalse(data['has_more'])
+
+    def test_get_changes_pages_by_cursor(self):
+        first_page = self.get_changes(limit=2)
+        second_page = self.get_changes(limit=2, cursor=list(first_page['cursors'].values()))
+
+        self.assertTrue(first_page['has_more'])
+        self.assertEqual([change['title'] for change in second_page['results']], ['Medium article2'])
+        self.assertFalse(second_page['has_more'])
+
+    def test_get_changes_after_update(self):
+        Article.objects.filter(pk=self.article.pk).update(publication_date=timezone.now() - timedelta(days=1))
+        self.article.refresh_from_db()
+        cursors = self.get_changes()['cursors']
+        self.article.content = 'Updated content'
+        self.article.save()
+
+        data = self.get_changes(cursor=list(cursors.values()))
+
+        self.assertEqual([(change['id'], change['change']) for change in data['results']],
+                         [(self.article.id, 'updated')])
+
+    def test_article_created_and_edited_between_two_requests_is_created(self):
+        now = timezone.now()
+        Article.objects.update(publication_date=now - timedelta(minutes=10), updated_date=now - timedelta(minutes=10))
+        ParsingArticle.objects.update(added_date=now - timedelta(minutes=10), updated_date=now - timedelta(minutes=10))
+        cursors = self.get_changes()['cursors']
+        article = Article.objects.create(title='New post', content='New post', profile=self.profile)
+        # the edit a minute after the publication, both before the next request
+        Article.objects.filter(pk=article.pk).update(publication_date=now - timedelta(minutes=2),
+                                                     updated_date=now - timedelta(minutes=1))
+
+        data = self.get_changes(cursor=list(cursors.values()))
+
+        self.assertEqual([(change['title'], change['change']) for change in data['results']],
+                         [('New post', 'created')])
+
+    def test_article_edited_pages_after_its_creation_is_created(self):
+        now = timezone.now()
+        Article.objects.update(publication_date=now - timedelta(minutes=70), updated_date=now - timedelta(minutes=70))
+        ParsingArticle.objects.update(added_date=now - timedelta(minutes=70), updated_date=now - timedelta(minutes=70))
+        cursors = self.get_changes()['cursors']
+        article = Article.objects.create(title='New post', content='New post', profile=self.profile)
+        Article.objects.filter(pk=article.pk).update(publication_date=now - timedelta(minutes=50),
+                                                     updated_date=now - timedelta(minutes=1))
+        for minutes in (40, 39, 38):
+            parsing_article = ParsingArticle.objects.create(headline=f'Y{minutes}', url=f'https://y{minutes}.com')
+            ParsingArticle.objects.filter(pk=parsing_article.pk).update(
+                added_date=now - timedelta(minutes=minutes), updated_date=now - timedelta(minutes=minutes))
+
+        changes, has_more = [], True
+        while has_more:
+            page = self.get_changes(limit=2, cursor=list(cursors.values()))
+            changes += [(change['title'], change['change']) for change in page['results']]
+            cursors, has_more = page['cursors'], page['has_more']
+        Article.objects.filter(pk=article.pk).update(updated_date=now)
+        edited = self.get_changes(limit=2, cursor=list(cursors.values()))
+
+        self.assertEqual(changes, [('Y40', 'created'), ('Y39', 'created'), ('Y38', 'created'),
+                                   ('New post', 'created')])
+        self.assertEqual([(change['title'], change['change']) for change in edited['results']],
+                         [('New post', 'updated')])
+
+    def test_get_changes_from_latest(self):
+        cursors = self.get_changes(start='latest')['cursors']
+        ParsingArticle.objects.create(headline='Medium article3', url='https://medium_article3.com')
+
+        data = self.get_changes(cursor=list(cursors.values()))
+
+        self.assertEqual([change['title'] for change in data['results']], ['Medium article3'])
+
+    @parameterized.expand([
+        ({'cursor': 'not-a-cursor'},),
+        ({'limit': 0},),
+        ({'start': 'middle'},),
+    ])
+    def test_get_changes_with_invalid_parameters(self, query_params):
+        response = self.client.get(reverse('changes'), query_params)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_changes_without_token(self):
+        self.client.credentials()
+
+        response = self.client.get(reverse('changes'))
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
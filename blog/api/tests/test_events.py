@@ -0,0 +1,114 @@
+import asyncio
+import threading
+from datetime import timedelta
+from unittest.mock import Mock, patch
+
+from asgiref.sync import sync_to_async
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.reverse import reverse
+
+from web.models import ParsingArticle, Profile
+from ..changes import Change
+from ..events import OVERFLOW, ChangesHub, Subscriber, event_id, hub, parse_last_event_id
+
+
+class SubscriberTest(SimpleTestCase):
+
+    def test_full_buffer_is_replaced_by_overflow(self):
+        async def fill():
+            subscriber = Subscriber(2)
+            for number in range(3):
+                subscriber.put((Change('article', timezone.now(), number, {}), '{}'))
+            return await subscriber.get(1), subscriber.queue.qsize()
+
+        self.assertEqual(asyncio.run(fill()), (OVERFLOW, 0))
+
+    def test_event_id_round_trip(self):
+        positions = {'article': (timezone.now(), 3), 'parsingarticle': (timezone.now(), 7)}
+
+        self.assertEqual(parse_last_event_id(event_id(positions)), positions)
+        self.assertEqual(parse_last_event_id('broken'), {})
+
+
+class ListenerTest(SimpleTestCase):
+
+    def test_listener_connects_off_the_event_loop(self):
+        threads = {}
+
+        def connect(**params):
+            threads['connect'] = threading.current_thread()
+            return Mock(fileno=Mock(return_value=99))
+
+        async def listen():
+            threads['loop'] = threading.current_thread()
+            changes_hub = ChangesHub()
+            changes_hub.loop = asyncio.get_running_loop()
+            with patch('api.events.connections') as connections, patch('psycopg2.connect', side_effect=connect), \
+                    patch.object(changes_hub.loop, 'add_reader') as add_reader:
+                connections.__getitem__.return_value.vendor = 'postgresql'
+                connections.__getitem__.return_value.get_connection_params.return_value = {}
+                await changes_hub._listen()
+            return changes_hub, add_reader
+
+        changes_hub, add_reader = asyncio.run(listen())
+
+        self.assertIsNot(threads['connect'], threads['loop'])
+        add_reader.assert_called_once()
+        self.assertIsNotNone(changes_hub._listener)
+
+
+@patch('api.changes.CHANGES_LAG', timedelta(0))
+class ChangesStreamTest(TestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(avatar='', email='ankar@gmail.com', username='testuser', password='1234')
+        self.token, created = Token.objects.get_or_create(user=self.profile)
+
+    async def read_events(self, response, count: int) -> list[str]:
+        events = []
+        content = aiter(response.streaming_content)
+        while len(events) < count:
+            chunk = await asyncio.wait_for(anext(content), 5)
+            chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+            if chunk.startswith('id: '):
+                events.append(chunk)
+        await content.aclose()
+        return events
+
+    async def test_stream_without_token(self):
+        response = await self.async_client.get(reverse('changes_stream'))
+
+        self.assertEqual(response.status_code, 401)
+
+    async def test_stream_resumes_after_last_event_id(self):
+        positions = {'article': (timezone.now() - timedelta(days=1), 0),
+                     'parsingarticle': (timezone.now() - timedelta(days=1), 0)}
+        await ParsingArticle.objects.acreate(headline='Medium article1', url='https://medium_article1.com')
+
+        response = await self.async_client.get(
+            reverse('changes_stream'),
+            headers={'Authorization': f'Token {self.token.key}', 'Last-Event-ID': event_id(positions)}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = await self.read_events(response, 1)
+        self.assertIn('event: created', events[0])
+        self.assertIn('"title": "Medium article1"', events[0])
+
+    async def test_stream_sends_new_articles(self):
+        response = await self.async_client.get(
+            reverse('changes_stream'), headers={'Authorization': f'Token {self.token.key}'})
+
+        async def add_article():
+            await asyncio.sleep(0.1)
+            await ParsingArticle.objects.acreate(headline='Medium article2', url='https://medium_article2.com')
+            # TestCase never commits, so wake the hub the way on_commit would
+            await sync_to_async(hub.wake)()
+
+        adding = asyncio.create_task(add_article())
+        events = await self.read_events(response, 1)
+        await adding
+
+        self.assertIn('"title": "Medium article2"', events[0])
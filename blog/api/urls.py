@@ -5,15 +5,21 @@ from .views import (
     ApiArticleDetail,
     ApiLatestArticleDetail,
     ApiLatestParsingArticle,
+    ApiChanges,
+    changes_stream,
     login_view,
-    logout_view
+    logout_view,
+    health_view
 )
 
 urlpatterns = [
     path('login/', login_view, name='api_login'),
     path('logout/', logout_view, name='api_logout'),
+    path('health/', health_view, name='api_health'),
     path('articles/', ApiArticle.as_view(), name='articles'),
     path('article/<pk>/', ApiArticleDetail.as_view(), name='article'),
     path('latest_web_article/', ApiLatestArticleDetail.as_view(), name='latest_web_article'),
     path('latest_parsing_article/', ApiLatestParsingArticle.as_view(), name='latest_parsing_article'),
+    path('changes/', ApiChanges.as_view(), name='changes'),
+    path('changes/stream/', changes_stream, name='changes_stream'),
 ]
\ No newline at end of file
@@ -1,4 +1,8 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth import authenticate, login, logout
+from django.db import DatabaseError, connection
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 from rest_framework import generics, status, permissions
 from rest_framework.views import APIView
 from rest_framework.authentication import TokenAuthentication
@@ -12,8 +16,12 @@ from .serializers import (
     LoginSerializer,
     LatestArticleSerializer,
     ArticleParamValidationSerializer,
-    ParsingArticlesSerializer
+    ParsingArticlesSerializer,
+    ChangesParamValidationSerializer
 )
+from .changes import get_changes, head_positions
+from .events import parse_last_event_id, stream_changes
+from .pagination import BEGINNING, encode_cursor
 from rest_framework.authtoken.models import Token
 
 
@@ -100,6 +108,65 @@ class ApiLatestParsingArticle(APIView):
             return Response({})
 
 
+class ApiChanges(APIView):
+    """
+    Articles created or updated after the given cursors, oldest change first.
+    Every source has its own cursor, a position in (updated_date, id) order.
+    """
+
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        serializer = ChangesParamValidationSerializer(data={
+            'cursor': request.query_params.getlist('cursor'),
+            'limit': request.query_params.get('limit', 100),
+            'start': request.query_params.get('start', 'earliest'),
+        })
+        serializer.is_valid(raise_exception=True)
+        positions = {source: cursor.position for source, cursor in serializer.validated_data['cursor'].items()}
+
+        if serializer.validated_data['start'] == 'latest':
+            cursors = {source: encode_cursor(source, *position)
+                       for source, position in head_positions(positions).items()}
+            return Response({'results': [], 'cursors': cursors, 'has_more': False})
+
+        origins = {source: cursor.origin for source, cursor in serializer.validated_data['cursor'].items()}
+        changes, has_more = get_changes(positions, serializer.validated_data['limit'], origins)
+        for change in changes:
+            positions[change.source] = change.position
+        # the cursors keep the origin until the last page, the next run starts from where it ended
+        cursors = {source: encode_cursor(source, *position, origin=origins.get(source, BEGINNING) if has_more else None)
+                   for source, position in positions.items()}
+
+        return Response({'results': [change.data for change in changes], 'cursors': cursors, 'has_more': has_more})
+
+
+async def get_stream_user(request):
+    """DRF views are sync only, so the stream checks the token (or the session of a browser tab) itself"""
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Token '):
+        token = await Token.objects.select_related('user').filter(key=header.removeprefix('Token ')).afirst()
+        return token.user if token and token.user.is_active else None
+
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+@require_GET
+async def changes_stream(request):
+    """Server-Sent Events of created and updated articles, a reconnect resumes after Last-Event-ID"""
+    if await get_stream_user(request) is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    positions = parse_last_event_id(request.headers.get('Last-Event-ID'))
+    positions = await sync_to_async(head_positions)(positions)
+    response = StreamingHttpResponse(stream_changes(positions), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def login_view(request):
@@ -129,3 +196,15 @@ def logout_view(request):
     logout(request)
     return Response({'message': 'Logout successful'}, status=status.HTTP_200_OK)
 
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@authentication_classes([])
+def health_view(request):
+    """Readiness probe: the app is up and the database answers, no article table is touched"""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1;')
+    except DatabaseError:
+        return Response({'status': 'unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response({'status': 'ok'}, status=status.HTTP_200_OK)
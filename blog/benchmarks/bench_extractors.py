@@ -0,0 +1,73 @@
+"""
+Benchmark of the extraction backends of web.extractors on saved Hacker News pages.
+
+Run from the blog directory:
+    python -m benchmarks.bench_extractors --repeat 200
+
+Every backend runs in a fresh process, so the peak memory of one does not hide
+the other. tracemalloc sees only the Python allocations, the growth of the peak
+RSS also counts the trees libxml2 allocates in C.
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+import tracemalloc
+from pathlib import Path
+
+PAGES = Path(__file__).resolve().parent.parent / 'web' / 'tests' / 'pages'
+URL = 'https://news.ycombinator.com/'
+
+
+def run(backend: str, pages: list[str], repeat: int) -> dict:
+    from web.extractors import EXTRACTORS
+
+    extract = EXTRACTORS[backend]
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # the first run also loads what the backend needs lazily
+    items = sum(len(extract(html, URL)[0]) for html in pages)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for html in pages:
+            extract(html, URL)
+    elapsed = time.perf_counter() - start
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+
+    tracemalloc.start()
+    for html in pages:
+        extract(html, URL)
+    python_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'items': items, 'ms per page': elapsed * 1000 / (repeat * len(pages)),
+            'python peak KB': python_peak / 1024, 'rss growth KB': rss_growth}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTML extraction benchmark')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--backend', action='append', help='backends to run, all by default')
+    parser.add_argument('pages', nargs='*', type=Path, help='saved pages, web/tests/pages by default')
+    args = parser.parse_args()
+
+    from web.extractors import EXTRACTORS
+
+    paths = args.pages or sorted(PAGES.glob('*.html'))
+    pages = [path.read_text() for path in paths]
+    print(f'{len(pages)} pages, {sum(map(len, pages)) / 1024:.0f}KB, {args.repeat} runs')
+    print(f'{"backend":<10} {"items":>6} {"ms per page":>12} {"python peak":>12} {"rss growth":>12}')
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for backend in args.backend or list(EXTRACTORS):
+        with context.Pool(1) as pool:
+            results[backend] = result = pool.apply(run, (backend, pages, args.repeat))
+        print(f'{backend:<10} {result["items"]:>6} {result["ms per page"]:>12.3f} '
+              f'{result["python peak KB"]:>10.0f}KB {result["rss growth KB"]:>10.0f}KB')
+
+    assert len({result['items'] for result in results.values()}) == 1
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Extraction of the articles from Hacker News pages.
+
+Nothing here touches Django, so the parser can run it in worker processes
+that never set Django up.
+
+There are two backends with the same result: `bs4`, the BeautifulSoup
+reference, and `lxml`, which looks the title spans up with one compiled
+XPath on the lxml tree without building the BeautifulSoup one.
+
+The original parser skipped every title without a `sitebit comhead` span,
+the site of the link, so it never took self posts such as Ask HN. With
+`self_posts` off both backends give exactly what it took.
+"""
+from typing import Callable
+from urllib.parse import urljoin
+
+import lxml.html
+from bs4 import BeautifulSoup
+from lxml import etree
+
+MAX_LENGTH = 1000
+
+# (html, base_url, self_posts) -> ((url, headline) items, problems)
+Extractor = Callable[[str, str, bool], tuple[list[tuple[str, str]], list[str]]]
+
+TITLELINES = etree.XPath("//span[contains(concat(' ', normalize-space(@class), ' '), ' titleline ')]")
+# what BeautifulSoup matches for a class with a space: the whole attribute
+SITEBIT = etree.XPath("descendant::span[normalize-space(@class) = 'sitebit comhead']")
+NO_SITEBIT = 'The article cannot be found.The span tag is missing a {"class": "sitebit comhead"}'
+
+
+def check_links(links: list[tuple[str | None, str] | str | None],
+                base_url: str) -> tuple[list[tuple[str, str]], list[str]]:
+    """
+    The items and problems of the (href, text) of the first link of every title span,
+    None for no link or the problem of a title that is skipped.
+    """
+    if not links:
+        return [], ['The array of articles is empty.The span tag is missing a {"class": "titleline"}']
+
+    items, problems = [], []
+    for link in links:
+        if isinstance(link, str):
+            problems.append(link)
+            continue
+        if link is None:
+            problems.append('The article cannot be found.The span tag has no link')
+            continue
+
+        url, headline = link
+        url = urljoin(base_url, url) if url else None
+        if url is None or len(url) > MAX_LENGTH:
+            problems.append('The link is empty or the length exceeds the allowed value.')
+            continue
+
+        if headline is None or len(headline) > MAX_LENGTH:
+            problems.append('The headline is empty or the length exceeds the allowed value')
+            continue
+
+        items.append((url, headline))
+
+    return items, problems
+
+
+def extract_items_bs4(html: str, base_url: str, self_posts: bool = True) -> tuple[list[tuple[str, str]], list[str]]:
+    soup = BeautifulSoup(html, 'lxml')
+    links = []
+    for article in soup.find_all('span', {'class': 'titleline'}):
+        if not self_posts and article.find('span', {'class': 'sitebit comhead'}) is None:
+            links.append(NO_SITEBIT)
+            continue
+        tag_a = article.find('a')
+        links.append(None if tag_a is None else (tag_a.get('href'), tag_a.text))
+    return check_links(links, base_url)
+
+
+def extract_items_lxml(html: str, base_url: str, self_posts: bool = True) -> tuple[list[tuple[str, str]], list[str]]:
+    try:
+        root = lxml.html.document_fromstring(html)
+    except etree.ParserError:
+        # an empty document
+        return check_links([], base_url)
+
+    links = []
+    for article in TITLELINES(root):
+        if not self_posts and not SITEBIT(article):
+            links.append(NO_SITEBIT)
+            continue
+        tag_a = article.find('.//a')
+        links.append(None if tag_a is None else (tag_a.get('href'), tag_a.text_content()))
+    return check_links(links, base_url)
+
+
+EXTRACTORS: dict[str, Extractor] = {'bs4': extract_items_bs4, 'lxml': extract_items_lxml}
+
+
+def extract_items(html: str, base_url: str, backend: str = 'lxml',
+                  self_posts: bool = True) -> tuple[list[tuple[str, str]], list[str]]:
+    """
+    (url, headline) of the articles of a page in page order and the warnings
+    about what was skipped. Links to Hacker News itself, such as Ask HN
+    posts, are made absolute with `base_url`.
+    """
+    return EXTRACTORS[backend](html, base_url, self_posts)
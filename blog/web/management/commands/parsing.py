@@ -1,72 +1,342 @@
+import hashlib
+import multiprocessing
+import os
+import random
+import signal
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Iterator
+from urllib.parse import urljoin, urlsplit
+
 import requests
-from bs4 import BeautifulSoup
 from django.core.management import BaseCommand
+from django.db import DatabaseError, connection, transaction
+from requests.adapters import HTTPAdapter
 
+from web.extractors import extract_items
 from web.parsinglog import logger
 from web.models import ParsingArticle
+from web.signals import articles_added
 
 URL = 'https://news.ycombinator.com/'
+# news is paged (news?p=2, ...), the other sections are crawled on their first page
+SECTIONS = os.environ.get('PARSING_SECTIONS', 'news,newest,show,ask').split(',')
+NEWS_PAGES = int(os.environ.get('PARSING_NEWS_PAGES', 3))
+FETCH_WORKERS = int(os.environ.get('PARSING_FETCH_WORKERS', 8))
+# 0 parses in the fetching process
+PARSE_WORKERS = int(os.environ.get('PARSING_PARSE_WORKERS', min(4, os.cpu_count() or 1)))
+# politeness: requests in flight to one host and seconds between their starts
+HOST_CONCURRENCY = int(os.environ.get('PARSING_HOST_CONCURRENCY', 4))
+HOST_INTERVAL = float(os.environ.get('PARSING_HOST_INTERVAL', 0.2))
+# lxml, or bs4 for the BeautifulSoup reference, see web.extractors
+EXTRACTOR = os.environ.get('PARSING_EXTRACTOR', 'lxml')
+# (connect, read) seconds
+TIMEOUT = (5, 20)
+# key of the Postgres advisory lock only one parser daemon holds
+LOCK_KEY = 7_000_021
+INTERVAL = int(os.environ.get('PARSING_INTERVAL', 300))
+JITTER = 0.1
+
+# one keep-alive session with a connection pool shared by the fetch threads, the daemon keeps it between runs
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_WORKERS))
+session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_WORKERS))
+
+
+class HostLimiter:
+    """At most `concurrency` requests to one host at a time, their starts at least `interval` seconds apart"""
+
+    def __init__(self, concurrency: int, interval: float):
+        self.concurrency = concurrency
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_start = {}
+
+    @contextmanager
+    def slot(self, host: str) -> Iterator[None]:
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.BoundedSemaphore(self.concurrency))
+        with semaphore:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start.get(host, 0.0))
+                self._next_start[host] = start + self.interval
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+
+host_limiter = HostLimiter(HOST_CONCURRENCY, HOST_INTERVAL)
+_parse_pool = None
+
+
+def parse_pool() -> ProcessPoolExecutor | None:
+    """Worker processes for the HTML parsing, started once and kept by the daemon"""
+    global _parse_pool
+    if _parse_pool is None and PARSE_WORKERS > 0:
+        # spawn: forking the threads of the fetch pool and the Django connection is not safe
+        _parse_pool = ProcessPoolExecutor(PARSE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _parse_pool
+
+
+def shutdown_parse_pool() -> None:
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(cancel_futures=True)
+        _parse_pool = None
 
 
-def get_html(url: str) -> str:
-    response = requests.get(url)
+def crawl_urls(sections: list[str], news_pages: int) -> list[str]:
+    """Pages to crawl, the front page first so its headline wins for a URL that is on several pages"""
+    urls = []
+    for section in sections:
+        if section == 'news':
+            urls.extend(urljoin(URL, f'news?p={page}') for page in range(1, news_pages + 1))
+        elif section:
+            urls.append(urljoin(URL, section))
+    return urls
+
+
+@dataclass(frozen=True)
+class PageState:
+    """What the last saved crawl of a page saw: its validators and hashes of the HTML and of the items"""
+    etag: str | None = None
+    last_modified: str | None = None
+    html_hash: str | None = None
+    fingerprint: str | None = None
+
+
+# url -> PageState, the daemon keeps them between runs
+page_states: dict[str, PageState] = {}
+# pages not_modified (304), unchanged (same HTML or items) or changed, runs and runs_skipped since the start
+crawl_stats = Counter()
+
+
+def fingerprint(value) -> str:
+    return hashlib.blake2b(repr(value).encode(), digest_size=16).hexdigest()
+
+
+def get_html(url: str, state: PageState | None = None) -> tuple[str | None, PageState | None]:
+    """
+    Conditional GET with the validators of `state`. Returns the page and the state with the
+    new validators, (None, state) when the page is not modified or (None, None) on an error.
+    """
+    state = state or PageState()
+    headers = {}
+    if state.etag:
+        headers['If-None-Match'] = state.etag
+    if state.last_modified:
+        headers['If-Modified-Since'] = state.last_modified
+    try:
+        with host_limiter.slot(urlsplit(url).hostname):
+            response = session.get(url, timeout=TIMEOUT, headers=headers)
+    except requests.RequestException as e:
+        logger.error(f'{url} did not answer: {e!r}')
+        return None, None
+
+    if response.status_code == 304:
+        return None, state
     if response.status_code == 200:
-        return response.text
+        return response.text, replace(
+            state, etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
 
     logger.error(f'{url} returned the code {response.status_code}')
+    return None, None
 
 
-def get_data(html: str) -> None:
-    soup = BeautifulSoup(html, 'lxml')
-    articles = soup.find_all('span', {'class': 'titleline'})
-    if not articles:
-        logger.warning('The array of articles is empty.'
-                       'The span tag is missing a {"class": "titleline"}')
-        return
+def save_articles(items: dict[str, str]) -> list[str]:
+    """
+    Insert the url -> headline articles that are not in the database yet with one
+    lookup and one insert in a single transaction, returns the URLs it added.
+    """
+    with transaction.atomic():
+        existing = set(ParsingArticle.objects.filter(url__in=items).values_list('url', flat=True))
+        # the advisory lock keeps other parsers out, so every one of them is inserted here or
+        # the batch fails on the unique URL and the next run, which looks them up again, retries it
+        new_articles = ParsingArticle.objects.bulk_create([
+            ParsingArticle(url=url, headline=headline) for url, headline in items.items() if url not in existing
+        ])
+        if new_articles:
+            # the change streams are woken up once for the batch
+            articles_added.send(sender=ParsingArticle, articles=new_articles)
 
-    for article in articles:
-        article_from_site = article.find('span', {'class': 'sitebit comhead'})
-        if article_from_site is None:
-            logger.warning('The article cannot be found.'
-                           'The span tag is missing a {"class": "sitebit comhead"}')
-            continue
+    return [parsing_article.url for parsing_article in new_articles]
 
-        tag_a = article.find('a')
 
-        url = tag_a.get('href')
-        if url is None or len(url) > 1000:
-            logger.info('The link is empty or the length exceeds the allowed value.')
-            continue
+def crawl(urls: list[str]) -> tuple[dict[str, str], dict[str, PageState]]:
+    """
+    Fetch the pages in a thread pool and parse every page in the process pool as
+    soon as it is there. Pages the site reports not modified, with the same HTML
+    or the same items as the last time are left out. Returns url -> headline of
+    the articles of the other pages and the new states of all pages that answered.
+    """
+    states: dict[str, PageState] = {}
+    parsed: dict[str, Future | tuple] = {}
+    pool = parse_pool()
+    with ThreadPoolExecutor(FETCH_WORKERS) as fetchers:
+        fetches = {fetchers.submit(get_html, url, page_states.get(url)): url for url in urls}
+        for fetch in as_completed(fetches):
+            url = fetches[fetch]
+            html, state = fetch.result()
+            if state is None:
+                continue
+            if html is None:
+                crawl_stats['not_modified'] += 1
+                states[url] = state
+                continue
 
-        headline = tag_a.text
-        if headline is None or len(headline) > 1000:
-            logger.info('The headline is empty or the length exceeds the allowed value')
-            continue
+            html_hash = fingerprint(html)
+            if html_hash == state.html_hash:
+                crawl_stats['unchanged'] += 1
+                states[url] = state
+                continue
+            states[url] = replace(state, html_hash=html_hash)
+            parsed[url] = (pool.submit(extract_items, html, url, EXTRACTOR) if pool
+                           else extract_items(html, url, EXTRACTOR))
 
-        try:
-            parsing_article, created = ParsingArticle.objects.get_or_create(
-                url=url,
-                defaults={'headline': headline}
-            )
-            if created:
-                logger.info(f'Added new article {url}')
+    items = {}
+    for url in urls:
+        if url not in parsed:
+            continue
+        page_items, problems = parsed[url].result() if isinstance(parsed[url], Future) else parsed[url]
+        for problem in problems:
+            logger.warning(f'{url}: {problem}')
 
-        except Exception:
-            logger.exception('Article adding error to database')
+        items_hash = fingerprint(page_items)
+        if items_hash == states[url].fingerprint:
+            crawl_stats['unchanged'] += 1
+            continue
+        states[url] = replace(states[url], fingerprint=items_hash)
+        crawl_stats['changed'] += 1
+        for article_url, headline in page_items:
+            items.setdefault(article_url, headline)
+    return items, states
 
 
 def main():
     logger.info('RUN SITE PARSING')
-    html = get_html(URL)
+    start = time.monotonic()
+    urls = crawl_urls(SECTIONS, NEWS_PAGES)
+    items, states = crawl(urls)
+    crawl_stats['runs'] += 1
+    if items:
+        added = save_articles(items)
+        for url in added:
+            logger.info(f'Added new article {url}')
+    else:
+        added = []
+        crawl_stats['runs_skipped'] += 1
+    # remembered only once the articles are saved, a failed run is not skipped the next time
+    page_states.update(states)
+    logger.info(f'Crawled {len(urls)} pages, {len(items)} articles, {len(added)} new '
+                f'in {time.monotonic() - start:.1f}s; since the start: {dict(crawl_stats)}')
+
+
+def try_lock() -> bool:
+    """Take the advisory lock for the session of the database connection, without waiting"""
+    if connection.vendor != 'postgresql':
+        return True
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s);', [LOCK_KEY])
+        return cursor.fetchone()[0]
+
+
+def unlock() -> None:
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s);', [LOCK_KEY])
+
+
+class Daemon:
+    """
+    Parses the site every `interval` seconds give or take `jitter` of it, in one
+    process that keeps Django, the database connection and the HTTP session warm.
 
-    if html is not None:
-        get_data(html)
+    Only the holder of a Postgres advisory lock parses, another daemon waits as a
+    standby and takes over once the lock is free. SIGTERM or SIGINT stop the
+    loop between two runs, a run in progress is bounded by the request timeout.
+    """
+
+    def __init__(self, interval: float, jitter: float):
+        self.interval = interval
+        self.jitter = jitter
+        self.stopping = threading.Event()
+        self.locked = False
+
+    def stop(self, signum, frame) -> None:
+        logger.info(f'Parser daemon got signal {signum}, stopping')
+        self.stopping.set()
+
+    def next_delay(self, elapsed: float) -> float:
+        return max(0.0, self.interval * random.uniform(1 - self.jitter, 1 + self.jitter) - elapsed)
+
+    def run_once(self) -> None:
+        try:
+            if self.locked and (connection.connection is None or not connection.is_usable()):
+                logger.warning('The database connection was lost and the lock with it')
+                connection.close()
+                self.locked = False
+            if not self.locked:
+                self.locked = try_lock()
+                if not self.locked:
+                    logger.info('Another parser daemon holds the lock, waiting')
+                    return
+            main()
+        except DatabaseError:
+            # the lock went away with the session, the next run connects and takes it again
+            logger.exception('Database error, reconnecting')
+            connection.close()
+            self.locked = False
+        except Exception:
+            logger.exception('Parsing failed')
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logger.info(f'Parser daemon started, every {self.interval}s')
+        try:
+            while not self.stopping.is_set():
+                start = time.monotonic()
+                self.run_once()
+                self.stopping.wait(self.next_delay(time.monotonic() - start))
+        finally:
+            if self.locked:
+                try:
+                    unlock()
+                except DatabaseError:
+                    pass
+            connection.close()
+            session.close()
+            shutdown_parse_pool()
+            logger.info('Parser daemon stopped')
 
 
 class Command(BaseCommand):
     help = 'Parsing articles "https://news.ycombinator.com/"'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--daemon', action='store_true', help='stay resident and parse periodically')
+        parser.add_argument('--interval', type=float, default=INTERVAL, help='seconds between two runs')
+        parser.add_argument('--jitter', type=float, default=JITTER, help='random share of the interval')
+
     def handle(self, *args, **options):
-        main()
+        if options['daemon']:
+            Daemon(options['interval'], options['jitter']).run()
+            return
+
+        # a run by hand must not overlap the daemon
+        if not try_lock():
+            self.stdout.write(self.style.WARNING('Another parser holds the lock, nothing was parsed'))
+            return
+        try:
+            main()
+        finally:
+            unlock()
+            shutdown_parse_pool()
         self.stdout.write(self.style.SUCCESS('Parsing articles'))
 
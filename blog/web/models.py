@@ -13,10 +13,12 @@ class Article(models.Model):
     title = models.CharField(max_length=120, unique=True)
     content = models.TextField()
     publication_date = models.DateTimeField(auto_now_add=True)
+    updated_date = models.DateTimeField(auto_now=True)
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE)
 
     class Meta:
         ordering = ['-publication_date']
+        indexes = [models.Index(fields=['updated_date', 'id'])]
 
     def __str__(self):
         return f'Article of {self.title}'
@@ -26,4 +28,7 @@ class ParsingArticle(models.Model):
     headline = models.CharField(max_length=1000)
     url = models.URLField(max_length=1000, unique=True)
     added_date = models.DateTimeField(auto_now_add=True)
+    updated_date = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['updated_date', 'id'])]
@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# sent once for the ParsingArticle rows a bulk_create added, bulk_create sends no post_save
+articles_added = Signal()
@@ -0,0 +1,105 @@
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+from django.test import SimpleTestCase
+
+from ..extractors import EXTRACTORS, extract_items
+
+PAGES = Path(__file__).parent / 'pages'
+URL = 'https://news.ycombinator.com/'
+
+EDGE_CASES = {
+    'nested tags and entities': '''
+        <span class="titleline"><a href="https://example.com/a"><i>Rust</i> &amp; <b>C</b>&nbsp;FFI</a>
+        <span class="sitebit comhead"> (<a href="from?site=example.com">example.com</a>)</span></span>''',
+    'relative link without a sitebit': '<span class="titleline"><a href="item?id=1">Ask HN: Why?</a></span>',
+    'class among others': '<span class=" big  titleline\n"><a href="https://example.com/b">B</a></span>',
+    'similar class only': '<span class="titlelines"><a href="https://example.com/c">C</a></span>',
+    'span without a link': '<span class="titleline">No link</span><span class="titleline"><a href="/d">D</a></span>',
+    'empty link': '<span class="titleline"><a href="">Empty</a></span><span class="titleline"><a>None</a></span>',
+    'too long headline': f'<span class="titleline"><a href="https://example.com/e">{"e" * 1001}</a></span>',
+    'no articles': '<html><body><table id="hnmain"></table></body></html>',
+    'empty document': '',
+}
+
+
+def baseline_get_data(html: str) -> tuple[list[tuple[str, str]], list[str]]:
+    """get_data of the parser before the extractors, what it logged and saved collected instead"""
+    items, problems = [], []
+    soup = BeautifulSoup(html, 'lxml')
+    articles = soup.find_all('span', {'class': 'titleline'})
+    if not articles:
+        problems.append('The array of articles is empty.'
+                        'The span tag is missing a {"class": "titleline"}')
+        return items, problems
+
+    for article in articles:
+        article_from_site = article.find('span', {'class': 'sitebit comhead'})
+        if article_from_site is None:
+            problems.append('The article cannot be found.'
+                            'The span tag is missing a {"class": "sitebit comhead"}')
+            continue
+
+        tag_a = article.find('a')
+
+        url = tag_a.get('href')
+        if url is None or len(url) > 1000:
+            problems.append('The link is empty or the length exceeds the allowed value.')
+            continue
+
+        headline = tag_a.text
+        if headline is None or len(headline) > 1000:
+            problems.append('The headline is empty or the length exceeds the allowed value')
+            continue
+
+        items.append((url, headline))
+    return items, problems
+
+
+class BaselineParserTest(SimpleTestCase):
+
+    def test_saved_pages(self):
+        skipped = 0
+        for path in sorted(PAGES.glob('*.html')):
+            html = path.read_text()
+            baseline = baseline_get_data(html)
+            skipped += len(baseline[1])
+            for backend, extract in EXTRACTORS.items():
+                with self.subTest(page=path.name, backend=backend):
+                    self.assertEqual(extract(html, URL + path.stem, False), baseline)
+        # the pages have self posts the baseline skipped
+        self.assertGreater(skipped, 0)
+
+    def test_edge_cases(self):
+        for case, html in EDGE_CASES.items():
+            for backend, extract in EXTRACTORS.items():
+                with self.subTest(case=case, backend=backend):
+                    self.assertEqual(extract(html, URL, False), baseline_get_data(html))
+
+
+class ExtractorParityTest(SimpleTestCase):
+
+    def test_saved_pages(self):
+        for path in sorted(PAGES.glob('*.html')):
+            html = path.read_text()
+            with self.subTest(page=path.name):
+                reference = EXTRACTORS['bs4'](html, URL + path.stem)
+
+                self.assertEqual(EXTRACTORS['lxml'](html, URL + path.stem), reference)
+                self.assertGreaterEqual(len(reference[0]), 10)
+                self.assertEqual(reference[1], [])
+
+    def test_edge_cases(self):
+        for case, html in EDGE_CASES.items():
+            with self.subTest(case=case):
+                self.assertEqual(EXTRACTORS['lxml'](html, URL), EXTRACTORS['bs4'](html, URL))
+
+    def test_items(self):
+        self.assertEqual(extract_items(EDGE_CASES['nested tags and entities'], URL),
+                         ([('https://example.com/a', 'Rust & C\xa0FFI')], []))
+        self.assertEqual(extract_items(EDGE_CASES['relative link without a sitebit'], URL),
+                         ([('https://news.ycombinator.com/item?id=1', 'Ask HN: Why?')], []))
+        self.assertEqual(extract_items(EDGE_CASES['span without a link'], URL),
+                         ([('https://news.ycombinator.com/d', 'D')],
+                          ['The article cannot be found.The span tag has no link']))
+        self.assertEqual(extract_items(EDGE_CASES['similar class only'], URL)[0], [])
@@ -0,0 +1,243 @@
+import signal
+import threading
+import time
+from io import StringIO
+from unittest.mock import Mock, patch
+
+import requests
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..management.commands import parsing
+from ..models import ParsingArticle
+
+HTML = '''
+<span class="titleline"><a href="https://example.com/a">Article A</a>
+<span class="sitebit comhead"><a href="from?site=example.com">example.com</a></span></span>
+'''
+
+
+class GetHtmlTest(TestCase):
+
+    def test_timeout_gives_none(self):
+        with patch.object(parsing.session, 'get', side_effect=requests.Timeout) as get:
+            self.assertEqual(parsing.get_html(parsing.URL), (None, None))
+
+        self.assertEqual(get.call_args.kwargs['timeout'], parsing.TIMEOUT)
+
+    def test_validators_are_sent_back(self):
+        response = Mock(status_code=200, text=HTML, headers={'ETag': '"v1"', 'Last-Modified': 'Sat, 17 Oct 2026'})
+        with patch.object(parsing.session, 'get', return_value=response):
+            html, state = parsing.get_html(parsing.URL)
+
+        with patch.object(parsing.session, 'get', return_value=Mock(status_code=304, headers={})) as get:
+            self.assertEqual(parsing.get_html(parsing.URL, state), (None, state))
+
+        self.assertEqual(html, HTML)
+        self.assertEqual(get.call_args.kwargs['headers'],
+                         {'If-None-Match': '"v1"', 'If-Modified-Since': 'Sat, 17 Oct 2026'})
+
+
+class CrawlTest(TestCase):
+
+    def fake_get(self, delay: float):
+        def get(url, timeout, headers):
+            time.sleep(delay)
+            number = url.rsplit('=', 1)[-1]
+            return Mock(status_code=200, text=HTML.replace('/a"', f'/{number}"'), headers={})
+        return get
+
+    def test_crawl_urls(self):
+        self.assertEqual(parsing.crawl_urls(['news', 'newest', 'ask'], 2), [
+            'https://news.ycombinator.com/news?p=1', 'https://news.ycombinator.com/news?p=2',
+            'https://news.ycombinator.com/newest', 'https://news.ycombinator.com/ask'])
+
+    @patch.object(parsing, 'PARSE_WORKERS', 0)
+    @patch.object(parsing, 'host_limiter', parsing.HostLimiter(concurrency=8, interval=0))
+    def test_pages_are_fetched_concurrently(self):
+        urls = [f'https://news.ycombinator.com/news?p={page}' for page in range(1, 7)]
+
+        with patch.object(parsing.session, 'get', side_effect=self.fake_get(0.2)):
+            start = time.monotonic()
+            items, _ = parsing.crawl(urls)
+            elapsed = time.monotonic() - start
+
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(list(items), [f'https://example.com/{page}' for page in range(1, 7)])
+
+    @patch.object(parsing, 'PARSE_WORKERS', 2)
+    def test_pages_are_parsed_in_worker_processes(self):
+        urls = ['https://news.ycombinator.com/news?p=1', 'https://news.ycombinator.com/news?p=2']
+
+        try:
+            with patch.object(parsing.session, 'get', side_effect=self.fake_get(0)):
+                items, _ = parsing.crawl(urls)
+        finally:
+            parsing.shutdown_parse_pool()
+
+        self.assertEqual(items, {'https://example.com/1': 'Article A', 'https://example.com/2': 'Article A'})
+
+    def test_host_limiter_spaces_the_starts(self):
+        limiter = parsing.HostLimiter(concurrency=2, interval=0.05)
+        starts = []
+
+        def request():
+            with limiter.slot('news.ycombinator.com'):
+                starts.append(time.monotonic())
+
+        threads = [threading.Thread(target=request) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        starts.sort()
+        self.assertGreaterEqual(starts[2] - starts[0], 0.09)
+
+
+@patch.object(parsing, 'SECTIONS', ['news'])
+@patch.object(parsing, 'NEWS_PAGES', 1)
+@patch.object(parsing, 'PARSE_WORKERS', 0)
+class UnchangedPagesTest(TestCase):
+
+    def setUp(self):
+        parsing.page_states.clear()
+        parsing.crawl_stats.clear()
+        self.addCleanup(parsing.page_states.clear)
+        self.addCleanup(parsing.crawl_stats.clear)
+
+    def run_main(self, *responses):
+        with patch.object(parsing.session, 'get', side_effect=responses), \
+                CaptureQueriesContext(connection) as queries:
+            parsing.main()
+        return queries
+
+    def test_not_modified_page_skips_the_database(self):
+        self.run_main(Mock(status_code=200, text=HTML, headers={'ETag': '"v1"'}))
+
+        queries = self.run_main(Mock(status_code=304, headers={}))
+
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(parsing.crawl_stats['not_modified'], 1)
+        self.assertEqual(parsing.crawl_stats['runs_skipped'], 1)
+
+    def test_same_articles_in_other_html_skip_the_database(self):
+        self.run_main(Mock(status_code=200, text=HTML, headers={}))
+
+        queries = self.run_main(Mock(status_code=200, text=HTML.replace('<span', '<span data-rank="1"', 1), headers={}))
+
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(parsing.crawl_stats['unchanged'], 1)
+        self.assertEqual(ParsingArticle.objects.count(), 1)
+
+    def test_page_of_a_failed_save_is_parsed_again(self):
+        with patch.object(parsing, 'save_articles', side_effect=DatabaseError), self.assertRaises(DatabaseError):
+            self.run_main(Mock(status_code=200, text=HTML, headers={}))
+
+        self.run_main(Mock(status_code=200, text=HTML, headers={}))
+
+        self.assertEqual(ParsingArticle.objects.get().headline, 'Article A')
+
+
+class SaveArticlesTest(TestCase):
+
+    def test_only_new_urls_are_inserted_with_two_queries(self):
+        ParsingArticle.objects.create(url='https://example.com/old', headline='Old')
+        items = {'https://example.com/old': 'Old again', 'https://example.com/new1': 'New 1',
+                 'https://example.com/new2': 'New 2'}
+
+        with CaptureQueriesContext(connection) as queries, \
+                patch('api.signals.hub.wake') as wake, self.captureOnCommitCallbacks(execute=True):
+            added = parsing.save_articles(items)
+
+        self.assertEqual(added, ['https://example.com/new1', 'https://example.com/new2'])
+        self.assertEqual(len([query for query in queries if 'web_parsingarticle' in query['sql']]), 2)
+        self.assertEqual(ParsingArticle.objects.get(url='https://example.com/old').headline, 'Old')
+        self.assertEqual(ParsingArticle.objects.count(), 3)
+        wake.assert_called_once()
+
+    def test_nothing_new(self):
+        ParsingArticle.objects.create(url='https://example.com/old', headline='Old')
+
+        with patch('api.signals.hub.wake') as wake, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(parsing.save_articles({'https://example.com/old': 'Old'}), [])
+        wake.assert_not_called()
+
+    def test_url_added_meanwhile_fails_the_batch(self):
+        items = {'https://example.com/new1': 'New 1', 'https://example.com/new2': 'New 2'}
+        ParsingArticle.objects.create(url='https://example.com/new2', headline='Meanwhile')
+
+        # the lookup ran before another writer added the URL
+        with patch.object(ParsingArticle.objects, 'filter', return_value=Mock(values_list=Mock(return_value=[]))), \
+                self.assertRaises(IntegrityError):
+            parsing.save_articles(items)
+
+        self.assertEqual(parsing.save_articles(items), ['https://example.com/new1'])
+        self.assertEqual(ParsingArticle.objects.get(url='https://example.com/new2').headline, 'Meanwhile')
+
+
+class ParsingDaemonTest(TestCase):
+
+    def setUp(self):
+        self.handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT)}
+
+    def tearDown(self):
+        for signum, handler in self.handlers.items():
+            signal.signal(signum, handler)
+
+    @patch.object(parsing, 'SECTIONS', ['news'])
+    @patch.object(parsing, 'NEWS_PAGES', 1)
+    @patch.object(parsing, 'PARSE_WORKERS', 0)
+    def test_daemon_parses_until_sigterm(self):
+        runs = []
+
+        def get_html(url, state):
+            runs.append(url)
+            if len(runs) == 2:
+                # what the signal handler does when docker stops the container
+                signal.raise_signal(signal.SIGTERM)
+            return HTML, parsing.PageState()
+
+        with patch.object(parsing, 'get_html', side_effect=get_html):
+            call_command('parsing', '--daemon', '--interval', '0')
+
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(ParsingArticle.objects.get().headline, 'Article A')
+
+    def test_run_by_hand_waits_for_no_daemon(self):
+        with patch.object(parsing, 'try_lock', return_value=False), patch.object(parsing, 'main') as main:
+            call_command('parsing', stdout=StringIO())
+
+        main.assert_not_called()
+
+    def test_run_by_hand_releases_the_lock(self):
+        with patch.object(parsing, 'try_lock', return_value=True), patch.object(parsing, 'unlock') as unlock, \
+                patch.object(parsing, 'main') as main:
+            call_command('parsing', stdout=StringIO())
+
+        main.assert_called_once()
+        unlock.assert_called_once()
+
+    def test_failed_run_does_not_stop_the_daemon(self):
+        daemon = parsing.Daemon(interval=0, jitter=0)
+        calls = []
+
+        def main():
+            calls.append(1)
+            if len(calls) == 1:
+                raise ValueError
+            daemon.stopping.set()
+
+        with patch.object(parsing, 'main', side_effect=main):
+            daemon.run()
+
+        self.assertEqual(len(calls), 2)
+
+    def test_jitter_keeps_the_delay_around_the_interval(self):
+        daemon = parsing.Daemon(interval=100, jitter=0.1)
+
+        delays = [daemon.next_delay(elapsed=10) for _ in range(100)]
+
+        self.assertTrue(all(80 <= delay <= 100 for delay in delays))
@@ -0,0 +1,90 @@
+import threading
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from botlog import logger
+from settings import api_base_url, api_username, api_password
+from work_with_db import get_api_token, save_api_token, delete_api_token
+
+
+class BlogApiClient:
+    """
+    Client for the blog REST API.
+
+    Keeps one keep-alive session for all requests and logs in only when there is
+    no token yet or the blog answers 401, the token is remembered in memory and
+    in the bot database so a restart does not cost a new login.
+    """
+
+    def __init__(self, base_url: str, username: str, password: str, timeout: float = 10):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json; charset=utf-8"})
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=10))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=10))
+        self._token = None
+        self._lock = threading.Lock()
+
+    def _get_token(self) -> str | None:
+        if self._token is None:
+            with self._lock:
+                if self._token is None:
+                    self._token = get_api_token(self.base_url) or self.login()
+        return self._token
+
+    def login(self) -> str | None:
+        try:
+            response = self.session.post(
+                urljoin(self.base_url, 'login/'),
+                json={'username': self.username, 'password': self.password},
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            logger.error(f'Login to the blog API failed: {e!r}')
+            return None
+        if response.status_code != 200:
+            logger.error(f'Login to the blog API failed with the code {response.status_code}')
+            return None
+
+        token = f'Token {response.json().get("token")}'
+        save_api_token(self.base_url, token)
+        return token
+
+    def _relogin(self, stale_token: str | None) -> str | None:
+        with self._lock:
+            if self._token == stale_token:
+                delete_api_token(self.base_url)
+                self._token = self.login()
+        return self._token
+
+    def get(self, path: str, params: dict | None = None) -> requests.Response:
+        url = urljoin(self.base_url, path)
+        token = self._get_token()
+        response = self.session.get(url, params=params, headers={"Authorization": token}, timeout=self.timeout)
+        if response.status_code == 401:
+            token = self._relogin(token)
+            response = self.session.get(url, params=params, headers={"Authorization": token}, timeout=self.timeout)
+        return response
+
+    def is_ready(self) -> bool:
+        """The blog answers its health check, no token is needed for it"""
+        try:
+            response = self.session.get(urljoin(self.base_url, 'health/'), timeout=self.timeout)
+        except requests.RequestException:
+            return False
+        return response.status_code == 200
+
+    def get_json(self, path: str, params: dict | None = None) -> dict | list | None:
+        response = self.get(path, params)
+        if response.status_code == 200:
+            return response.json()
+
+        logger.error(f'{response.url} returned the code {response.status_code}')
+
+
+api_client = BlogApiClient(api_base_url, api_username, api_password)
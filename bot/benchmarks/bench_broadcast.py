@@ -0,0 +1,189 @@
+"""
+Offline load test of one send_new_articles_to_user cycle against fake
+Telegram and blog servers.
+
+Run from the bot directory:
+    python -m benchmarks.bench_broadcast --subscribers 100000 --output results.json
+
+With --processes N the outbox is drained by N delivery processes that share
+the shards of the database file, the way BOT_ROLE=delivery workers do.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.request import urlopen
+
+from benchmarks import fake_servers
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def drain_worker(number: int, telegram_port: int, barrier) -> None:
+    """One delivery process: take a fair share of the shards once all of them are up and drain it"""
+    os.environ['WORKER_ID'] = f'bench-{number}'
+    from telebot import asyncio_helper
+
+    from broadcaster import broadcaster
+    from scheduled_tasks import drain_outbox, leases
+    from settings import broadcast_rate, delivery_shards
+    from shards import WORKER_LEASE
+    from work_with_db import acquire_leases
+
+    asyncio_helper.API_URL = f'http://127.0.0.1:{telegram_port}/bot{{0}}/{{1}}'
+    now = time.time()
+    acquire_leases([f'{WORKER_LEASE}{leases.owner}'], leases.owner, now + leases.ttl, now)
+    barrier.wait()
+    leases.refresh()
+    broadcaster.limiter.set_rate(broadcast_rate * len(leases.owned) / delivery_shards)
+
+    async def drain():
+        await drain_outbox()
+        await asyncio_helper.session_manager.session.close()
+
+    asyncio.run(drain())
+
+
+def run_workers(processes: int, telegram_port: int) -> None:
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(processes)
+    workers = [context.Process(target=drain_worker, args=(number, telegram_port, barrier))
+               for number in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+async def run_cycle(telegram_port: int, blog_port: int, processes: int) -> dict:
+    from telebot import asyncio_helper
+
+    from api_client import api_client
+    from scheduled_tasks import drain_outbox, leases, seed_cursors, send_new_articles_to_user
+    from database import get_connection
+    from work_with_db import count_pending_messages
+
+    asyncio_helper.API_URL = f'http://127.0.0.1:{telegram_port}/bot{{0}}/{{1}}'
+    api_client.base_url = f'http://127.0.0.1:{blog_port}/api/'
+    leases.refresh()
+    await seed_cursors()
+
+    start = time.perf_counter()
+    await send_new_articles_to_user()
+    enqueued = time.perf_counter()
+    queued = count_pending_messages()
+    if processes > 1:
+        leases.release()
+        await asyncio.to_thread(run_workers, processes, telegram_port)
+    else:
+        await drain_outbox()
+    finished = time.perf_counter()
+    if asyncio_helper.session_manager.session:
+        await asyncio_helper.session_manager.session.close()
+    sent = get_connection().execute("SELECT COUNT(*) FROM outbox WHERE status = 'sent';").fetchone()[0]
+    deactivated = get_connection().execute('SELECT COUNT(*) FROM users WHERE active = 0;').fetchone()[0]
+
+    return {
+        'messages_queued': queued,
+        'messages_sent': sent,
+        'messages_left': count_pending_messages(),
+        'users_deactivated': deactivated,
+        'enqueue_seconds': round(enqueued - start, 3),
+        'send_seconds': round(finished - enqueued, 3),
+        'cycle_seconds': round(finished - start, 3),
+        'messages_per_second': round(sent / (finished - enqueued), 1) if finished > enqueued else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bot broadcast load test against fake servers')
+    parser.add_argument('--subscribers', type=int, default=10_000)
+    parser.add_argument('--articles', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per Telegram request')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--blocked-rate', type=float, default=0.01, help='share of chats that blocked the bot')
+    parser.add_argument('--workers', type=int, default=64)
+    parser.add_argument('--rate', type=float, default=1000, help='messages per second the bot allows itself')
+    parser.add_argument('--processes', type=int, default=1, help='delivery processes sharing the outbox')
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument('--digest', action='store_true')
+    parser.add_argument('--output', help='JSON file for the results, printed to stdout as well')
+    args = parser.parse_args()
+
+    behaviour = fake_servers.TelegramBehaviour(
+        latency=args.latency, jitter=args.jitter, flood_rate=args.flood_rate,
+        retry_after=args.retry_after, blocked_rate=args.blocked_rate
+    )
+    process, telegram_port, blog_port = fake_servers.start(behaviour, args.articles)
+
+    directory = tempfile.mkdtemp()
+    os.environ.update({
+        'DB_NAME': os.path.join(directory, 'bench.db'),
+        'TELEGRAM_TOKEN': '123456:benchmark',
+        'HOST': '127.0.0.1',
+        'BROADCAST_WORKERS': str(args.workers),
+        'BROADCAST_RATE': str(args.rate),
+        'BROADCAST_CHAT_INTERVAL': '0',
+        'DIGEST_MODE': '1' if args.digest else '0',
+        'OUTBOX_BATCH_SIZE': '5000',
+        'DELIVERY_SHARDS': str(args.shards),
+    })
+
+    from database import create_databases
+    from work_with_db import create_users
+
+    try:
+        create_databases()
+        start = time.perf_counter()
+        create_users(random.sample(range(1, 10 ** 10), args.subscribers))
+        fill_seconds = time.perf_counter() - start
+
+        cycle = asyncio.run(run_cycle(telegram_port, blog_port, args.processes))
+        with urlopen(f'http://127.0.0.1:{telegram_port}/stats') as response:
+            telegram = json.load(response)
+    finally:
+        process.terminate()
+        shutil.rmtree(directory)
+
+    results = {
+        'benchmark': 'broadcast',
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'parameters': vars(args),
+        'fill_seconds': round(fill_seconds, 3),
+        **cycle,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'telegram': telegram,
+    }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
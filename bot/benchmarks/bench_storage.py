@@ -0,0 +1,75 @@
+"""
+Benchmark of the bot storage layer on a large subscriber table.
+
+Run from the bot directory:
+    python -m benchmarks.bench_storage --subscribers 1000000
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+@contextmanager
+def timed(results: dict, name: str):
+    start = time.perf_counter()
+    yield
+    results[name] = time.perf_counter() - start
+    print(f'{name:<40} {results[name]:>10.3f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bot storage benchmark')
+    parser.add_argument('--subscribers', type=int, default=1_000_000)
+    parser.add_argument('--lookups', type=int, default=100_000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ['DB_NAME'] = os.path.join(directory, 'bench.db')
+
+    from database import create_databases, get_connection
+    from work_with_db import create_user, create_users, is_user_exist, iter_user_batches
+
+    create_databases()
+    telegram_ids = random.sample(range(10 ** 10), args.subscribers)
+    results = {}
+
+    print(f'{args.subscribers} subscribers, database {os.environ["DB_NAME"]}')
+    with timed(results, 'bulk insert of subscribers'):
+        create_users(telegram_ids)
+
+    with timed(results, 'bulk insert of the same subscribers'):
+        create_users(telegram_ids[:args.lookups])
+
+    existing = random.choices(telegram_ids, k=args.lookups)
+    with timed(results, f'{args.lookups} is_user_exist, existing'):
+        for telegram_id in existing:
+            is_user_exist(telegram_id)
+
+    with timed(results, f'{args.lookups} is_user_exist, missing'):
+        for telegram_id in range(-args.lookups, 0):
+            is_user_exist(telegram_id)
+
+    with timed(results, '1000 create_user of existing ids'):
+        for telegram_id in existing[:1000]:
+            create_user(telegram_id)
+
+    tracemalloc.start()
+    with timed(results, 'iter_user_batches over all subscribers'):
+        count = sum(len(batch) for batch in iter_user_batches())
+    results['iteration peak memory'] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{"iteration peak memory":<40} {results["iteration peak memory"] / 1024:>9.0f}KB')
+    assert count == args.subscribers
+
+    count = get_connection().execute('SELECT COUNT(*) FROM users;').fetchone()[0]
+    assert count == args.subscribers
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
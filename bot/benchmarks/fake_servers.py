@@ -0,0 +1,120 @@
+"""
+Fake Telegram Bot API and blog API for the offline benchmarks.
+
+Both run in a child process, so their work does not count against the
+CPU time and memory of the bot process that is measured.
+"""
+import asyncio
+import multiprocessing
+import random
+from dataclasses import dataclass, asdict
+from urllib.parse import parse_qs
+
+from aiohttp import web
+
+
+@dataclass
+class TelegramBehaviour:
+    latency: float = 0.05
+    jitter: float = 0.02
+    # share of requests answered with 429 and how long the bot is asked to wait
+    flood_rate: float = 0.0
+    retry_after: int = 1
+    # share of chats that blocked the bot, picked by chat id so the bot side can count them too
+    blocked_rate: float = 0.0
+
+    def is_blocked(self, chat_id: int) -> bool:
+        return chat_id % 10000 < self.blocked_rate * 10000
+
+
+def telegram_app(behaviour: TelegramBehaviour) -> web.Application:
+    stats = {'requests': 0, 'sent': 0, 'flood': 0, 'blocked': 0, 'chats': set()}
+
+    async def api_method(request: web.Request) -> web.Response:
+        stats['requests'] += 1
+        # pyTelegramBotAPI sends the form in the body of a GET request
+        data = {key: values[0] for key, values in parse_qs(await request.text()).items()}
+        await asyncio.sleep(max(0.0, random.gauss(behaviour.latency, behaviour.jitter)))
+
+        if request.match_info['method'] != 'sendMessage':
+            return web.json_response({'ok': True, 'result': True})
+
+        chat_id = int(data['chat_id'])
+        if random.random() < behaviour.flood_rate:
+            stats['flood'] += 1
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {behaviour.retry_after}',
+                'parameters': {'retry_after': behaviour.retry_after}
+            }, status=429)
+        if behaviour.is_blocked(chat_id):
+            stats['blocked'] += 1
+            return web.json_response({
+                'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'
+            }, status=403)
+
+        stats['sent'] += 1
+        stats['chats'].add(chat_id)
+        return web.json_response({'ok': True, 'result': {
+            'message_id': stats['sent'], 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'text': data['text']
+        }})
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response({**{k: v for k, v in stats.items() if k != 'chats'}, 'chats': len(stats['chats'])})
+
+    app = web.Application()
+    app.router.add_route('*', '/bot{token}/{method}', api_method)
+    app.router.add_get('/stats', get_stats)
+    return app
+
+
+def blog_app(articles: int) -> web.Application:
+    """A changes feed that has `articles` new parsing articles once, then nothing"""
+    created = [
+        {'id': number, 'title': f'Benchmark article {number}', 'url': f'https://example.com/articles/{number}/',
+         'source': 'parsingarticle', 'change': 'created'}
+        for number in range(1, articles + 1)
+    ]
+
+    async def login(request: web.Request) -> web.Response:
+        return web.json_response({'token': 'benchmark', 'user': 'botuser'})
+
+    async def changes(request: web.Request) -> web.Response:
+        cursors = request.query.getall('cursor', [])
+        if request.query.get('start') == 'latest' or not cursors:
+            return web.json_response({'results': [], 'cursors': {'article': 'a0', 'parsingarticle': 'p0'},
+                                      'has_more': False})
+        results = created if 'p0' in cursors else []
+        return web.json_response({'results': results, 'cursors': {'parsingarticle': 'p1'}, 'has_more': False})
+
+    app = web.Application()
+    app.router.add_post('/api/login/', login)
+    app.router.add_get('/api/changes/', changes)
+    return app
+
+
+async def serve(app: web.Application) -> int:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return site._server.sockets[0].getsockname()[1]
+
+
+def run(ports: multiprocessing.Queue, behaviour: dict, articles: int) -> None:
+    async def main():
+        telegram_port = await serve(telegram_app(TelegramBehaviour(**behaviour)))
+        blog_port = await serve(blog_app(articles))
+        ports.put((telegram_port, blog_port))
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def start(behaviour: TelegramBehaviour, articles: int) -> tuple[multiprocessing.Process, int, int]:
+    """Start both servers in a child process, returns it with the Telegram and blog ports"""
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run, args=(ports, asdict(behaviour), articles), daemon=True)
+    process.start()
+    telegram_port, blog_port = ports.get(timeout=30)
+    return process, telegram_port, blog_port
@@ -0,0 +1,256 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Hashable, Iterable
+
+import aiohttp
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiHTTPException, ApiInvalidJSONException, ApiTelegramException, RequestTimeout
+
+from botlog import logger
+from messages import PARSE_MODE
+from metrics import messages_total, flood_waits_total, send_seconds
+from settings import (
+    bot, broadcast_workers, broadcast_rate, broadcast_chat_interval, broadcast_max_retries, broadcast_retry_backoff)
+
+
+class RateLimiter:
+    """
+    Hands out send slots no faster than `rate` per second overall and
+    one per `chat_interval` seconds for the same chat.
+    """
+
+    def __init__(self, rate: float, chat_interval: float):
+        self.interval = 1 / rate
+        self.chat_interval = chat_interval
+        self._next_slot = 0.0
+        self._next_chat_slot = {}
+
+    async def acquire(self, chat_id: int) -> None:
+        now = time.monotonic()
+        slot = max(now, self._next_slot, self._next_chat_slot.get(chat_id, 0.0))
+        self._next_slot = slot + self.interval
+        self._next_chat_slot[chat_id] = slot + self.chat_interval
+        if len(self._next_chat_slot) > 10000:
+            self._next_chat_slot = {chat: t for chat, t in self._next_chat_slot.items() if t > now}
+
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def set_rate(self, rate: float) -> None:
+        self.interval = 1 / rate
+
+    def pause(self, seconds: float) -> None:
+        """Push every following slot back, Telegram asked us to slow down."""
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+# how a failed send is handled
+TRANSIENT = 'transient'  # retried after a while: 429, Telegram 5xx, network errors
+PERMANENT = 'permanent'  # the chat is gone: blocked, deactivated or unknown, the user is deactivated
+FATAL = 'fatal'  # the bot itself is rejected (bad token), nothing else can be sent
+FAILED = 'failed'  # only this message is wrong, e.g. it can not be parsed
+
+DEAD_CHAT_ERRORS = ('chat not found', 'user is deactivated', 'peer_id_invalid', 'bot was kicked', 'bot was blocked')
+
+
+def classify_error(error: Exception) -> tuple[str, float | None]:
+    """Kind of a send_message error and the retry_after Telegram asked for"""
+    if isinstance(error, ApiTelegramException):
+        if error.error_code == 429:
+            return TRANSIENT, error.result_json.get('parameters', {}).get('retry_after', 1)
+        if error.error_code >= 500:
+            return TRANSIENT, None
+        if error.error_code in (401, 404):
+            return FATAL, None
+        if error.error_code == 403 or any(text in error.description.lower() for text in DEAD_CHAT_ERRORS):
+            return PERMANENT, None
+        return FAILED, None
+    if isinstance(error, (ApiHTTPException, ApiInvalidJSONException, RequestTimeout, asyncio.TimeoutError,
+                          aiohttp.ClientError)):
+        return TRANSIENT, None
+    return FAILED, None
+
+
+@dataclass
+class BroadcastReport:
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    elapsed: float = 0.0
+    delivered: list = field(default_factory=list)
+    # keys of the messages to try again later and of the ones Telegram rejected, sending them again fails too
+    undelivered: list = field(default_factory=list)
+    rejected: list = field(default_factory=list)
+    # keys of the messages to chats that are gone and the chats themselves
+    dead: list = field(default_factory=list)
+    dead_chats: set = field(default_factory=set)
+    fatal: str | None = None
+    # set from outside to stop the broadcast, e.g. the shard lease of the messages ran out
+    stopped: str | None = None
+
+    @property
+    def halted(self) -> bool:
+        return bool(self.fatal or self.stopped)
+
+    @property
+    def rate(self) -> float:
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+
+class Broadcaster:
+    """
+    Sends messages from a number of concurrent workers sharing one RateLimiter.
+
+    A transient failure does not keep a worker busy: the message is put aside
+    with a jittered exponential backoff and sent again in the next round, the
+    other chats go on meanwhile.
+    """
+
+    def __init__(
+            self,
+            telegram_bot: AsyncTeleBot,
+            workers: int = 32,
+            rate: float = 30,
+            chat_interval: float = 1,
+            max_retries: int = 3,
+            retry_backoff: float = 1
+    ):
+        self.bot = telegram_bot
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.limiter = RateLimiter(rate, chat_interval)
+        self._order = itertools.count()
+
+    def retry_delay(self, attempt: int, retry_after: float | None) -> float:
+        delay = retry_after if retry_after is not None else self.retry_backoff * 2 ** attempt
+        # jitter so the retried messages do not come back all at once
+        return delay * random.uniform(1, 1.5)
+
+    async def _send(
+            self,
+            key: Hashable,
+            chat_id: int,
+            text: str,
+            attempt: int,
+            report: BroadcastReport,
+            retries: list
+    ) -> None:
+        if report.halted:
+            return
+
+        await self.limiter.acquire(chat_id)
+        start = time.perf_counter()
+        try:
+            await self.bot.send_message(chat_id, text=text, parse_mode=PARSE_MODE)
+        except Exception as e:
+            send_seconds.observe(time.perf_counter() - start)
+            error = e
+            kind, retry_after = classify_error(error)
+        else:
+            send_seconds.observe(time.perf_counter() - start)
+            report.sent += 1
+            report.delivered.append(key)
+            messages_total.inc('sent')
+            return
+
+        if kind == TRANSIENT and attempt < self.max_retries:
+            if retry_after is not None:
+                logger.warning(f'Telegram flood control, retry after {retry_after}s')
+                self.limiter.pause(retry_after)
+                flood_waits_total.inc()
+            due = time.monotonic() + self.retry_delay(attempt, retry_after)
+            heapq.heappush(retries, (due, next(self._order), (key, chat_id, text, attempt + 1)))
+            report.retried += 1
+            return
+
+        if kind == PERMANENT:
+            logger.info(f'Chat {chat_id} is gone: {error}')
+            report.dead.append(key)
+            report.dead_chats.add(chat_id)
+            messages_total.inc('dead')
+            return
+
+        if kind == FAILED:
+            logger.error(f'Message to {chat_id} was not sent: {error!r}')
+            report.failed += 1
+            report.rejected.append(key)
+            messages_total.inc('failed')
+            return
+
+        if kind == FATAL:
+            logger.error(f'Telegram rejected the bot, broadcast stopped: {error}')
+            report.fatal = str(error)
+        else:
+            logger.error(f'Message to {chat_id} was not sent after {attempt + 1} attempts: {error!r}')
+        report.failed += 1
+        report.undelivered.append(key)
+        messages_total.inc('failed')
+
+    async def broadcast(
+            self,
+            messages: Iterable[tuple[Hashable, int, str]],
+            report: BroadcastReport | None = None
+    ) -> BroadcastReport:
+        """
+        Send (key, chat_id, text) messages, returns when all of them are handled.
+        The keys end up in report.delivered, report.undelivered, report.rejected or report.dead,
+        after a fatal error or a stop the keys of the messages that were not tried are in none of them.
+        A report given by the caller can be read while the broadcast goes on.
+        """
+        report = report or BroadcastReport()
+        jobs = asyncio.Queue(maxsize=self.workers * 4)
+        retries = []
+
+        async def worker():
+            while (job := await jobs.get()) is not None:
+                try:
+                    await self._send(*job, report, retries)
+                finally:
+                    jobs.task_done()
+
+        start = time.monotonic()
+        tasks = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        try:
+            for key, chat_id, text in messages:
+                if report.halted:
+                    break
+                await jobs.put((key, chat_id, text, 0))
+            await jobs.join()
+
+            # the retries that came up meanwhile, each one once it is due
+            while retries and not report.halted:
+                due, _, job = heapq.heappop(retries)
+                await asyncio.sleep(due - time.monotonic())
+                await jobs.put(job)
+                if not retries:
+                    await jobs.join()
+
+            for _ in tasks:
+                await jobs.put(None)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        report.elapsed = time.monotonic() - start
+
+        if report.sent or report.failed or report.dead:
+            logger.info(f'Broadcast finished: sent {report.sent}, failed {report.failed}, '
+                        f'chats gone {len(report.dead_chats)}, retried {report.retried} '
+                        f'in {report.elapsed:.1f}s ({report.rate:.1f} msg/s)')
+        return report
+
+
+broadcaster = Broadcaster(
+    bot,
+    workers=broadcast_workers,
+    rate=broadcast_rate,
+    chat_interval=broadcast_chat_interval,
+    max_retries=broadcast_max_retries,
+    retry_backoff=broadcast_retry_backoff
+)
@@ -1,5 +1,9 @@
 import sqlite3
+import threading
+from contextlib import contextmanager
 from sqlite3 import Error
+from typing import Iterator
+
 from botlog import logger
 from settings import db_name
 
@@ -7,48 +11,196 @@ from settings import db_name
 def create_connection(db_name: str):
     connection = None
     try:
-        connection = sqlite3.connect(db_name, check_same_thread=False)
+        # autocommit mode, transactions are opened explicitly with transaction()
+        connection = sqlite3.connect(db_name, isolation_level=None, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL;')
+        connection.execute('PRAGMA synchronous=NORMAL;')
     except Error as e:
         logger.exception(f"The error '{e}' occurred")
 
     return connection
 
 
-def execute_query(connection, query, params=tuple()):
-    cursor = connection.cursor()
-    try:
-        a = cursor.execute(query, params)
-        connection.commit()
-        return a
-    except Error as e:
-        logger.error(f"The error '{e}' occurred")
-
+_local = threading.local()
 
-connection = create_connection(db_name)
 
+def get_connection() -> sqlite3.Connection:
+    """Every thread gets its own connection, WAL lets readers work next to a writer."""
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        connection = _local.connection = create_connection(db_name)
+    return connection
 
-create_users_table = """
-CREATE TABLE IF NOT EXISTS users (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  telegram_id INTEGER NOT NULL
-);
-"""
 
+@contextmanager
+def transaction(connection: sqlite3.Connection | None = None) -> Iterator[sqlite3.Connection]:
+    """Run the statements of the block in one write transaction."""
+    connection = connection or get_connection()
+    connection.execute('BEGIN IMMEDIATE;')
+    try:
+        yield connection
+    except BaseException:
+        connection.execute('ROLLBACK;')
+        raise
+    connection.execute('COMMIT;')
 
-create_articles_id_table = """
-CREATE TABLE IF NOT EXISTS article_ids (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  source TEXT NOT NULL UNIQUE,
-  last_article_id INTEGER NOT NULL
-);
-"""
 
+def execute_query(connection, query, params=tuple()):
+    cursor = connection.cursor()
+    try:
+        return cursor.execute(query, params)
+    except Error as e:
+        logger.error(f"The error '{e}' occurred")
 
-def create_databases():
-    execute_query(connection, create_users_table)
-    execute_query(connection, create_articles_id_table)
 
+def execute_many(connection, query, params_seq):
+    try:
+        with transaction(connection):
+            return connection.executemany(query, params_seq)
+    except Error as e:
+        logger.error(f"The error '{e}' occurred")
 
 
+# Every schema change is a new entry, the number of applied entries is kept in PRAGMA user_version
+MIGRATIONS = [
+    # 1: initial schema
+    [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          telegram_id INTEGER NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS article_ids (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          source TEXT NOT NULL UNIQUE,
+          last_article_id INTEGER NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS api_tokens (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          base_url TEXT NOT NULL UNIQUE,
+          token TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          idempotency_key TEXT NOT NULL UNIQUE,
+          telegram_id INTEGER NOT NULL,
+          text TEXT NOT NULL,
+          status TEXT NOT NULL DEFAULT 'pending',
+          attempts INTEGER NOT NULL DEFAULT 0,
+          created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS outbox_status_id ON outbox (status, id);",
+    ],
+    # 2: one row per subscriber
+    [
+        "DELETE FROM users WHERE id NOT IN (SELECT MIN(id) FROM users GROUP BY telegram_id);",
+        "CREATE UNIQUE INDEX IF NOT EXISTS users_telegram_id ON users (telegram_id);",
+    ],
+    # 3: subscription preferences
+    [
+        """
+        CREATE TABLE preference_rules (
+          telegram_id INTEGER NOT NULL,
+          kind TEXT NOT NULL,
+          value TEXT NOT NULL,
+          PRIMARY KEY (telegram_id, kind, value)
+        ) WITHOUT ROWID;
+        """,
+    ],
+    # 4: delivery windows, outbox messages held back until not_before
+    [
+        """
+        CREATE TABLE delivery_windows (
+          telegram_id INTEGER PRIMARY KEY,
+          timezone TEXT,
+          quiet_start INTEGER,
+          quiet_end INTEGER,
+          deliver_at INTEGER
+        );
+        """,
+        "ALTER TABLE outbox ADD COLUMN not_before REAL NOT NULL DEFAULT 0;",
+        "ALTER TABLE outbox ADD COLUMN pack INTEGER NOT NULL DEFAULT 0;",
+        "DROP INDEX outbox_status_id;",
+        "CREATE INDEX outbox_status_due ON outbox (status, not_before, id);",
+    ],
+    # 5: position of the bot in the changes feed of every source
+    [
+        "ALTER TABLE article_ids ADD COLUMN cursor TEXT;",
+    ],
+    # 6: chats that blocked the bot or are gone get no more messages
+    [
+        "ALTER TABLE users ADD COLUMN active INTEGER NOT NULL DEFAULT 1;",
+    ],
+    # 7: delivery shards, held by the bot processes through leases
+    [
+        """
+        CREATE TABLE leases (
+          name TEXT PRIMARY KEY,
+          owner TEXT NOT NULL,
+          expires_at REAL NOT NULL
+        ) WITHOUT ROWID;
+        """,
+        "ALTER TABLE outbox ADD COLUMN shard INTEGER NOT NULL DEFAULT 0;",
+        "DROP INDEX outbox_status_due;",
+        "CREATE INDEX outbox_status_shard_due ON outbox (status, shard, not_before, id);",
+    ],
+    # 8: newest articles of both sources for /latest
+    [
+        """
+        CREATE TABLE recent_articles (
+          source TEXT NOT NULL,
+          id INTEGER NOT NULL,
+          title TEXT NOT NULL,
+          url TEXT NOT NULL,
+          created_at REAL NOT NULL,
+          PRIMARY KEY (source, id)
+        ) WITHOUT ROWID;
+        """,
+        "CREATE INDEX recent_articles_created ON recent_articles (created_at);",
+    ],
+    # 9: hashes of the links every user got lately, two generations packed in blobs
+    [
+        """
+        CREATE TABLE delivered_links (
+          telegram_id INTEGER PRIMARY KEY,
+          generation INTEGER NOT NULL,
+          current BLOB NOT NULL,
+          previous BLOB NOT NULL
+        );
+        """,
+        "CREATE INDEX delivered_links_generation ON delivered_links (generation);",
+    ],
+    # 10: 64-bit link hashes, the links of an outbox message are remembered once it is sent
+    [
+        # the 32-bit hashes cannot be compared with the new ones
+        "DELETE FROM delivered_links;",
+        "ALTER TABLE outbox ADD COLUMN links BLOB;",
+        "CREATE INDEX outbox_pending_user ON outbox (telegram_id) WHERE status = 'pending';",
+    ],
+]
+
+
+def migrate(connection) -> None:
+    version = connection.execute('PRAGMA user_version;').fetchone()[0]
+    while version < len(MIGRATIONS):
+        with transaction(connection):
+            # read again under the write lock, a process starting at the same time may have migrated
+            version = connection.execute('PRAGMA user_version;').fetchone()[0]
+            if version == len(MIGRATIONS):
+                break
+            for statement in MIGRATIONS[version]:
+                connection.execute(statement)
+            version += 1
+            connection.execute(f'PRAGMA user_version = {version};')
+        logger.info(f'Bot database migrated to version {version}')
 
 
+def create_databases():
+    migrate(get_connection())
@@ -0,0 +1,119 @@
+import hashlib
+from array import array
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from preferences import normalize_domain
+from work_with_db import get_delivered_links, get_message_links, get_pending_links, save_delivered_links
+
+TRACKING_PARAMS = {'fbclid', 'gclid', 'yclid', 'mc_cid', 'mc_eid', 'ref', 'ref_src', '_hsenc', '_hsmi'}
+
+
+def normalize_url(url: str) -> str:
+    """
+    The same link written differently gives the same string: no scheme, no www,
+    no fragment or trailing slash, no tracking parameters and the rest sorted.
+    """
+    parts = urlsplit(url.strip())
+    host = normalize_domain(parts.hostname or '')
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port not in (80, 443):
+        host = f'{host}:{port}'
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith('utm_')
+    )
+    return host + (parts.path.rstrip('/') or '/') + (f'?{urlencode(query)}' if query else '')
+
+
+def url_hash(url: str) -> int:
+    """
+    64 bits, so that the chance two different links of a user's rows collide and one is
+    skipped stays negligible for every user together, 32 bits would hit some of them.
+    """
+    return int.from_bytes(hashlib.blake2b(normalize_url(url).encode(), digest_size=8).digest(), 'little')
+
+
+def pack_links(hashes: list[int]) -> bytes | None:
+    """The outbox links of a message, None for none"""
+    return array('Q', hashes).tobytes() if hashes else None
+
+
+def generation(now: float, days: float) -> int:
+    """A generation lasts half of `days`, so a link is remembered for half of them up to all of them"""
+    return int(now // (days * 86400 / 2))
+
+
+class DeliveredLinks:
+    """
+    Hashes of the links every user was sent lately, to skip the same link from the other source.
+
+    A user has one row with two generations of packed 64-bit hashes. A new
+    generation starts every half of `days` and the one before the previous is
+    dropped. A generation keeps the newest `max_links` hashes, a user who gets
+    more within half of `days` may get the older ones again.
+
+    The links of a message are remembered once Telegram took it (`record`),
+    until then its links in the outbox count as sent already, so a message
+    that is held back is not queued again from the other source and one that
+    never got through does not keep the link from the user.
+    Checking a user is one row read, made for a whole batch of users at once.
+    """
+
+    def __init__(self, days: float, max_links: int, now: float):
+        self.max_links = max_links
+        self.generation = generation(now, days)
+        # telegram_id -> links of the current and previous generation and of the outbox of the current batch
+        self._seen: dict[int, set[int]] = {}
+
+    def _read(self, telegram_ids: list[int]) -> dict[int, list[array]]:
+        """telegram_id -> [current, previous] generation of the users that have a row"""
+        rows = {}
+        for telegram_id, generation, current, previous in get_delivered_links(telegram_ids):
+            if generation == self.generation:
+                rows[telegram_id] = [array('Q', current), array('Q', previous)]
+            elif generation == self.generation - 1:
+                rows[telegram_id] = [array('Q'), array('Q', current)]
+        return rows
+
+    def load(self, telegram_ids: list[int]) -> None:
+        """Read the rows and the outbox links of a batch of users, the ones of the batch before are forgotten"""
+        self._seen = {telegram_id: set(current).union(previous)
+                      for telegram_id, (current, previous) in self._read(telegram_ids).items()}
+        for telegram_id, links in get_pending_links(telegram_ids):
+            self._seen.setdefault(telegram_id, set()).update(array('Q', links))
+
+    def unseen(self, telegram_id: int, positions: tuple[int, ...], hashes: list[int | None]) -> tuple[int, ...]:
+        """
+        The positions of the articles whose link the user did not get yet, the first of
+        the same links included. A `hashes` item is None for no link.
+        """
+        seen = self._seen.setdefault(telegram_id, set())
+        kept = []
+        for position in positions:
+            link = hashes[position]
+            if link is not None:
+                if link in seen:
+                    continue
+                seen.add(link)
+            kept.append(position)
+        return tuple(kept)
+
+    def record(self, message_ids: list[int]) -> None:
+        """Remember the links of the sent outbox messages, within the open transaction of the thread if any"""
+        sent = get_message_links(message_ids)
+        if not sent:
+            return
+
+        rows = self._read(sorted({telegram_id for telegram_id, _ in sent}))
+        for telegram_id, links in sent:
+            current, previous = rows.setdefault(telegram_id, [array('Q'), array('Q')])
+            known = set(current).union(previous)
+            current.extend(link for link in dict.fromkeys(array('Q', links)) if link not in known)
+            del current[:-self.max_links]
+        save_delivered_links([
+            (telegram_id, self.generation, current.tobytes(), previous.tobytes())
+            for telegram_id, (current, previous) in rows.items()
+        ])
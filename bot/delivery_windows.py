@@ -0,0 +1,74 @@
+import re
+from datetime import datetime, timedelta
+from typing import Iterable
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+def parse_time(value: str) -> int | None:
+    """'07:30' -> minutes since midnight"""
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', value)
+    if match and int(match[1]) < 24 and int(match[2]) < 60:
+        return int(match[1]) * 60 + int(match[2])
+
+
+def format_time(minutes: int | None) -> str:
+    return '-' if minutes is None else f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def get_zone(name: str | None, default: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(name or default)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo('UTC')
+
+
+def next_occurrence(now: datetime, minutes: int) -> datetime:
+    """First moment at minutes since midnight that is not before now"""
+    moment = now.replace(hour=minutes // 60, minute=minutes % 60, second=0, microsecond=0)
+    if moment < now:
+        moment += timedelta(days=1)
+    return moment
+
+
+def in_quiet_hours(minute_of_day: int, start: int, end: int) -> bool:
+    if start <= end:
+        return start <= minute_of_day < end
+    return minute_of_day >= start or minute_of_day < end
+
+
+class DeliveryWindows:
+    """
+    Delivery windows of the users who set them: a time zone, quiet hours and
+    a daily delivery time. Users without a window get messages right away.
+    """
+
+    def __init__(
+            self,
+            windows: Iterable[tuple[int, str | None, int | None, int | None, int | None]],
+            default_zone: str
+    ):
+        self.default_zone = default_zone
+        self.windows = {
+            telegram_id: (get_zone(zone, default_zone), quiet_start, quiet_end, deliver_at)
+            for telegram_id, zone, quiet_start, quiet_end, deliver_at in windows
+        }
+
+    def next_delivery(self, telegram_id: int, now: float) -> tuple[float, int]:
+        """
+        When a message created now may be sent to the user: (timestamp, pack).
+        Messages with pack 1 are held back and merged into as few messages as possible.
+        """
+        window = self.windows.get(telegram_id)
+        if window is None:
+            return 0.0, 0
+
+        zone, quiet_start, quiet_end, deliver_at = window
+        local_now = datetime.fromtimestamp(now, zone)
+        if deliver_at is not None:
+            return next_occurrence(local_now, deliver_at).timestamp(), 1
+
+        if quiet_start is not None and quiet_end is not None and \
+                in_quiet_hours(local_now.hour * 60 + local_now.minute, quiet_start, quiet_end):
+            return next_occurrence(local_now, quiet_end).timestamp(), 1
+
+        return 0.0, 0
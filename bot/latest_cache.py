@@ -0,0 +1,78 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Iterable
+
+from botlog import logger
+from work_with_db import get_recent_articles, save_recent_articles
+
+Fetch = Callable[[], Awaitable[list[tuple[str, dict]]]]
+
+
+def parse_date(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def article_rows(articles: Iterable[tuple[str, dict]], now: float) -> list[tuple[str, int, str, str, float]]:
+    """
+    (source, id, title, url, created_at) rows of (source, article) pairs from the changes feed
+    or the latest article endpoints, an article without a date counts as created now.
+    """
+    return [
+        (source, article['id'], article.get('title') or '', article.get('url') or '',
+         parse_date(article.get('created_date') or article.get('publication_date')) or now)
+        for source, article in articles
+    ]
+
+
+class LatestArticles:
+    """
+    The newest articles for /latest, kept in memory in front of the recent_articles table.
+
+    The sync saves the articles it finds into the table. An answer older than
+    `ttl` is still served at once while one background refresh asks the blog for
+    its latest articles and reloads the table, so only the very first /latest
+    after a start waits for the blog.
+    """
+
+    def __init__(self, fetch: Fetch, ttl: float, keep: int):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.keep = keep
+        self._articles: list[tuple[str, dict]] = []
+        self._loaded_at: float | None = None
+        self._expired = False
+        self._refreshing: asyncio.Task | None = None
+
+    async def get(self, count: int, source: str | None = None) -> list[tuple[str, dict]]:
+        """The `count` newest (source, article) pairs, of one source when it is given"""
+        if self._refreshing is None or self._refreshing.done():
+            if self._loaded_at is None or self._expired or time.monotonic() - self._loaded_at > self.ttl:
+                self._refreshing = asyncio.create_task(self.refresh())
+        if self._loaded_at is None:
+            await asyncio.shield(self._refreshing)
+
+        articles = [item for item in self._articles if source is None or item[0] == source]
+        return articles[:count]
+
+    def expire(self) -> None:
+        """The table changed, revalidate with the next answer"""
+        self._expired = True
+
+    async def refresh(self) -> None:
+        self._expired = False
+        try:
+            if fetched := await self.fetch():
+                await asyncio.to_thread(save_recent_articles, article_rows(fetched, time.time()), self.keep)
+        except Exception:
+            # the table still has what the sync saved
+            logger.exception('Latest articles were not fetched')
+        rows = await asyncio.to_thread(get_recent_articles, self.keep)
+        self._articles = [(source, {'id': article_id, 'title': title, 'url': url})
+                          for source, article_id, title, url, _ in rows]
+        self._loaded_at = time.monotonic()
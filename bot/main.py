@@ -1,95 +1,256 @@
-import time
+import asyncio
+from urllib.parse import urlparse
+
 from telebot.types import BotCommand, Message
-import requests
 import prettytable as pt
 
 from botlog import logger
-from work_with_db import create_user, is_user_exist
+from messages import render_digest, PARSE_MODE
+from delivery_windows import parse_time, format_time, get_zone
+from preferences import SOURCES, RULE_KINDS, is_keyword, normalize_domain
+from work_with_db import (
+    create_user, add_preference_rules, delete_preference_rules, get_user_preference_rules,
+    get_delivery_window, set_delivery_window)
 from database import create_databases
-from work_with_db import update_article_ids, get_article_ids, create_article_ids
-from settings import bot, url_latest_site_article, url_latest_web_article, get_token
+from scheduled_tasks import latest_articles, run_scheduled_tasks, send_new_articles_to_user
+import metrics
+from settings import (
+    bot, latest_max_count, bot_mode, webhook_url, webhook_secret,
+    webhook_port, webhook_workers, webhook_queue_size, default_timezone, health_max_age, bot_role)
+from webhook import WebhookServer
 
 start_command = BotCommand(command='start', description='start')
 help_command = BotCommand(command='help', description='get_list_of_available_commands')
-latest_command = BotCommand(command='latest', description='get latest article')
+latest_command = BotCommand(command='latest', description='get latest article, or the N newest: /latest 5')
+subscribe_command = BotCommand(command='subscribe', description='turn on a source: article or parsingarticle')
+unsubscribe_command = BotCommand(command='unsubscribe', description='turn off a source: article or parsingarticle')
+include_command = BotCommand(command='include', description='get only articles with these keywords')
+exclude_command = BotCommand(command='exclude', description='skip articles with these keywords')
+domain_command = BotCommand(command='domain', description='get only articles from these domains')
+preferences_command = BotCommand(command='preferences', description='show your subscription rules')
+clear_command = BotCommand(command='clear', description='remove rules: include, exclude, domain or all')
+quiet_command = BotCommand(command='quiet', description='no messages between two times, e.g. 23:00 07:00 or off')
+deliverat_command = BotCommand(command='deliverat', description='get all articles once a day, e.g. 09:00 or off')
+timezone_command = BotCommand(command='timezone', description='set your time zone, e.g. Europe/Kyiv')
 
-bot.set_my_commands([start_command, help_command, latest_command])
+commands = [
+    start_command, help_command, latest_command, subscribe_command, unsubscribe_command,
+    include_command, exclude_command, domain_command, preferences_command, clear_command,
+    quiet_command, deliverat_command, timezone_command
+]
 
 
 @bot.message_handler(commands=['start'])
-def send_hello(message: Message) -> None:
-    chat_id = message.chat.id
-    if not is_user_exist(chat_id):
-        create_user(chat_id)
+async def send_hello(message: Message) -> None:
+    await asyncio.to_thread(create_user, message.chat.id)
 
-    bot.send_message(
+    await bot.send_message(
         message.chat.id,
         text='Hello.\n I\'m a bot that will send you new interesting articles',
     )
 
 
-def get_latest_article(url: str) -> dict:
-    headers = {"Content-Type": "application/json; charset=utf-8",
-               "Authorization": get_token()}
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        return response.json()
-
-
 @bot.message_handler(commands=['help'])
-def get_list_of_available_commands(message: Message) -> None:
+async def get_list_of_available_commands(message: Message) -> None:
     table = pt.PrettyTable(['№', 'command', 'description'])
     table.border = False
     table.header_style = 'upper'
     table.align = 'l'
 
-    for index, command in enumerate(bot.get_my_commands(), start=1):
+    for index, command in enumerate(commands, start=1):
         table.add_row([index, command.command,  command.description])
 
-    bot.send_message(
+    await bot.send_message(
         message.chat.id,
         text=table.get_string()
     )
 
 
 @bot.message_handler(commands=['latest'])
-def send_latest_article_to_user(message: Message) -> None:
-    article = get_latest_article(url_latest_web_article)
-    if article:
-        bot.send_message(
+async def send_latest_article_to_user(message: Message) -> None:
+    arguments = message.text.split()[1:]
+    if not arguments:
+        articles = await latest_articles.get(1, source='article')
+    elif len(arguments) == 1 and arguments[0].isdigit() and 1 <= int(arguments[0]) <= latest_max_count:
+        articles = await latest_articles.get(int(arguments[0]))
+    else:
+        await bot.send_message(message.chat.id, text=f'Usage: /latest or /latest N, N from 1 to {latest_max_count}')
+        return
+
+    if articles:
+        for text in render_digest([article for _, article in articles]):
+            await bot.send_message(
+                message.chat.id,
+                text=text,
+                parse_mode=PARSE_MODE
+            )
+    else:
+        await bot.send_message(
             message.chat.id,
-            text=f'[{article.get("title")}]({article.get("url")})',
-            parse_mode='Markdown'
+            text=f'Articles hasn\'t had yet ((('
         )
+
+
+def command_arguments(message: Message) -> list[str]:
+    return message.text.lower().split()[1:]
+
+
+@bot.message_handler(commands=['subscribe', 'unsubscribe'])
+async def switch_source(message: Message) -> None:
+    command = message.text.split()[0].lstrip('/').split('@')[0]
+    sources = [source for source in command_arguments(message) if source in SOURCES]
+    if not sources:
+        await bot.send_message(message.chat.id, text=f'Usage: /{command} {" ".join(SOURCES)}')
+        return
+
+    if command == 'subscribe':
+        await asyncio.to_thread(delete_preference_rules, message.chat.id, 'source_off', sources)
     else:
-        bot.send_message(
+        await asyncio.to_thread(add_preference_rules, message.chat.id, 'source_off', sources)
+    await bot.send_message(message.chat.id, text=f'Done: {command} {", ".join(sources)}')
+
+
+@bot.message_handler(commands=['include', 'exclude', 'domain'])
+async def add_rules(message: Message) -> None:
+    kind = message.text.split()[0].lstrip('/').split('@')[0]
+    values = command_arguments(message)
+    if kind == 'domain':
+        values = [normalize_domain(value) for value in values]
+    values = [value for value in values if value]
+    if not values:
+        await bot.send_message(message.chat.id, text=f'Usage: /{kind} word1 word2 ...')
+        return
+    if kind != 'domain' and (wrong := [value for value in values if not is_keyword(value)]):
+        await bot.send_message(
             message.chat.id,
-            text=f'Articles hasn\'t had yet ((('
+            text=f'Titles are matched word by word, a keyword has only letters, digits and _: {" ".join(wrong)}'
         )
+        return
+
+    await asyncio.to_thread(add_preference_rules, message.chat.id, kind, values)
+    await bot.send_message(message.chat.id, text=f'Added {kind} rules: {", ".join(values)}')
 
 
-def update_or_set_initial_data(
-        source: str,
-        url_latest_web_article: str,
-        initial_article_id: int = 0
-):
-    article = get_latest_article(url_latest_web_article)
-    article_in_db = get_article_ids(source)
-    if article == {} and article_in_db is None:
-        create_article_ids(source, initial_article_id)
-    elif article and article_in_db is None:
-        create_article_ids(source, article.get('id'))
-    elif article and article_in_db and article.get('id') != article_in_db:
-        update_article_ids(source, article.get('id'))
-    elif article == {} and article_in_db:
-        update_article_ids(source, 0)
+@bot.message_handler(commands=['clear'])
+async def clear_rules(message: Message) -> None:
+    kinds = command_arguments(message)
+    if kinds in ([], ['all']):
+        # unsubscriptions too
+        kinds = []
+        await asyncio.to_thread(delete_preference_rules, message.chat.id)
+    elif all(kind in RULE_KINDS for kind in kinds):
+        for kind in kinds:
+            await asyncio.to_thread(delete_preference_rules, message.chat.id, kind)
+    else:
+        await bot.send_message(message.chat.id, text=f'Usage: /clear, /clear all or /clear {" ".join(RULE_KINDS)}')
+        return
+    await bot.send_message(message.chat.id, text=f'Removed rules: {", ".join(kinds) or "all"}')
 
 
-if __name__ == "__main__":
-    time.sleep(60)
+@bot.message_handler(commands=['preferences'])
+async def show_preferences(message: Message) -> None:
+    rules = await asyncio.to_thread(get_user_preference_rules, message.chat.id)
+    if not rules:
+        await bot.send_message(message.chat.id, text='You get all articles from all sources')
+        return
+
+    table = pt.PrettyTable(['rule', 'value'])
+    table.border = False
+    table.header_style = 'upper'
+    table.align = 'l'
+    for kind, value in rules:
+        table.add_row([kind, value])
+
+    await bot.send_message(message.chat.id, text=table.get_string())
+
+
+async def send_delivery_window(chat_id: int) -> None:
+    window = await asyncio.to_thread(get_delivery_window, chat_id)
+    zone, quiet_start, quiet_end, deliver_at = window or (None, None, None, None)
+    await bot.send_message(
+        chat_id,
+        text=f'Time zone: {zone or default_timezone}\n'
+             f'Quiet hours: {format_time(quiet_start)} - {format_time(quiet_end)}\n'
+             f'Daily delivery: {format_time(deliver_at)}'
+    )
+
+
+@bot.message_handler(commands=['quiet'])
+async def set_quiet_hours(message: Message) -> None:
+    arguments = command_arguments(message)
+    if arguments == ['off']:
+        await asyncio.to_thread(set_delivery_window, message.chat.id, quiet_start=None, quiet_end=None)
+    elif len(arguments) == 2 and None not in (times := [parse_time(value) for value in arguments]):
+        await asyncio.to_thread(set_delivery_window, message.chat.id, quiet_start=times[0], quiet_end=times[1])
+    else:
+        await bot.send_message(message.chat.id, text='Usage: /quiet 23:00 07:00 or /quiet off')
+        return
+    await send_delivery_window(message.chat.id)
+
+
+@bot.message_handler(commands=['deliverat'])
+async def set_delivery_time(message: Message) -> None:
+    arguments = command_arguments(message)
+    if arguments == ['off']:
+        await asyncio.to_thread(set_delivery_window, message.chat.id, deliver_at=None)
+    elif len(arguments) == 1 and (deliver_at := parse_time(arguments[0])) is not None:
+        await asyncio.to_thread(set_delivery_window, message.chat.id, deliver_at=deliver_at)
+    else:
+        await bot.send_message(message.chat.id, text='Usage: /deliverat 09:00 or /deliverat off')
+        return
+    await send_delivery_window(message.chat.id)
+
+
+@bot.message_handler(commands=['timezone'])
+async def set_timezone(message: Message) -> None:
+    arguments = message.text.split()[1:]
+    if len(arguments) != 1 or get_zone(arguments[0], '').key != arguments[0]:
+        await bot.send_message(message.chat.id, text='Usage: /timezone Europe/Kyiv')
+        return
+    await asyncio.to_thread(set_delivery_window, message.chat.id, timezone=arguments[0])
+    await send_delivery_window(message.chat.id)
+
+
+async def main() -> None:
+    # /healthz fails when the articles check stops succeeding
+    health_job = send_new_articles_to_user.__name__
     create_databases()
-    logger.info('Start BOT')
-    update_or_set_initial_data('article', url_latest_web_article)
-    update_or_set_initial_data('parsingarticle', url_latest_site_article)
+    logger.info(f'Start BOT ({bot_role})')
+    scheduled_tasks = asyncio.create_task(run_scheduled_tasks())
+
+    if bot_role == 'delivery':
+        # Telegram hands updates to one consumer only, the main process handles them
+        await metrics.start_server('0.0.0.0', webhook_port, health_job, health_max_age)
+        await scheduled_tasks
+        return
 
-    bot.polling(none_stop=True, interval=1, timeout=30)
+    await bot.set_my_commands(commands)
+    if bot_mode == 'webhook':
+        server = WebhookServer(
+            bot,
+            path=urlparse(webhook_url).path or '/',
+            secret_token=webhook_secret,
+            workers=webhook_workers,
+            queue_size=webhook_queue_size
+        )
+        metrics.add_routes(server.app, health_job, health_max_age)
+        metrics.Gauge('bot_webhook_queue', 'Updates waiting for a webhook worker.', function=server.queue.qsize)
+        await server.start('0.0.0.0', webhook_port)
+        await bot.set_webhook(url=webhook_url, secret_token=webhook_secret)
+        logger.info(f'Webhook server is listening on port {webhook_port}')
+        await scheduled_tasks
+    else:
+        await metrics.start_server('0.0.0.0', webhook_port, health_job, health_max_age)
+        logger.info(f'Metrics are served on port {webhook_port}')
+        await bot.remove_webhook()
+        # a failed scheduled task stops the bot instead of leaving it answering without deliveries
+        await asyncio.gather(scheduled_tasks, bot.polling(non_stop=True, interval=1, timeout=30))
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except Exception:
+        # the exit status lets supervisord start the bot again
+        logger.exception('The bot stopped')
+        raise
@@ -0,0 +1,40 @@
+import re
+
+MESSAGE_MAX_LENGTH = 4096
+PARSE_MODE = 'MarkdownV2'
+
+
+def escape_text(text: str) -> str:
+    """Escape text for Telegram MarkdownV2."""
+    return re.sub(r'([_*\[\]()~`>#+\-=|{}.!\\])', r'\\\1', text)
+
+
+def escape_url(url: str) -> str:
+    """Inside the (...) part of a MarkdownV2 link only ')' and '\\' are special."""
+    return re.sub(r'([)\\])', r'\\\1', url)
+
+
+def article_link(article: dict) -> str:
+    title = article.get('title') or article.get('url') or ''
+    return f'[{escape_text(title)}]({escape_url(article.get("url") or "")})'
+
+
+def render_digest(articles: list[dict], limit: int = MESSAGE_MAX_LENGTH) -> list[str]:
+    """Pack the links of all articles into as few messages as fit in `limit` characters."""
+    chunks = []
+    current = ''
+    for article in articles:
+        line = article_link(article)
+        if len(line) > limit:
+            article = {**article, 'title': article.get('title', '')[:limit // 4]}
+            line = article_link(article)
+
+        if current and len(current) + 1 + len(line) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = f'{current}\n{line}' if current else line
+
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,180 @@
+import bisect
+import json
+import math
+import time
+from typing import Callable
+
+from aiohttp import web
+
+from botlog import logger
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY: list['Metric'] = []
+
+
+class Metric:
+    """
+    Base of the metrics in Prometheus text format.
+
+    Metrics are only updated from the event loop thread (blocking calls are
+    timed around asyncio.to_thread), so an update is a dict lookup and an
+    addition without any lock.
+    """
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), registry: list = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        registry.append(self)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return '\n'.join([f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+                         + self.samples())
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, value: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def samples(self) -> list[str]:
+        return [f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}'
+                for labels, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """A value that is set, or read from `function` when the metrics are scraped"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 function: Callable[[], float] | None = None, registry: list = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.function = function
+
+    def set(self, value: float, *labels) -> None:
+        self.values[labels] = value
+
+    def get(self, *labels) -> float | None:
+        return self.values.get(labels)
+
+    def samples(self) -> list[str]:
+        values = self.values
+        if self.function:
+            try:
+                values = {(): self.function()}
+            except Exception:
+                # one broken gauge must not take the whole scrape down
+                logger.exception(f'Gauge {self.name} failed')
+                return []
+        return [f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}'
+                for labels, value in values.items()]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS, registry: list = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value: float, *labels) -> None:
+        state = self.values.get(labels)
+        if state is None:
+            # per bucket counts, sum, count
+            state = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = format_labels(self.labelnames, labels, f'le="{format_value(float(bound))}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+messages_total = Counter('bot_messages_total', 'Telegram messages by result: sent, failed or dead (chat gone).',
+                         ('result',))
+chats_deactivated_total = Counter('bot_chats_deactivated_total', 'Chats deactivated because they are gone.')
+flood_waits_total = Counter('bot_flood_waits_total', 'Telegram 429 answers the bot waited for.')
+send_seconds = Histogram('bot_send_seconds', 'Duration of a send_message call.')
+api_requests_total = Counter('bot_api_requests_total', 'Blog API requests by endpoint and result.',
+                             ('endpoint', 'result'))
+api_seconds = Histogram('bot_api_seconds', 'Duration of a blog API request.', ('endpoint',))
+jobs_total = Counter('bot_jobs_total', 'Scheduled jobs run, by job and result.', ('job', 'result'))
+job_seconds = Histogram('bot_job_seconds', 'Duration of a scheduled job.', ('job',))
+job_lag_seconds = Histogram('bot_job_lag_seconds', 'How late a scheduled job started.')
+last_success = Gauge('bot_job_last_success_timestamp_seconds', 'When a job last finished without error.', ('job',))
+started = Gauge('bot_start_timestamp_seconds', 'When the bot started.')
+started.set(time.time())
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+def health(job: str, max_age: float) -> tuple[bool, dict]:
+    """Healthy while `job` keeps succeeding, a fresh bot gets max_age to do it the first time"""
+    now = time.time()
+    last = last_success.get(job) or started.get()
+    age = now - last
+    return age <= max_age, {'job': job, 'seconds_since_success': round(age, 1), 'max_age': max_age}
+
+
+def add_routes(app: web.Application, job: str, max_age: float) -> None:
+    """/metrics in Prometheus text format and /healthz that answers 503 when `job` stopped succeeding"""
+
+    async def metrics_view(request: web.Request) -> web.Response:
+        return web.Response(text=render(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def health_view(request: web.Request) -> web.Response:
+        healthy, details = health(job, max_age)
+        return web.Response(text=json.dumps({'status': 'ok' if healthy else 'stale', **details}),
+                            content_type='application/json', status=200 if healthy else 503)
+
+    app.router.add_get('/metrics', metrics_view)
+    app.router.add_get('/healthz', health_view)
+
+
+async def start_server(host: str, port: int, job: str, max_age: float) -> web.AppRunner:
+    """Serve only the metrics and health routes, for the polling mode where no webhook server runs"""
+    app = web.Application()
+    add_routes(app, job, max_age)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
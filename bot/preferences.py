@@ -0,0 +1,113 @@
+import re
+from collections import defaultdict
+from typing import Iterable
+from urllib.parse import urlparse
+
+SOURCES = ('article', 'parsingarticle')
+RULE_KINDS = ('include', 'exclude', 'domain')
+KEYWORD = re.compile(r'\w+')
+
+
+def title_keywords(title: str | None) -> set[str]:
+    return set(KEYWORD.findall((title or '').lower()))
+
+
+def is_keyword(value: str) -> bool:
+    """Whether a rule value is one word of a title, anything else would never match"""
+    return KEYWORD.fullmatch(value) is not None
+
+
+def normalize_domain(domain: str) -> str:
+    domain = domain.lower().strip().strip('.')
+    if '://' in domain:
+        domain = urlparse(domain).hostname or ''
+    return domain.removeprefix('www.')
+
+
+def url_domains(url: str | None) -> list[str]:
+    """'news.example.com' gives ['news.example.com', 'example.com', 'com'], a rule matches subdomains too"""
+    parts = normalize_domain(urlparse(url or '').hostname or '').split('.')
+    return ['.'.join(parts[i:]) for i in range(len(parts)) if parts[i]]
+
+
+class PreferenceIndex:
+    """
+    Inverted index of subscription rules: keyword or domain -> telegram_id.
+
+    Rule kinds are ``source_off`` (value is a source), ``include`` and ``exclude``
+    (value is a keyword) and ``domain``. Users with an include or domain rule are
+    selective, they only get articles the index matches for them. Everybody else
+    gets every article except the excluded ones and the switched off sources.
+    """
+
+    def __init__(self, rules: Iterable[tuple[int, str, str]]):
+        self.source_off = defaultdict(set)
+        self.index = {kind: defaultdict(set) for kind in RULE_KINDS}
+        self.users_with_rules = set()
+        self.include_users = set()
+        self.domain_users = set()
+
+        for telegram_id, kind, value in rules:
+            self.users_with_rules.add(telegram_id)
+            if kind == 'source_off':
+                self.source_off[value].add(telegram_id)
+                continue
+
+            self.index[kind][value].add(telegram_id)
+            if kind == 'include':
+                self.include_users.add(telegram_id)
+            elif kind == 'domain':
+                self.domain_users.add(telegram_id)
+
+        self.selective_users = self.include_users | self.domain_users
+
+    def _lookup(self, kind: str, values: Iterable[str]) -> set[int]:
+        index = self.index[kind]
+        found = set()
+        for value in values:
+            found.update(index.get(value, ()))
+        return found
+
+    def match(self, articles: list[tuple[str, dict]]) -> tuple[dict[int, list[int]], list[set[int]]]:
+        """
+        Match (source, article) pairs against the rules.
+
+        Returns positions of the articles every selective user gets, and for every
+        article the users among the rest who must not get it.
+        """
+        selective = defaultdict(list)
+        blocked = []
+        for position, (source, article) in enumerate(articles):
+            keywords = title_keywords(article.get('title'))
+            excluded = self._lookup('exclude', keywords) | self.source_off.get(source, set())
+
+            included = self._lookup('include', keywords)
+            by_domain = self._lookup('domain', url_domains(article.get('url')))
+            for telegram_id in included | by_domain:
+                if telegram_id in excluded:
+                    continue
+                if telegram_id in self.include_users and telegram_id not in included:
+                    continue
+                if telegram_id in self.domain_users and telegram_id not in by_domain:
+                    continue
+                selective[telegram_id].append(position)
+
+            blocked.append(excluded)
+
+        for positions in selective.values():
+            positions.sort()
+        return selective, blocked
+
+    def user_articles(
+            self,
+            telegram_id: int,
+            selective: dict[int, list[int]],
+            blocked: list[set[int]],
+            everything: tuple[int, ...]
+    ) -> tuple[int, ...]:
+        """Positions of the articles this user gets, users without rules share `everything`"""
+        if telegram_id not in self.users_with_rules:
+            return everything
+        if telegram_id in self.selective_users:
+            return tuple(selective.get(telegram_id, ()))
+        return tuple(position for position in everything if telegram_id not in blocked[position])
@@ -1,68 +1,378 @@
+import asyncio
+import hashlib
+import sqlite3
 import time
-import schedule
-import requests
-
-from main import (
-    get_latest_article, url_latest_web_article, bot, url_latest_site_article,
-    logger)
-from work_with_db import get_article_ids, update_article_ids, get_all_users
-from settings import host, get_token
-
-
-def get_new_articles(url: str, last_article_id_db: int, parsing: int = 0) -> list:
-    latest_article = get_latest_article(url)
-
-    if latest_article:
-        last_article_id = latest_article.get('id')
-        new_articles = last_article_id - last_article_id_db
-        if new_articles > 0:
-            headers = {"Content-Type": "application/json; charset=utf-8",
-                       "Authorization": get_token()}
-            response = requests.get(
-                f'http://{host}:8000/api/articles/'
-                f'?parsing={parsing}'
-                f'&id_from={last_article_id_db + 1}'
-                f'&id_to={last_article_id}',
-                headers=headers
-            )
-            if response.status_code == 200:
-                return response.json()
-
-
-def send_new_articles_to_user() -> None:
-    new_articles = get_new_articles(url_latest_web_article, get_article_ids('article'))
-    parsing_articles = get_new_articles(url_latest_site_article, get_article_ids('parsingarticle'), parsing=1)
-
-    send_articles = []
-    if new_articles:
-        send_articles.extend(new_articles)
-        update_article_ids('article', new_articles[0]['id'])
-    if parsing_articles:
-        send_articles.extend(parsing_articles)
-        update_article_ids('parsingarticle', parsing_articles[-1]['id'])
-
-    for telegram_id in get_all_users():
-        for article in send_articles:
-            bot.send_message(
-                telegram_id,
-                text=f'[{article.get( "title" )}]({article.get( "url" )})',
-                parse_mode='Markdown'
-            )
-
-
-def schedule_actions():
-    schedule.every(5).minutes.do(send_new_articles_to_user)
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
-
-
-if __name__ == "__main__":
-
-    while True:
+from typing import Iterable, Iterator
+
+from api_client import api_client
+from botlog import logger
+from broadcaster import BroadcastReport, broadcaster
+from delivered_links import DeliveredLinks, generation, pack_links, url_hash
+from delivery_windows import DeliveryWindows
+from latest_cache import LatestArticles, article_rows
+from metrics import Gauge, api_requests_total, api_seconds, chats_deactivated_total
+from messages import article_link, render_digest, MESSAGE_MAX_LENGTH
+from preferences import PreferenceIndex, SOURCES
+from scheduler import AdaptiveInterval, Scheduler
+from shards import ShardLeases, shard_of
+from work_with_db import (
+    get_cursors, save_cursors, iter_user_batches, enqueue_messages, get_due_messages, settle_messages,
+    delete_old_messages, get_preference_rules, get_next_delivery_time,
+    get_delivery_windows, count_pending_messages, save_recent_articles, delete_expired_links)
+from settings import (
+    digest_mode, outbox_batch_size, outbox_max_attempts, outbox_keep_days, outbox_settle_interval, sync_interval,
+    url_changes, changes_page_size, changes_max_pages, default_timezone, startup_max_delay,
+    broadcast_rate, delivery_shards, worker_id, lease_ttl, bot_role, drain_interval, url_latest_web_article,
+    url_latest_site_article, latest_cache_ttl, recent_articles_keep, delivered_links_days, delivered_links_max,
+    sync_min_interval, sync_max_interval, sync_smoothing, sync_backoff)
+
+scheduler = Scheduler()
+poll_interval = AdaptiveInterval(sync_min_interval, sync_max_interval, sync_interval, sync_smoothing, sync_backoff)
+# delivery processes only send, the articles check stays with the main bot
+leases = ShardLeases(worker_id, delivery_shards, lease_ttl, can_sync=bot_role != 'delivery')
+Gauge('bot_scheduled_jobs', 'Jobs waiting in the scheduler.', function=lambda: len(scheduler))
+outbox_pending = Gauge('bot_outbox_pending', 'Outbox messages waiting to be sent.')
+Gauge('bot_shards_owned', 'Delivery shards this process holds a lease on.', function=lambda: len(leases.owned))
+Gauge('bot_sync_interval_seconds', 'Seconds until the next check for new articles.', function=poll_interval)
+Gauge('bot_sync_arrival_rate', 'Moving average of new articles per second.', function=lambda: poll_interval.rate)
+Gauge('bot_sync_empty_polls', 'Checks in a row that found no new articles.', function=lambda: poll_interval.empty_streak)
+Gauge('bot_sync_leader', '1 while this process checks the blog for new articles.', function=lambda: int(leases.sync))
+
+
+async def api_get_json(path: str, params: dict | None = None) -> dict | list | None:
+    """Blog API request in a worker thread, timed and counted on the event loop"""
+    start = time.perf_counter()
+    result = 'error'
+    try:
+        data = await asyncio.to_thread(api_client.get_json, path, params)
+        if data is not None:
+            result = 'ok'
+        return data
+    finally:
+        api_seconds.observe(time.perf_counter() - start, path)
+        api_requests_total.inc(path, result)
+
+
+async def get_latest_article(url: str) -> dict:
+    return await api_get_json(url)
+
+
+async def fetch_latest_articles() -> list[tuple[str, dict]]:
+    """(source, article) of the latest article of both sources that have one"""
+    articles = []
+    for source, url in (('article', url_latest_web_article), ('parsingarticle', url_latest_site_article)):
+        if article := await get_latest_article(url):
+            articles.append((source, article))
+    return articles
+
+
+latest_articles = LatestArticles(fetch_latest_articles, latest_cache_ttl, recent_articles_keep)
+
+
+async def seed_cursors() -> dict[str, str]:
+    """Start the sources the bot has no cursor for from the newest change, old articles are not sent"""
+    cursors = await asyncio.to_thread(get_cursors)
+    if all(source in cursors for source in SOURCES):
+        return cursors
+
+    page = await api_get_json(url_changes, params={'cursor': list(cursors.values()), 'start': 'latest'})
+    if page:
+        cursors = page['cursors']
+        await asyncio.to_thread(save_cursors, cursors)
+    return cursors
+
+
+async def get_new_articles(cursors: dict[str, str]) -> tuple[list[tuple[str, dict]], dict[str, str]]:
+    """
+    Page through the changes feed after the cursors, one request a page.
+    Returns (source, article) of the created articles and the cursors after them,
+    what is left after changes_max_pages is picked up by the next run.
+    """
+    articles = []
+    for _ in range(changes_max_pages):
+        page = await api_get_json(url_changes, params={'cursor': list(cursors.values()), 'limit': changes_page_size})
+        if not page:
+            break
+
+        articles.extend((change['source'], change) for change in page['results'] if change['change'] == 'created')
+        cursors = {**cursors, **page['cursors']}
+        if not page['has_more']:
+            break
+
+    return articles, cursors
+
+
+def build_messages(
+        articles: list[tuple[str, dict]],
+        user_batches: Iterable[list[int]],
+        index: PreferenceIndex,
+        windows: DeliveryWindows,
+        now: float,
+        delivered: DeliveredLinks | None = None
+) -> Iterator[list[tuple[str, int, str, float, int, bytes | None]]]:
+    """
+    Build (idempotency_key, telegram_id, text, not_before, pack, links) outbox messages for every
+    user, without the links a user already got from the other source or with another query string.
+    Yields the messages of every user batch, `links` are the hashes `delivered` records once sent.
+    """
+    selective, blocked = index.match(articles)
+    everything = tuple(range(len(articles)))
+    hashes = [url_hash(article['url']) if article.get('url') else None for _, article in articles]
+    rendered = {}
+
+    def links(positions: tuple[int, ...]) -> bytes | None:
+        return pack_links([hashes[position] for position in positions if hashes[position] is not None])
+
+    def payloads(positions: tuple[int, ...]) -> list[tuple[str, str, bytes | None]]:
+        """Render every distinct set of articles only once"""
+        if positions not in rendered:
+            if digest_mode:
+                # every part of a digest carries all of its links, they count as sent with any of them
+                rendered[positions] = [
+                    (f'digest:{hashlib.sha1(text.encode()).hexdigest()}', text, links(positions))
+                    for text in render_digest([articles[position][1] for position in positions])
+                ]
+            else:
+                rendered[positions] = [
+                    (f'{articles[position][0]}:{articles[position][1]["id"]}', article_link(articles[position][1]),
+                     links((position,)))
+                    for position in positions
+                ]
+        return rendered[positions]
+
+    def user_positions(telegram_id: int) -> tuple[int, ...]:
+        positions = index.user_articles(telegram_id, selective, blocked, everything)
+        return delivered.unseen(telegram_id, positions, hashes) if delivered else positions
+
+    for users in user_batches:
+        if delivered:
+            delivered.load(users)
+        user_payloads = [
+            (telegram_id, payloads(user_positions(telegram_id)), windows.next_delivery(telegram_id, now))
+            for telegram_id in users
+        ]
+        # one message to every user of the batch first, then the second one, a chat gets them spread out
+        yield [
+            (f'{telegram_id}:{items[number][0]}', telegram_id, items[number][1], not_before, pack, items[number][2])
+            for number in range(max((len(items) for _, items, _ in user_payloads), default=0))
+            for telegram_id, items, (not_before, pack) in user_payloads
+            if number < len(items)
+        ]
+
+
+def pack_messages(rows: list[tuple[int, int, str, float, int]]) -> list[tuple[tuple[int, ...], int, str]]:
+    """
+    Turn outbox rows into (outbox ids, telegram_id, text) messages, the held back
+    rows of a user are merged into as few messages as fit in the length limit.
+    """
+    messages = []
+    packed = {}
+    for message_id, telegram_id, text, _, pack in rows:
+        if pack:
+            packed.setdefault(telegram_id, []).append((message_id, text))
+        else:
+            messages.append(((message_id,), telegram_id, text))
+
+    for telegram_id, items in packed.items():
+        ids, current = [], ''
+        for message_id, text in items:
+            if current and len(current) + 1 + len(text) > MESSAGE_MAX_LENGTH:
+                messages.append((tuple(ids), telegram_id, current))
+                ids, current = [], ''
+            ids.append(message_id)
+            current = f'{current}\n{text}' if current else text
+        messages.append((tuple(ids), telegram_id, current))
+
+    return messages
+
+
+class Settler:
+    """
+    Records what became of the messages of a broadcast while it goes on, every
+    `interval` seconds and once more at the end, so a message Telegram took is
+    marked sent within seconds and not only after its whole batch.
+
+    Every write also checks the shard lease: once it ran out the broadcast is
+    stopped, the process that took the shard over sends the rest. A write that
+    meets a locked database is tried again, the messages are never left looking unsent.
+    """
+
+    def __init__(self, report: BroadcastReport, lease: tuple[str, str], interval: float):
+        self.report = report
+        self.lease = lease
+        self.interval = interval
+        self._done = {'delivered': 0, 'undelivered': 0, 'rejected': 0, 'dead': 0}
+        self._dead_chats: set[int] = set()
+        self._finishing = asyncio.Event()
+        self._running: asyncio.Task | None = None
+
+    async def settle(self) -> None:
+        report = self.report
+        new = {name: getattr(report, name)[start:] for name, start in self._done.items()}
+        dead_chats = report.dead_chats - self._dead_chats
+        ids = {name: [message_id for keys in items for message_id in keys] for name, items in new.items()}
+        now = time.time()
+        # the links of the messages Telegram took are remembered in the same transaction
+        delivered = DeliveredLinks(delivered_links_days, delivered_links_max, now)
+        held = await asyncio.to_thread(
+            settle_messages, ids['delivered'], ids['undelivered'], ids['rejected'], ids['dead'], dead_chats,
+            outbox_max_attempts, self.lease, now, delivered.record
+        )
+        self._done = {name: start + len(new[name]) for name, start in self._done.items()}
+        self._dead_chats |= dead_chats
+        if dead_chats:
+            chats_deactivated_total.inc(value=len(dead_chats))
+            logger.info(f'{len(dead_chats)} chats that are gone were deactivated')
+        if not held and not report.stopped:
+            logger.warning(f'Lease {self.lease[0]} ran out, its messages are left to its new holder')
+            report.stopped = 'lease lost'
+
+    async def run(self) -> None:
+        """Settle every `interval` seconds until finish()"""
+        while True:
+            try:
+                await asyncio.wait_for(self._finishing.wait(), self.interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.settle()
+            except sqlite3.OperationalError as e:
+                logger.warning(f'Sent messages were not recorded yet: {e}')
+
+    def start(self) -> None:
+        self._running = asyncio.create_task(self.run())
+
+    async def finish(self, attempts: int = 3) -> None:
+        """Wait for a settle in progress and record the rest"""
+        self._finishing.set()
+        await self._running
+        for attempt in range(attempts):
+            try:
+                await self.settle()
+                return
+            except sqlite3.OperationalError as e:
+                if attempt == attempts - 1:
+                    raise
+                logger.warning(f'Sent messages were not recorded yet: {e}')
+                await asyncio.sleep(self.interval)
+
+
+async def drain_outbox() -> None:
+    """Send outbox messages of the held shards that are due batch by batch, a restart continues from what is left"""
+    now = time.time()
+    for shard in sorted(leases.owned):
+        after = (-1.0, 0)
+        lease = leases.shard_lease(shard)
+        leases.busy = shard
         try:
-            schedule_actions()
-        except Exception as e:
-            time.sleep(5)
-            logger.error(e)
-        continue
\ No newline at end of file
+            # no rows once the shard was taken over after a lost lease
+            while shard in leases.owned and (rows := await asyncio.to_thread(
+                    get_due_messages, now, shard, after, outbox_batch_size, lease, time.time())):
+                after = (rows[-1][3], rows[-1][0])
+                report = BroadcastReport()
+                settler = Settler(report, lease, outbox_settle_interval)
+                settler.start()
+                try:
+                    await broadcaster.broadcast(pack_messages(rows), report)
+                finally:
+                    await settler.finish()
+                if report.halted:
+                    # the messages that were not tried stay pending for the next run
+                    return
+        finally:
+            leases.busy = None
+    # what got due during the drain is sent right away
+    await schedule_deliveries(after=now)
+
+
+async def schedule_deliveries(after: float | None = None) -> None:
+    """Wake up when the next held back message of the held shards gets due, that drain schedules the one after"""
+    after = time.time() if after is None else after
+    when = await asyncio.to_thread(get_next_delivery_time, sorted(leases.owned), after)
+    if when is not None:
+        scheduler.call_at(when, drain_outbox, key=('drain', when))
+
+
+async def count_outbox() -> None:
+    """Count the pending messages in a thread, a metrics scrape reports the last count"""
+    outbox_pending.set(await asyncio.to_thread(count_pending_messages))
+
+
+async def keep_leases() -> None:
+    """
+    Renew the leases three times a lease time to live, the process sends at
+    its shards' part of broadcast_rate so all of them stay within the Telegram limit.
+    """
+    try:
+        while True:
+            if leases.owned:
+                broadcaster.limiter.set_rate(broadcast_rate * len(leases.owned) / delivery_shards)
+            await asyncio.sleep(lease_ttl / 3)
+            try:
+                await asyncio.to_thread(leases.refresh)
+            except Exception:
+                logger.exception('Leases were not renewed')
+    finally:
+        await asyncio.to_thread(leases.release)
+
+
+async def send_new_articles_to_user() -> None:
+    """Check the blog and put the new articles into the outbox, only in the process that holds the sync lease"""
+    if not leases.sync:
+        return
+
+    cursors = await seed_cursors()
+    if not all(source in cursors for source in SOURCES):
+        return
+
+    send_articles, new_cursors = await get_new_articles(cursors)
+    poll_interval.update(len(send_articles), time.time())
+    if send_articles:
+        index = PreferenceIndex(await asyncio.to_thread(get_preference_rules))
+        windows = DeliveryWindows(await asyncio.to_thread(get_delivery_windows), default_timezone)
+        now = time.time()
+        delivered = DeliveredLinks(delivered_links_days, delivered_links_max, now)
+        batches = (
+            [(key, telegram_id, text, not_before, pack, shard_of(telegram_id, delivery_shards), links)
+             for key, telegram_id, text, not_before, pack, links in messages]
+            for messages in build_messages(send_articles, iter_user_batches(), index, windows, now, delivered)
+        )
+        # the batches are built in the thread too, between their transactions
+        await asyncio.to_thread(enqueue_messages, batches, new_cursors)
+        await asyncio.to_thread(save_recent_articles, article_rows(send_articles, time.time()), recent_articles_keep)
+        latest_articles.expire()
+    elif new_cursors != cursors:
+        await asyncio.to_thread(save_cursors, new_cursors)
+
+    await schedule_deliveries()
+    await asyncio.to_thread(delete_old_messages, outbox_keep_days)
+    await asyncio.to_thread(delete_expired_links, generation(time.time(), delivered_links_days) - 1)
+
+
+async def wait_for_blog(max_delay: float) -> None:
+    """Probe the blog health check with exponential backoff until it answers"""
+    delay = 0.5
+    while not await asyncio.to_thread(api_client.is_ready):
+        logger.info(f'Blog API is not ready, next try in {delay:.1f}s')
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+async def run_scheduled_tasks() -> None:
+    """
+    Take the leases and deliver what is left in the outbox of the held shards right away,
+    look for messages other processes put there every drain_interval seconds, and once
+    the blog is up check it for new articles now and then as often as they come.
+    """
+    await asyncio.to_thread(leases.refresh)
+    logger.info(f'Worker {leases.owner} holds shards {sorted(leases.owned)} of {leases.shards}'
+                + (' and checks for new articles' if leases.sync else ''))
+    renewing = asyncio.create_task(keep_leases())
+    await schedule_deliveries()
+    scheduler.call_every(drain_interval, drain_outbox)
+    scheduler.call_every(drain_interval, count_outbox)
+    running = asyncio.create_task(scheduler.run())
+    await wait_for_blog(startup_max_delay)
+    scheduler.call_every(poll_interval, send_new_articles_to_user, first=time.time())
+    await asyncio.gather(running, renewing)
@@ -0,0 +1,140 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import time
+from typing import Awaitable, Callable, Hashable
+
+from botlog import logger
+from metrics import jobs_total, job_seconds, job_lag_seconds, last_success
+
+Job = Callable[[], Awaitable[None]]
+
+
+class Scheduler:
+    """
+    Runs coroutine jobs at given wall clock times.
+
+    Jobs are kept in a heap, the loop sleeps until the earliest one is due
+    and is woken up early only when an earlier job is added. A job added
+    with a key is dropped while another job with the same key is waiting.
+
+    Every job runs in a task of its own, so a long one does not hold the
+    others up. One coroutine function runs once at a time however it was
+    scheduled, a run that gets due meanwhile starts after the running one.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._keys = set()
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._running: dict[Callable, asyncio.Lock] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def call_at(self, when: float, job: Job, key: Hashable | None = None) -> None:
+        if key is not None:
+            if key in self._keys:
+                return
+            self._keys.add(key)
+
+        heapq.heappush(self._heap, (when, next(self._counter), job, key))
+        if self._heap[0][2] is job:
+            self._wakeup.set()
+
+    def call_every(self, interval: float | Callable[[], float], job: Job, first: float | None = None) -> None:
+        """Run the job every `interval` seconds, a callable interval is asked again after every run"""
+        next_interval = interval if callable(interval) else lambda: interval
+
+        @functools.wraps(job)
+        async def periodic():
+            try:
+                await job()
+            finally:
+                self.call_at(time.time() + next_interval(), periodic)
+
+        self.call_at(first if first is not None else time.time() + next_interval(), periodic)
+
+    def next_run(self) -> float | None:
+        return self._heap[0][0] if self._heap else None
+
+    async def run(self) -> None:
+        try:
+            while True:
+                self._wakeup.clear()
+                if not self._heap:
+                    await self._wakeup.wait()
+                    continue
+
+                delay = self._heap[0][0] - time.time()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                when, _, job, key = heapq.heappop(self._heap)
+                self._keys.discard(key)
+                task = asyncio.create_task(self._run_job(when, job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+
+    async def _run_job(self, when: float, job: Job) -> None:
+        # a periodic job wraps the function call_every was given
+        async with self._running.setdefault(getattr(job, '__wrapped__', job), asyncio.Lock()):
+            name = getattr(job, '__name__', 'job')
+            start = time.time()
+            job_lag_seconds.observe(start - when)
+            try:
+                await job()
+            except Exception:
+                logger.exception('Scheduled job failed')
+                jobs_total.inc(name, 'failed')
+            else:
+                jobs_total.inc(name, 'ok')
+                last_success.set(time.time(), name)
+            job_seconds.observe(time.time() - start, name)
+
+
+class AdaptiveInterval:
+    """
+    Poll interval that follows how fast new articles come.
+
+    The arrival rate is a moving average of the articles every poll found per
+    second, the interval is the time one article takes to come at that rate.
+    Every empty poll in a row stretches it by `backoff` more, it stays between
+    `minimum` and `maximum`.
+    """
+
+    def __init__(self, minimum: float, maximum: float, initial: float, smoothing: float = 0.3,
+                 backoff: float = 1.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.interval = min(maximum, max(minimum, initial))
+        self.rate = 1 / self.interval
+        self.empty_streak = 0
+        self._last_poll: float | None = None
+
+    def __call__(self) -> float:
+        return self.interval
+
+    def update(self, count: int, now: float) -> float:
+        """Take the number of new articles a poll found at `now`, returns the next interval"""
+        elapsed = now - self._last_poll if self._last_poll is not None else self.interval
+        self._last_poll = now
+        if elapsed > 0:
+            self.rate = self.smoothing * count / elapsed + (1 - self.smoothing) * self.rate
+        self.empty_streak = 0 if count else self.empty_streak + 1
+
+        interval = 1 / self.rate if self.rate > 0 else self.maximum
+        self.interval = min(self.maximum, max(self.minimum, interval * self.backoff ** min(self.empty_streak, 50)))
+        return self.interval
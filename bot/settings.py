@@ -1,23 +1,55 @@
 import os
+import socket
 
-import requests
 from dotenv import load_dotenv
-from telebot import TeleBot
+from telebot.async_telebot import AsyncTeleBot
 
 load_dotenv()
-bot = TeleBot(os.environ.get("TELEGRAM_TOKEN"))
+bot = AsyncTeleBot(os.environ.get("TELEGRAM_TOKEN"))
 host = os.environ.get("HOST")
-url_latest_web_article = f'http://{host}:8000/api/latest_web_article/'
-url_latest_site_article = f'http://{host}:8000/api/latest_parsing_article/'
-url_get_token = f'http://{host}:8000/api/login/'
+api_base_url = f'http://{host}:8000/api/'
+url_latest_web_article = 'latest_web_article/'
+url_latest_site_article = 'latest_parsing_article/'
+url_changes = 'changes/'
+api_username = os.environ.get("API_USERNAME", "botuser")
+api_password = os.environ.get("API_PASSWORD", "botuser")
 db_name = os.environ.get("DB_NAME")
-
-
-def get_token() -> str:
-    login_data = {
-        'username': 'botuser',
-        'password': 'botuser',
-    }
-    response = requests.post(url_get_token, json=login_data)
-    if response.status_code == 200:
-        return f'Token {response.json().get("token")}'
\ No newline at end of file
+sync_interval = int(os.environ.get("SYNC_INTERVAL", 300))
+sync_min_interval = float(os.environ.get("SYNC_MIN_INTERVAL", 30))
+sync_max_interval = float(os.environ.get("SYNC_MAX_INTERVAL", 1800))
+sync_smoothing = float(os.environ.get("SYNC_SMOOTHING", 0.3))
+sync_backoff = float(os.environ.get("SYNC_BACKOFF", 1.5))
+startup_max_delay = float(os.environ.get("STARTUP_MAX_DELAY", 30))
+health_max_age = int(os.environ.get("HEALTH_MAX_AGE", 3 * max(sync_interval, sync_max_interval)))
+changes_page_size = int(os.environ.get("CHANGES_PAGE_SIZE", 100))
+changes_max_pages = int(os.environ.get("CHANGES_MAX_PAGES", 10))
+latest_cache_ttl = float(os.environ.get("LATEST_CACHE_TTL", 60))
+latest_max_count = int(os.environ.get("LATEST_MAX_COUNT", 10))
+recent_articles_keep = int(os.environ.get("RECENT_ARTICLES_KEEP", 50))
+delivered_links_days = float(os.environ.get("DELIVERED_LINKS_DAYS", 7))
+# links remembered per user and half of DELIVERED_LINKS_DAYS, above what both sources add in that time
+delivered_links_max = int(os.environ.get("DELIVERED_LINKS_MAX", 500))
+default_timezone = os.environ.get("TZ", "UTC")
+broadcast_workers = int(os.environ.get("BROADCAST_WORKERS", 32))
+broadcast_rate = float(os.environ.get("BROADCAST_RATE", 30))
+broadcast_chat_interval = float(os.environ.get("BROADCAST_CHAT_INTERVAL", 1))
+broadcast_max_retries = int(os.environ.get("BROADCAST_MAX_RETRIES", 3))
+broadcast_retry_backoff = float(os.environ.get("BROADCAST_RETRY_BACKOFF", 1))
+digest_mode = os.environ.get("DIGEST_MODE", "0") == "1"
+outbox_batch_size = int(os.environ.get("OUTBOX_BATCH_SIZE", 500))
+outbox_max_attempts = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 5))
+outbox_keep_days = int(os.environ.get("OUTBOX_KEEP_DAYS", 7))
+# seconds between two writes of what became of the messages being sent
+outbox_settle_interval = float(os.environ.get("OUTBOX_SETTLE_INTERVAL", 1))
+bot_mode = os.environ.get("BOT_MODE", "polling")
+webhook_url = os.environ.get("WEBHOOK_URL")
+webhook_secret = os.environ.get("WEBHOOK_SECRET") or None
+webhook_port = int(os.environ.get("WEBHOOK_PORT", 5009))
+webhook_workers = int(os.environ.get("WEBHOOK_WORKERS", 8))
+webhook_queue_size = int(os.environ.get("WEBHOOK_QUEUE_SIZE", 100))
+# all: Telegram updates, the articles check and delivery; delivery: only a share of the outbox
+bot_role = os.environ.get("BOT_ROLE", "all")
+delivery_shards = int(os.environ.get("DELIVERY_SHARDS", 16))
+worker_id = os.environ.get("WORKER_ID") or f'{socket.gethostname()}:{os.getpid()}'
+lease_ttl = float(os.environ.get("LEASE_TTL", 30))
+drain_interval = float(os.environ.get("DRAIN_INTERVAL", 5))
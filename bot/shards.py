@@ -0,0 +1,74 @@
+import math
+import time
+
+from work_with_db import acquire_leases, get_leases, release_leases
+
+SYNC_LEASE = 'sync'
+WORKER_LEASE = 'worker:'
+SHARD_LEASE = 'shard:'
+
+
+def shard_of(telegram_id: int, shards: int) -> int:
+    """Stable shard of a chat, Fibonacci hashing spreads consecutive ids over all shards"""
+    return ((telegram_id * 0x9E3779B1) & 0xFFFFFFFF) * shards >> 32
+
+
+class ShardLeases:
+    """
+    The delivery shards and the articles check one bot process holds.
+
+    Every process renews a worker lease, so the others know how many share
+    the work, and takes free shard leases up to a fair share. A lease that is
+    not renewed runs out after `ttl` seconds: the shards of a crashed process
+    are taken over by the others, and a process that has more than its share
+    after a new one joined gives the rest back. Only the holder of the sync
+    lease checks the blog for new articles, a process with `can_sync` off
+    never takes it.
+
+    The leases live in the bot database, so all processes must share the file.
+    """
+
+    def __init__(self, owner: str, shards: int, ttl: float, can_sync: bool = True):
+        self.owner = owner
+        self.shards = shards
+        self.ttl = ttl
+        self.can_sync = can_sync
+        self.owned: frozenset[int] = frozenset()
+        self.sync = False
+        # the shard being drained is not given back until its batch is marked
+        self.busy: int | None = None
+
+    def shard_lease(self, shard: int) -> tuple[str, str]:
+        """(name, owner) of the lease of a shard, the outbox queries check it is still held"""
+        return f'{SHARD_LEASE}{shard}', self.owner
+
+    def refresh(self, now: float | None = None) -> None:
+        """Renew the leases, take free shards up to the fair share and give back what is above it"""
+        now = time.time() if now is None else now
+        holders = get_leases(now)
+        workers = {owner for name, owner in holders.items() if name.startswith(WORKER_LEASE)} | {self.owner}
+        share = math.ceil(self.shards / len(workers))
+
+        mine = [shard for shard in range(self.shards) if holders.get(f'{SHARD_LEASE}{shard}') == self.owner]
+        free = [shard for shard in range(self.shards) if f'{SHARD_LEASE}{shard}' not in holders]
+        extra = [shard for shard in mine[share:] if shard != self.busy]
+        release_leases([f'{SHARD_LEASE}{shard}' for shard in extra], self.owner)
+        kept = [shard for shard in mine if shard not in extra]
+        wanted = kept + free[:max(0, share - len(kept))]
+
+        sync = [SYNC_LEASE] if self.can_sync else []
+        held = acquire_leases(
+            [f'{WORKER_LEASE}{self.owner}', *sync, *(f'{SHARD_LEASE}{shard}' for shard in wanted)],
+            self.owner, now + self.ttl, now
+        )
+        self.sync = SYNC_LEASE in held
+        self.owned = frozenset(int(name[len(SHARD_LEASE):]) for name in held if name.startswith(SHARD_LEASE))
+
+    def release(self) -> None:
+        """Give all leases back on shutdown, the others take over without waiting for them to run out"""
+        release_leases(
+            [f'{WORKER_LEASE}{self.owner}', SYNC_LEASE, *(f'{SHARD_LEASE}{shard}' for shard in self.owned)],
+            self.owner
+        )
+        self.owned = frozenset()
+        self.sync = False
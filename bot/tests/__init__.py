@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:test-token')
+os.environ.setdefault('DB_NAME', os.path.join(tempfile.mkdtemp(), 'test.db'))
+os.environ.setdefault('HOST', '127.0.0.1')
@@ -0,0 +1,72 @@
+from unittest.mock import Mock
+
+import requests
+
+from api_client import BlogApiClient
+from database import create_databases
+from tests.test_database import DatabaseTestCase
+from work_with_db import get_api_token, save_api_token
+
+BASE_URL = 'http://blog/api/'
+
+
+def response(status_code: int, data: dict | None = None) -> Mock:
+    return Mock(status_code=status_code, json=Mock(return_value=data or {}), url=BASE_URL)
+
+
+class BlogApiClientTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        create_databases()
+
+    def client(self) -> BlogApiClient:
+        client = BlogApiClient(BASE_URL, 'bot', 'secret')
+        client.session = Mock()
+        return client
+
+    def test_token_is_reused_after_a_restart(self):
+        save_api_token(BASE_URL, 'Token saved')
+        client = self.client()
+        client.session.get.return_value = response(200, {'id': 1})
+
+        self.assertEqual(client.get_json('articles/'), {'id': 1})
+
+        client.session.post.assert_not_called()
+        self.assertEqual(client.session.get.call_args.kwargs['headers'], {'Authorization': 'Token saved'})
+
+    def test_one_login_again_on_401(self):
+        save_api_token(BASE_URL, 'Token stale')
+        client = self.client()
+        client.session.get.side_effect = [response(401), response(200, {'id': 1})]
+        client.session.post.return_value = response(200, {'token': 'fresh'})
+
+        self.assertEqual(client.get_json('articles/'), {'id': 1})
+
+        client.session.post.assert_called_once()
+        self.assertEqual([call.kwargs['headers'] for call in client.session.get.call_args_list],
+                         [{'Authorization': 'Token stale'}, {'Authorization': 'Token fresh'}])
+        self.assertEqual(get_api_token(BASE_URL), 'Token fresh')
+
+    def test_still_401_after_the_new_login_is_not_retried_again(self):
+        client = self.client()
+        client.session.get.return_value = response(401)
+        client.session.post.return_value = response(200, {'token': 'fresh'})
+
+        self.assertIsNone(client.get_json('articles/'))
+
+        self.assertEqual(client.session.post.call_count, 2)
+        self.assertEqual(client.session.get.call_count, 2)
+
+    def test_failed_login_gives_none(self):
+        client = self.client()
+        client.session.post.return_value = response(400)
+
+        self.assertIsNone(client.login())
+        self.assertIsNone(get_api_token(BASE_URL))
+
+    def test_unreachable_blog_login_gives_none(self):
+        client = self.client()
+        client.session.post.side_effect = requests.ConnectionError
+
+        self.assertIsNone(client.login())
@@ -0,0 +1,90 @@
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from telebot.asyncio_helper import ApiTelegramException, RequestTimeout
+
+from broadcaster import Broadcaster, classify_error, FAILED, FATAL, PERMANENT, TRANSIENT
+
+
+def telegram_error(code: int, description: str, **parameters) -> ApiTelegramException:
+    result_json = {'ok': False, 'error_code': code, 'description': description}
+    if parameters:
+        result_json['parameters'] = parameters
+    return ApiTelegramException('sendMessage', None, result_json)
+
+
+class FakeBot:
+    """Answers every chat with the errors given for it, then succeeds"""
+
+    def __init__(self, errors: dict[int, list[Exception]]):
+        self.errors = errors
+        self.sent = []
+
+    async def send_message(self, chat_id: int, text: str, parse_mode: str | None = None) -> None:
+        if self.errors.get(chat_id):
+            raise self.errors[chat_id].pop(0)
+        self.sent.append(chat_id)
+
+
+class ClassifyErrorTest(TestCase):
+
+    def test_classify_error(self):
+        self.assertEqual(classify_error(telegram_error(429, 'Too Many Requests', retry_after=5)), (TRANSIENT, 5))
+        self.assertEqual(classify_error(telegram_error(502, 'Bad Gateway')), (TRANSIENT, None))
+        self.assertEqual(classify_error(RequestTimeout()), (TRANSIENT, None))
+        self.assertEqual(classify_error(telegram_error(403, 'Forbidden: bot was blocked by the user')),
+                         (PERMANENT, None))
+        self.assertEqual(classify_error(telegram_error(400, 'Bad Request: chat not found')), (PERMANENT, None))
+        self.assertEqual(classify_error(telegram_error(400, "Bad Request: can't parse entities")), (FAILED, None))
+        self.assertEqual(classify_error(telegram_error(401, 'Unauthorized')), (FATAL, None))
+
+
+class BroadcasterTest(IsolatedAsyncioTestCase):
+
+    def broadcaster(self, errors: dict[int, list[Exception]]) -> Broadcaster:
+        self.bot = FakeBot(errors)
+        return Broadcaster(self.bot, workers=4, rate=10000, chat_interval=0, max_retries=2, retry_backoff=0.01)
+
+    async def test_transient_errors_are_retried(self):
+        broadcaster = self.broadcaster({1: [telegram_error(502, 'Bad Gateway'), RequestTimeout()]})
+
+        report = await broadcaster.broadcast([('a', 1, 'text'), ('b', 2, 'text')])
+
+        self.assertEqual(sorted(report.delivered), ['a', 'b'])
+        self.assertEqual(report.retried, 2)
+
+    async def test_retries_run_out(self):
+        broadcaster = self.broadcaster({1: [telegram_error(502, 'Bad Gateway')] * 3})
+
+        report = await broadcaster.broadcast([('a', 1, 'text')])
+
+        self.assertEqual(report.undelivered, ['a'])
+        self.assertEqual(report.failed, 1)
+
+    async def test_rejected_message_is_not_retried(self):
+        broadcaster = self.broadcaster({1: [telegram_error(400, "Bad Request: can't parse entities")]})
+
+        report = await broadcaster.broadcast([('a', 1, 'text'), ('b', 2, 'text')])
+
+        self.assertEqual(report.rejected, ['a'])
+        self.assertEqual(report.undelivered, [])
+        self.assertEqual(report.retried, 0)
+        self.assertEqual(report.delivered, ['b'])
+
+    async def test_dead_chats_are_reported(self):
+        broadcaster = self.broadcaster({1: [telegram_error(403, 'Forbidden: bot was blocked by the user')]})
+
+        report = await broadcaster.broadcast([('a', 1, 'text'), ('b', 2, 'text')])
+
+        self.assertEqual(report.dead, ['a'])
+        self.assertEqual(report.dead_chats, {1})
+        self.assertEqual(report.delivered, ['b'])
+
+    async def test_fatal_error_stops_broadcast(self):
+        broadcaster = self.broadcaster({1: [telegram_error(401, 'Unauthorized')]})
+        broadcaster.workers = 1
+
+        report = await broadcaster.broadcast([('a', 1, 'text')] + [(str(chat), chat, 'text') for chat in range(2, 50)])
+
+        self.assertIsNotNone(report.fatal)
+        self.assertEqual(report.undelivered, ['a'])
+        self.assertLess(len(self.bot.sent), 48)
@@ -0,0 +1,244 @@
+import os
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+import database
+from database import MIGRATIONS, create_databases, get_connection, transaction
+from work_with_db import (
+    create_user, create_users, is_user_exist, iter_user_batches, get_all_users, get_cursors, save_cursors,
+    enqueue_messages, settle_messages, get_due_messages, get_next_delivery_time, acquire_leases,
+    add_preference_rules, get_preference_rules, set_delivery_window, get_delivery_windows)
+
+LEASE = ('shard:0', 'worker-1')
+
+
+class DatabaseTestCase(TestCase):
+    """Every test gets a fresh database file."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_name = os.path.join(self.directory.name, 'bot.db')
+        self.old_db_name = database.db_name
+        database.db_name = self.db_name
+        database._local.connection = None
+
+    def tearDown(self):
+        get_connection().close()
+        database._local.connection = None
+        database.db_name = self.old_db_name
+        self.directory.cleanup()
+
+
+class MigrationTest(DatabaseTestCase):
+
+    def test_new_database_gets_latest_version(self):
+        create_databases()
+
+        version = get_connection().execute('PRAGMA user_version;').fetchone()[0]
+        self.assertEqual(version, len(MIGRATIONS))
+
+    def test_migration_is_idempotent(self):
+        create_databases()
+        create_databases()
+
+        version = get_connection().execute('PRAGMA user_version;').fetchone()[0]
+        self.assertEqual(version, len(MIGRATIONS))
+
+    def test_processes_starting_together_migrate_once(self):
+        first = database.create_connection(self.db_name)
+        errors, versions = [], []
+
+        def start():
+            second = database.create_connection(self.db_name)
+            try:
+                database.migrate(second)
+            except sqlite3.Error as e:
+                errors.append(e)
+            versions.append(second.execute('PRAGMA user_version;').fetchone()[0])
+            second.close()
+
+        with transaction(first):
+            # the second process reads version 0 and waits for the write lock the first one holds
+            starting = threading.Thread(target=start)
+            starting.start()
+            starting.join(timeout=0.5)
+            for statements in MIGRATIONS:
+                for statement in statements:
+                    first.execute(statement)
+            first.execute(f'PRAGMA user_version = {len(MIGRATIONS)};')
+        starting.join()
+        first.close()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(versions, [len(MIGRATIONS)])
+
+    def test_duplicate_subscribers_are_merged(self):
+        old = sqlite3.connect(self.db_name)
+        old.execute('CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, telegram_id INTEGER NOT NULL);')
+        old.executemany('INSERT INTO users (telegram_id) VALUES (?);', [(1,), (2,), (1,), (1,)])
+        old.commit()
+        old.close()
+
+        create_databases()
+
+        rows = get_connection().execute('SELECT id, telegram_id FROM users ORDER BY id;').fetchall()
+        self.assertEqual(rows, [(1, 1), (2, 2)])
+
+    def test_wal_mode(self):
+        mode = get_connection().execute('PRAGMA journal_mode;').fetchone()[0]
+        self.assertEqual(mode, 'wal')
+
+
+class UserTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        create_databases()
+
+    def test_create_user_twice(self):
+        create_user(100)
+        create_user(100)
+
+        count = get_connection().execute('SELECT COUNT(*) FROM users;').fetchone()[0]
+        self.assertEqual(count, 1)
+        self.assertTrue(is_user_exist(100))
+        self.assertFalse(is_user_exist(200))
+
+    def test_create_users_in_bulk(self):
+        create_users([1, 2, 3, 2])
+
+        count = get_connection().execute('SELECT COUNT(*) FROM users;').fetchone()[0]
+        self.assertEqual(count, 3)
+
+    def test_iter_user_batches(self):
+        create_users(range(10, 35))
+
+        batches = list(iter_user_batches(batch_size=10))
+
+        self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+        self.assertEqual([telegram_id for batch in batches for telegram_id in batch], list(range(10, 35)))
+        self.assertEqual(get_all_users(), tuple(range(10, 35)))
+
+    def test_deactivated_users_are_skipped_until_they_start_again(self):
+        create_users([1, 2, 3])
+        enqueue_messages([[('1:article:1', 2, 'text', 0.0, 0, 0, None)]], {})
+
+        settle_messages([], [], [], [1], [2], 5, LEASE, now=0)
+
+        self.assertEqual(get_all_users(), (1, 3))
+        status = get_connection().execute('SELECT status FROM outbox WHERE id = 1;').fetchone()[0]
+        self.assertEqual(status, 'failed')
+        create_user(2)
+        self.assertEqual(get_all_users(), (1, 2, 3))
+
+    def test_rejected_message_is_given_up_at_once(self):
+        enqueue_messages([[('1:article:1', 1, 'text', 0.0, 0, 0, None),
+                           ('2:article:1', 2, 'text', 0.0, 0, 0, None)]], {})
+
+        settle_messages([], [1], [2], [], [], max_attempts=5, lease=LEASE, now=0)
+
+        statuses = get_connection().execute('SELECT status, attempts FROM outbox ORDER BY id;').fetchall()
+        self.assertEqual(statuses, [('pending', 1), ('failed', 1)])
+
+    def test_messages_of_a_lost_lease_are_not_due(self):
+        enqueue_messages([[('1:article:1', 1, 'text', 0.0, 0, 0, None)]], {})
+        acquire_leases([LEASE[0]], LEASE[1], expires_at=30, now=0)
+
+        self.assertEqual(len(get_due_messages(10, 0, (-1.0, 0), 10, LEASE, now=10)), 1)
+        self.assertEqual(get_due_messages(10, 0, (-1.0, 0), 10, LEASE, now=31), [])
+        self.assertEqual(get_due_messages(10, 0, (-1.0, 0), 10, ('shard:0', 'other'), now=10), [])
+
+    def test_settle_tells_whether_the_lease_is_held(self):
+        enqueue_messages([[('1:article:1', 1, 'text', 0.0, 0, 0, None)]], {})
+        acquire_leases([LEASE[0]], LEASE[1], expires_at=30, now=0)
+
+        self.assertTrue(settle_messages([1], [], [], [], [], 5, LEASE, now=10))
+        self.assertFalse(settle_messages([], [], [], [], [], 5, LEASE, now=31))
+        self.assertEqual(get_connection().execute('SELECT status FROM outbox;').fetchone()[0], 'sent')
+
+    def test_locked_database_is_not_swallowed_by_settle(self):
+        enqueue_messages([[('1:article:1', 1, 'text', 0.0, 0, 0, None)]], {})
+        other = database.create_connection(self.db_name)
+        get_connection().execute('PRAGMA busy_timeout = 50;')
+
+        with transaction(other):
+            with self.assertRaises(sqlite3.OperationalError):
+                settle_messages([1], [], [], [], [], 5, LEASE, now=0)
+        other.close()
+
+        self.assertEqual(get_connection().execute('SELECT status FROM outbox;').fetchone()[0], 'pending')
+
+    def test_rules_and_windows_read_in_a_thread(self):
+        add_preference_rules(1, 'include', ['rust'])
+        set_delivery_window(1, deliver_at=540)
+
+        with ThreadPoolExecutor(1) as executor:
+            rules = executor.submit(get_preference_rules).result()
+            windows = executor.submit(get_delivery_windows).result()
+
+        self.assertEqual(list(rules), [(1, 'include', 'rust')])
+        self.assertEqual(list(windows), [(1, None, None, None, 540)])
+
+    def test_next_delivery_time(self):
+        enqueue_messages([[('1:a', 1, 'text', 0.0, 0, 0, None), ('2:a', 2, 'text', 50.0, 1, 1, None),
+                           ('3:a', 3, 'text', 20.0, 1, 0, None), ('4:a', 4, 'text', 10.0, 1, 2, None),
+                           ('5:a', 5, 'text', 30.0, 1, 0, None)]], {})
+        settle_messages([3], [], [], [], [], 5, LEASE, now=0)
+
+        self.assertEqual(get_next_delivery_time([0, 1], after=5), 30.0)
+        self.assertEqual(get_next_delivery_time([0, 1], after=30), 50.0)
+        self.assertIsNone(get_next_delivery_time([0, 1], after=50))
+        self.assertIsNone(get_next_delivery_time([], after=0))
+
+    def test_transaction_rollback(self):
+        with self.assertRaises(RuntimeError):
+            with transaction() as connection:
+                connection.execute('INSERT INTO users (telegram_id) VALUES (5);')
+                raise RuntimeError
+
+        self.assertFalse(is_user_exist(5))
+
+
+class CursorTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        create_databases()
+
+    def test_save_cursors(self):
+        save_cursors({'article': 'a1'})
+        save_cursors({'article': 'a2', 'parsingarticle': 'p1'})
+
+        self.assertEqual(get_cursors(), {'article': 'a2', 'parsingarticle': 'p1'})
+
+    def test_cursors_move_with_enqueued_messages(self):
+        save_cursors({'article': 'a1'})
+
+        with self.assertRaises(RuntimeError):
+            def batches():
+                yield [('key1', 1, 'text', 0.0, 0, 0, None)]
+                raise RuntimeError
+            enqueue_messages(batches(), {'article': 'a2'})
+
+        self.assertEqual(get_cursors(), {'article': 'a1'})
+        enqueue_messages([[('key1', 1, 'text', 0.0, 0, 0, None)], [('key2', 1, 'text', 0.0, 0, 0, None)]],
+                         {'article': 'a2'})
+        self.assertEqual(get_cursors(), {'article': 'a2'})
+        self.assertEqual(get_connection().execute('SELECT COUNT(*) FROM outbox;').fetchone()[0], 2)
+
+    def test_handlers_write_between_batches(self):
+        def batches():
+            yield [('key1', 1, 'text', 0.0, 0, 0, None)]
+            # what a /start handler does in its thread while the fan-out goes on
+            writer = threading.Thread(target=create_user, args=(7,))
+            writer.start()
+            writer.join(timeout=5)
+            self.assertFalse(writer.is_alive())
+            yield [('key2', 2, 'text', 0.0, 0, 0, None)]
+
+        enqueue_messages(batches(), {'article': 'a2'})
+
+        self.assertTrue(is_user_exist(7))
@@ -0,0 +1,90 @@
+from array import array
+from unittest import TestCase
+
+from database import create_databases, get_connection
+from delivered_links import DeliveredLinks, normalize_url, url_hash
+from delivery_windows import DeliveryWindows
+from preferences import PreferenceIndex
+from scheduled_tasks import build_messages
+from tests.test_database import LEASE, DatabaseTestCase
+from work_with_db import enqueue_messages, settle_messages
+
+DAY = 86400
+ARTICLES = [
+    ('article', {'id': 1, 'title': 'Rust in the kernel', 'url': 'https://lwn.net/Articles/1/'}),
+    ('parsingarticle', {'id': 7, 'title': 'Rust in the kernel', 'url': 'http://www.lwn.net/Articles/1?utm_source=hn'}),
+    ('parsingarticle', {'id': 8, 'title': 'Python packaging', 'url': 'https://blog.python.org/2024/'}),
+]
+
+
+class NormalizeUrlTest(TestCase):
+
+    def test_same_link_written_differently(self):
+        self.assertEqual(normalize_url('https://www.Example.com/a/?b=2&a=1&utm_medium=x#top'),
+                         normalize_url('http://example.com/a?a=1&b=2&fbclid=abc'))
+
+    def test_different_links(self):
+        self.assertNotEqual(normalize_url('https://news.ycombinator.com/item?id=1'),
+                            normalize_url('https://news.ycombinator.com/item?id=2'))
+        self.assertNotEqual(normalize_url('https://example.com:8443/a'), normalize_url('https://example.com/a'))
+
+
+class DeliveredLinksTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        create_databases()
+
+    def build(self, articles: list, now: float) -> list[str]:
+        """Queue the messages of the articles for users 10 and 20, returns their keys"""
+        delivered = DeliveredLinks(days=2, max_links=500, now=now)
+        keys = []
+        for batch in build_messages(articles, [[10, 20]], PreferenceIndex([]), DeliveryWindows([], 'UTC'), now, delivered):
+            enqueue_messages([[(*message[:5], 0, message[5]) for message in batch]], {})
+            keys.extend(message[0] for message in batch)
+        return keys
+
+    def settle(self, now: float, sent: bool = True, max_links: int = 500) -> None:
+        """Record the pending messages as sent, or as rejected by Telegram"""
+        pending = [row[0] for row in get_connection().execute("SELECT id FROM outbox WHERE status = 'pending';")]
+        delivered = DeliveredLinks(days=2, max_links=max_links, now=now)
+        settle_messages(pending if sent else [], [], [] if sent else pending, [], [], 5, LEASE, now, delivered.record)
+
+    def test_link_from_the_other_source_is_skipped(self):
+        self.assertEqual(self.build(ARTICLES, now=0),
+                         ['10:article:1', '20:article:1', '10:parsingarticle:8', '20:parsingarticle:8'])
+
+    def test_link_is_remembered_once_sent(self):
+        self.build(ARTICLES[:1], now=0)
+        self.settle(now=1)
+
+        self.assertEqual(self.build(ARTICLES[1:], now=DAY + 1), ['10:parsingarticle:8', '20:parsingarticle:8'])
+
+    def test_link_waiting_in_the_outbox_is_skipped(self):
+        self.build(ARTICLES[:1], now=0)
+
+        self.assertEqual(self.build(ARTICLES[1:], now=1), ['10:parsingarticle:8', '20:parsingarticle:8'])
+
+    def test_link_of_a_message_that_never_got_through_is_sent_again(self):
+        self.build(ARTICLES[:1], now=0)
+        self.settle(now=1, sent=False)
+
+        self.assertEqual(self.build(ARTICLES[1:2], now=2), ['10:parsingarticle:7', '20:parsingarticle:7'])
+        self.assertEqual(get_connection().execute('SELECT COUNT(*) FROM delivered_links;').fetchone()[0], 0)
+
+    def test_link_is_forgotten_after_two_generations(self):
+        self.build(ARTICLES[:1], now=0)
+        self.settle(now=1)
+
+        self.assertEqual(self.build(ARTICLES[1:2], now=2 * DAY + 1), ['10:parsingarticle:7', '20:parsingarticle:7'])
+
+    def test_row_size_is_bounded(self):
+        articles = [('parsingarticle', {'id': number, 'title': 't', 'url': f'https://example.com/{number}'})
+                    for number in range(10)]
+
+        self.build(articles, now=0)
+        self.settle(now=1, max_links=4)
+
+        current = get_connection().execute('SELECT current FROM delivered_links WHERE telegram_id = 10;').fetchone()[0]
+        self.assertEqual(array('Q', current).tolist(),
+                         [url_hash(f'https://example.com/{number}') for number in range(6, 10)])
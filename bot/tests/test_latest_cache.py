@@ -0,0 +1,99 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from database import create_databases
+from latest_cache import LatestArticles, article_rows
+from tests.test_database import DatabaseTestCase
+from work_with_db import get_recent_articles, save_recent_articles
+
+
+class RecentArticlesTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        create_databases()
+
+    def test_only_the_newest_are_kept(self):
+        save_recent_articles([('article', number, f'a{number}', f'https://a/{number}', float(number))
+                              for number in range(10)], keep=3)
+
+        self.assertEqual([row[1] for row in get_recent_articles(10)], [9, 8, 7])
+
+    def test_a_crawl_does_not_push_the_other_source_out(self):
+        save_recent_articles([('article', 1, 'Blog', 'https://a/1', 1.0)], keep=3)
+        save_recent_articles([('parsingarticle', number, f'p{number}', f'https://p/{number}', 10.0 + number)
+                              for number in range(10)], keep=3)
+
+        self.assertEqual([row[:2] for row in get_recent_articles(3)],
+                         [('parsingarticle', 9), ('parsingarticle', 8), ('parsingarticle', 7), ('article', 1)])
+
+    def test_saved_again_keeps_its_date(self):
+        save_recent_articles([('article', 1, 'old', 'https://a/1', 10.0)], keep=3)
+        save_recent_articles([('article', 1, 'new', 'https://a/1', 20.0)], keep=3)
+
+        self.assertEqual(get_recent_articles(1), [('article', 1, 'new', 'https://a/1', 10.0)])
+
+    def test_article_rows(self):
+        rows = article_rows([
+            ('article', {'id': 1, 'title': 't', 'url': 'u', 'publication_date': '2024-01-01T00:00:00Z'}),
+            ('parsingarticle', {'id': 2, 'title': 'p', 'url': 'v'}),
+        ], now=5.0)
+
+        self.assertEqual(rows, [('article', 1, 't', 'u', 1704067200.0), ('parsingarticle', 2, 'p', 'v', 5.0)])
+
+
+class LatestArticlesTest(DatabaseTestCase, IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        super().setUp()
+        create_databases()
+        save_recent_articles([('parsingarticle', 1, 'Parsed', 'https://p/1', 2.0),
+                              ('article', 1, 'Blog', 'https://a/1', 1.0)], keep=10)
+        self.fetches = 0
+        self.fetched = []
+
+    async def fetch(self):
+        self.fetches += 1
+        await asyncio.sleep(0.01)
+        return self.fetched
+
+    async def test_answers_come_from_memory_within_ttl(self):
+        cache = LatestArticles(self.fetch, ttl=60, keep=10)
+
+        first = await cache.get(1, source='article')
+        newest = await asyncio.gather(*(cache.get(2) for _ in range(10)))
+
+        self.assertEqual(first, [('article', {'id': 1, 'title': 'Blog', 'url': 'https://a/1'})])
+        self.assertEqual([source for source, _ in newest[0]], ['parsingarticle', 'article'])
+        self.assertEqual(self.fetches, 1)
+
+    async def test_stale_answer_is_served_while_revalidating(self):
+        cache = LatestArticles(self.fetch, ttl=0, keep=10)
+        await cache.get(1)
+        self.fetched = [('article', {'id': 2, 'title': 'Newer', 'url': 'https://a/2',
+                                     'publication_date': '2030-01-01T00:00:00+00:00'})]
+
+        stale = await cache.get(1)
+        await asyncio.sleep(0.05)
+        fresh = await cache.get(1)
+
+        self.assertEqual(stale[0][1]['title'], 'Parsed')
+        self.assertEqual(fresh[0][1]['title'], 'Newer')
+
+    async def test_blog_article_survives_more_than_keep_parsed_articles(self):
+        self.fetched = [('article', {'id': 2, 'title': 'Blog 2', 'url': 'https://a/2',
+                                     'publication_date': '1970-01-01T00:00:03Z'})]
+        save_recent_articles([('parsingarticle', number, f'p{number}', f'https://p/{number}', 100.0 + number)
+                              for number in range(20)], keep=10)
+        cache = LatestArticles(self.fetch, ttl=60, keep=10)
+
+        self.assertEqual(await cache.get(1, source='article'), [('article', {'id': 2, 'title': 'Blog 2',
+                                                                             'url': 'https://a/2'})])
+
+    async def test_failed_fetch_falls_back_to_the_table(self):
+        async def broken():
+            raise ConnectionError
+
+        cache = LatestArticles(broken, ttl=60, keep=10)
+
+        self.assertEqual((await cache.get(1))[0][1]['title'], 'Parsed')
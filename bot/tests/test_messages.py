@@ -0,0 +1,62 @@
+from unittest import TestCase
+
+from messages import MESSAGE_MAX_LENGTH, article_link, escape_text, escape_url, render_digest
+
+SPECIAL = '_*[]()~`>#+-=|{}.!\\'
+
+
+def article(title_length: int, url: str = 'https://e.co/') -> dict:
+    """The link of the article is title_length + len(url) + 4 characters long"""
+    return {'title': 'a' * title_length, 'url': url}
+
+
+class EscapeTest(TestCase):
+
+    def test_every_special_character_of_a_title_is_escaped(self):
+        self.assertEqual(escape_text(SPECIAL), ''.join(f'\\{char}' for char in SPECIAL))
+
+    def test_plain_text_is_kept(self):
+        self.assertEqual(escape_text('Rust 2024: what is new, and why?'), 'Rust 2024: what is new, and why?')
+
+    def test_only_parenthesis_and_backslash_of_a_url_are_escaped(self):
+        self.assertEqual(escape_url('https://en.wikipedia.org/wiki/Go_(game)?a=1&b=*\\x'),
+                         'https://en.wikipedia.org/wiki/Go_(game\\)?a=1&b=*\\\\x')
+
+    def test_article_link(self):
+        self.assertEqual(article_link({'title': 'C++ [draft] (v2.0)!', 'url': 'https://e.co/a_(b)'}),
+                         '[C\\+\\+ \\[draft\\] \\(v2\\.0\\)\\!](https://e.co/a_(b\\))')
+
+    def test_article_without_a_title_shows_its_url(self):
+        self.assertEqual(article_link({'title': '', 'url': 'https://e.co/a.b'}), '[https://e\\.co/a\\.b](https://e.co/a.b)')
+
+
+class RenderDigestTest(TestCase):
+
+    def test_lines_that_fill_the_limit_exactly_stay_in_one_message(self):
+        # two links of 2047 and 2048 characters and the newline between them
+        articles = [article(2047 - 17), article(2048 - 17)]
+
+        chunks = render_digest(articles)
+
+        self.assertEqual([len(chunk) for chunk in chunks], [MESSAGE_MAX_LENGTH])
+
+    def test_one_character_more_starts_a_new_message(self):
+        articles = [article(2047 - 17), article(2049 - 17)]
+
+        chunks = render_digest(articles)
+
+        self.assertEqual([len(chunk) for chunk in chunks], [2047, 2049])
+
+    def test_no_message_exceeds_the_limit(self):
+        articles = [{'title': f'{number} {SPECIAL}', 'url': f'https://e.co/{number})'} for number in range(500)]
+
+        chunks = render_digest(articles)
+
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= MESSAGE_MAX_LENGTH for chunk in chunks))
+        self.assertEqual(sum(chunk.count('\n') + 1 for chunk in chunks), 500)
+
+    def test_too_long_title_is_cut(self):
+        chunks = render_digest([article(5000)], limit=100)
+
+        self.assertEqual(chunks, [f'[{"a" * 25}](https://e.co/)'])
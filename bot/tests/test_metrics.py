@@ -0,0 +1,75 @@
+import time
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+import aiohttp
+from aiohttp import web
+
+import metrics
+from metrics import Counter, Histogram
+
+
+class MetricTest(TestCase):
+
+    def test_counter(self):
+        counter = Counter('test_total', 'Test counter.', ('result',), registry=[])
+        counter.inc('ok')
+        counter.inc('ok', value=2)
+        counter.inc('a "quoted"\nvalue')
+
+        self.assertEqual(counter.render().splitlines(), [
+            '# HELP test_total Test counter.',
+            '# TYPE test_total counter',
+            'test_total{result="ok"} 3',
+            'test_total{result="a \\"quoted\\"\\nvalue"} 1',
+        ])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('test_seconds', 'Test histogram.', buckets=(0.1, 1), registry=[])
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.samples(), [
+            'test_seconds_bucket{le="0.1"} 2',
+            'test_seconds_bucket{le="1.0"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 3.65',
+            'test_seconds_count 4',
+        ])
+
+
+class MetricsServerTest(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.app = web.Application()
+        metrics.add_routes(self.app, 'test_job', max_age=60)
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}'
+        self.session = aiohttp.ClientSession()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.runner.cleanup()
+        metrics.last_success.values.pop(('test_job',), None)
+
+    async def test_metrics(self):
+        metrics.messages_total.inc('sent')
+
+        async with self.session.get(self.url + '/metrics') as response:
+            text = await response.text()
+
+        self.assertEqual(response.status, 200)
+        self.assertIn('# TYPE bot_messages_total counter', text)
+        self.assertIn('bot_messages_total{result="sent"}', text)
+
+    async def test_healthz(self):
+        metrics.last_success.set(time.time(), 'test_job')
+        async with self.session.get(self.url + '/healthz') as response:
+            self.assertEqual(response.status, 200)
+
+        metrics.last_success.set(time.time() - 120, 'test_job')
+        async with self.session.get(self.url + '/healthz') as response:
+            self.assertEqual(response.status, 503)
+            self.assertEqual((await response.json())['status'], 'stale')
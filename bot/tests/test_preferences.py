@@ -0,0 +1,75 @@
+from unittest import TestCase
+
+from delivery_windows import DeliveryWindows
+from preferences import PreferenceIndex, is_keyword, title_keywords, url_domains
+from scheduled_tasks import build_messages
+
+ARTICLES = [
+    ('article', {'id': 1, 'title': 'Django tips', 'url': 'http://127.0.0.1:8000/web/article_detail/1'}),
+    ('parsingarticle', {'id': 7, 'title': 'Rust in the kernel', 'url': 'https://lwn.net/Articles/1/'}),
+    ('parsingarticle', {'id': 8, 'title': 'Python packaging', 'url': 'https://blog.python.org/2024/'}),
+]
+
+
+class PreferenceIndexTest(TestCase):
+
+    def user_articles(self, index: PreferenceIndex, telegram_id: int) -> tuple:
+        selective, blocked = index.match(ARTICLES)
+        return index.user_articles(telegram_id, selective, blocked, tuple(range(len(ARTICLES))))
+
+    def test_user_without_rules_gets_everything(self):
+        index = PreferenceIndex([(2, 'include', 'rust')])
+
+        self.assertEqual(self.user_articles(index, 1), (0, 1, 2))
+
+    def test_source_off(self):
+        index = PreferenceIndex([(1, 'source_off', 'parsingarticle')])
+
+        self.assertEqual(self.user_articles(index, 1), (0,))
+
+    def test_include_keyword(self):
+        index = PreferenceIndex([(1, 'include', 'rust'), (1, 'include', 'python')])
+
+        self.assertEqual(self.user_articles(index, 1), (1, 2))
+
+    def test_exclude_keyword(self):
+        index = PreferenceIndex([(1, 'exclude', 'django')])
+
+        self.assertEqual(self.user_articles(index, 1), (1, 2))
+
+    def test_domain_matches_subdomains(self):
+        index = PreferenceIndex([(1, 'domain', 'python.org')])
+
+        self.assertEqual(self.user_articles(index, 1), (2,))
+
+    def test_include_and_domain_must_both_match(self):
+        index = PreferenceIndex([(1, 'include', 'rust'), (1, 'domain', 'python.org')])
+
+        self.assertEqual(self.user_articles(index, 1), ())
+
+    def test_exclude_wins_over_include(self):
+        index = PreferenceIndex([(1, 'include', 'python'), (1, 'exclude', 'packaging')])
+
+        self.assertEqual(self.user_articles(index, 1), ())
+
+    def test_keywords_are_the_words_of_titles(self):
+        self.assertEqual(title_keywords('Node.js 22 and C++ in_depth'), {'node', 'js', '22', 'and', 'c', 'in_depth'})
+        self.assertTrue(all(is_keyword(keyword) for keyword in ['rust', '22', 'in_depth', 'ядро']))
+        self.assertFalse(any(is_keyword(value) for value in ['c++', 'node.js', 'c#', '']))
+
+    def test_url_domains(self):
+        self.assertEqual(url_domains('https://www.Blog.Python.org/x'), ['blog.python.org', 'python.org', 'org'])
+
+
+class BuildMessagesTest(TestCase):
+
+    def test_messages_follow_preferences(self):
+        index = PreferenceIndex([(20, 'include', 'rust'), (30, 'source_off', 'parsingarticle')])
+
+        messages = [message for batch in build_messages(ARTICLES, [[10, 20, 30]], index, DeliveryWindows([], 'UTC'), 0)
+                    for message in batch]
+
+        self.assertEqual(
+            [message[0] for message in messages],
+            ['10:article:1', '20:parsingarticle:7', '30:article:1', '10:parsingarticle:7', '10:parsingarticle:8']
+        )
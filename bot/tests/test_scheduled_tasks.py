@@ -0,0 +1,203 @@
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from broadcaster import BroadcastReport
+from database import create_databases, get_connection
+from scheduled_tasks import drain_outbox, get_new_articles, seed_cursors
+from scheduler import Scheduler
+from shards import ShardLeases
+from tests.test_database import DatabaseTestCase
+from work_with_db import create_users, enqueue_messages, get_all_users, get_cursors, save_cursors
+
+
+def change(source: str, pk: int, kind: str = 'created') -> dict:
+    return {'source': source, 'id': pk, 'title': f'{source} {pk}', 'url': f'https://{source}/{pk}', 'change': kind}
+
+
+class FakeChanges:
+    """The changes feed: the page after the cursors the bot sends, pages are chained by their cursors"""
+
+    def __init__(self, pages: list[dict]):
+        self.pages = pages
+        self.requests = []
+
+    def get_json(self, path: str, params: dict | None = None) -> dict | None:
+        self.requests.append(params)
+        if params.get('start') == 'latest':
+            return {'results': [], 'cursors': {'article': 'a-head', 'parsingarticle': 'p-head'}, 'has_more': False}
+        cursors = sorted(params['cursor'])
+        for page in self.pages:
+            if page['after'] == cursors:
+                return page
+        return None
+
+
+class ScheduledTasksTestCase(DatabaseTestCase, IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        super().setUp()
+        create_databases()
+
+
+class GetNewArticlesTest(ScheduledTasksTestCase):
+    pages = [
+        {'after': ['a0', 'p0'], 'results': [change('article', 1), change('parsingarticle', 1, 'updated')],
+         'cursors': {'article': 'a1', 'parsingarticle': 'p1'}, 'has_more': True},
+        {'after': ['a1', 'p1'], 'results': [change('parsingarticle', 2), change('parsingarticle', 3)],
+         'cursors': {'article': 'a1', 'parsingarticle': 'p3'}, 'has_more': True},
+        {'after': ['a1', 'p3'], 'results': [change('article', 2)],
+         'cursors': {'article': 'a2', 'parsingarticle': 'p3'}, 'has_more': False},
+    ]
+
+    async def test_pages_are_read_by_their_cursors(self):
+        blog = FakeChanges(self.pages)
+        with patch('scheduled_tasks.api_client', blog):
+            articles, cursors = await get_new_articles({'article': 'a0', 'parsingarticle': 'p0'})
+
+        self.assertEqual([(source, article['id']) for source, article in articles],
+                         [('article', 1), ('parsingarticle', 2), ('parsingarticle', 3), ('article', 2)])
+        self.assertEqual(cursors, {'article': 'a2', 'parsingarticle': 'p3'})
+        self.assertEqual(len(blog.requests), 3)
+
+    async def test_pages_over_the_limit_are_left_to_the_next_run(self):
+        blog = FakeChanges(self.pages)
+        with patch('scheduled_tasks.api_client', blog), patch('scheduled_tasks.changes_max_pages', 2):
+            first, cursors = await get_new_articles({'article': 'a0', 'parsingarticle': 'p0'})
+            second, cursors = await get_new_articles(cursors)
+
+        self.assertEqual([article['id'] for _, article in first], [1, 2, 3])
+        self.assertEqual([article['id'] for _, article in second], [2])
+        self.assertEqual(cursors, {'article': 'a2', 'parsingarticle': 'p3'})
+
+    async def test_failed_page_keeps_the_cursors_of_the_pages_before(self):
+        blog = FakeChanges(self.pages[:1])
+        with patch('scheduled_tasks.api_client', blog):
+            articles, cursors = await get_new_articles({'article': 'a0', 'parsingarticle': 'p0'})
+
+        self.assertEqual([article['id'] for _, article in articles], [1])
+        self.assertEqual(cursors, {'article': 'a1', 'parsingarticle': 'p1'})
+
+
+class SeedCursorsTest(ScheduledTasksTestCase):
+
+    async def test_new_bot_starts_from_the_newest_change(self):
+        blog = FakeChanges([])
+        with patch('scheduled_tasks.api_client', blog):
+            cursors = await seed_cursors()
+
+        self.assertEqual(cursors, {'article': 'a-head', 'parsingarticle': 'p-head'})
+        self.assertEqual(get_cursors(), cursors)
+        self.assertEqual(blog.requests, [{'cursor': [], 'start': 'latest'}])
+
+    async def test_saved_cursors_are_kept(self):
+        save_cursors({'article': 'a1', 'parsingarticle': 'p1'})
+        blog = FakeChanges([])
+        with patch('scheduled_tasks.api_client', blog):
+            cursors = await seed_cursors()
+
+        self.assertEqual(cursors, {'article': 'a1', 'parsingarticle': 'p1'})
+        self.assertEqual(blog.requests, [])
+
+    async def test_blog_down_leaves_the_cursors_unset(self):
+        blog = FakeChanges([])
+        blog.get_json = lambda path, params=None: None
+        with patch('scheduled_tasks.api_client', blog):
+            cursors = await seed_cursors()
+
+        self.assertEqual(cursors, {})
+        self.assertEqual(get_cursors(), {})
+
+
+class FakeBroadcaster:
+    """
+    Ends every message the way given for its chat, delivered by default, and remembers
+    what it was given. With `crash_after` it raises once that many messages were delivered.
+    """
+
+    def __init__(self, outcomes: dict[int, str] | None = None, crash_after: int | None = None):
+        self.outcomes = outcomes or {}
+        self.crash_after = crash_after
+        self.batches = []
+        self.delivered = 0
+
+    async def broadcast(self, messages: list, report: BroadcastReport) -> BroadcastReport:
+        self.batches.append([chat_id for _, chat_id, _ in messages])
+        for key, chat_id, text in messages:
+            if report.halted:
+                break
+            if self.delivered == self.crash_after:
+                raise RuntimeError('the process is killed')
+            outcome = self.outcomes.get(chat_id, 'delivered')
+            self.delivered += outcome == 'delivered'
+            if outcome == 'fatal':
+                report.fatal = 'Unauthorized'
+                break
+            getattr(report, outcome).append(key)
+            if outcome == 'dead':
+                report.dead_chats.add(chat_id)
+        return report
+
+
+class DrainOutboxTest(ScheduledTasksTestCase):
+    chats = [1, 2, 3, 4, 5]
+
+    def setUp(self):
+        super().setUp()
+        self.leases = ShardLeases('worker-1', shards=1, ttl=30)
+        for name, value in (('leases', self.leases), ('scheduler', Scheduler()), ('outbox_batch_size', 2),
+                            ('outbox_settle_interval', 0.01)):
+            patcher = patch(f'scheduled_tasks.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.leases.refresh()
+        create_users(self.chats)
+        enqueue_messages([[(f'{chat}:article:1', chat, f'text {chat}', 0.0, 0, 0, None) for chat in self.chats]], {})
+
+    async def drain(self, fake: FakeBroadcaster) -> FakeBroadcaster:
+        with patch('scheduled_tasks.broadcaster', fake):
+            await drain_outbox()
+        return fake
+
+    def outbox(self) -> dict[int, tuple[str, int]]:
+        return {telegram_id: (status, attempts) for telegram_id, status, attempts in
+                get_connection().execute('SELECT telegram_id, status, attempts FROM outbox;')}
+
+    async def test_every_outcome_is_recorded(self):
+        fake = await self.drain(FakeBroadcaster({2: 'undelivered', 3: 'rejected', 4: 'dead'}))
+
+        self.assertEqual(fake.batches, [[1, 2], [3, 4], [5]])
+        self.assertEqual(self.outbox(), {1: ('sent', 0), 2: ('pending', 1), 3: ('failed', 1), 4: ('failed', 0),
+                                         5: ('sent', 0)})
+        self.assertEqual(get_all_users(), (1, 2, 3, 5))
+
+    async def test_undelivered_message_is_not_read_again_in_the_same_drain(self):
+        fake = await self.drain(FakeBroadcaster({1: 'undelivered', 2: 'undelivered'}))
+
+        self.assertEqual(fake.batches, [[1, 2], [3, 4], [5]])
+        second = await self.drain(FakeBroadcaster())
+        self.assertEqual(second.batches, [[1, 2]])
+        self.assertEqual({status for status, _ in self.outbox().values()}, {'sent'})
+
+    async def test_fatal_error_stops_the_drain(self):
+        fake = await self.drain(FakeBroadcaster({2: 'fatal'}))
+
+        self.assertEqual(fake.batches, [[1, 2]])
+        self.assertEqual(self.outbox(), {1: ('sent', 0), 2: ('pending', 0), 3: ('pending', 0), 4: ('pending', 0),
+                                         5: ('pending', 0)})
+
+    async def test_restart_sends_only_what_was_not_sent(self):
+        with self.assertRaises(RuntimeError):
+            await self.drain(FakeBroadcaster(crash_after=3))
+
+        self.assertEqual([chat for chat, (status, _) in self.outbox().items() if status == 'sent'], [1, 2, 3])
+        second = await self.drain(FakeBroadcaster())
+        self.assertEqual(second.batches, [[4, 5]])
+        self.assertEqual({status for status, _ in self.outbox().values()}, {'sent'})
+
+    async def test_lost_lease_stops_the_drain(self):
+        get_connection().execute("UPDATE leases SET expires_at = 0 WHERE name = 'shard:0';")
+
+        fake = await self.drain(FakeBroadcaster())
+
+        self.assertEqual(fake.batches, [])
+        self.assertEqual({status for status, _ in self.outbox().values()}, {'pending'})
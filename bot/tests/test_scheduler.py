@@ -0,0 +1,173 @@
+import asyncio
+import time
+from datetime import datetime
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import AsyncMock, patch
+from zoneinfo import ZoneInfo
+
+from delivery_windows import DeliveryWindows, parse_time
+from scheduled_tasks import pack_messages, wait_for_blog
+from scheduler import AdaptiveInterval, Scheduler
+
+
+class SchedulerTest(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.scheduler = Scheduler()
+        self.calls = []
+        self.task = asyncio.create_task(self.scheduler.run())
+
+    async def asyncTearDown(self):
+        self.task.cancel()
+
+    def job(self, name: str):
+        async def run():
+            self.calls.append(name)
+        return run
+
+    async def test_jobs_run_in_time_order(self):
+        now = time.time()
+        self.scheduler.call_at(now + 0.06, self.job('second'))
+        self.scheduler.call_at(now + 0.03, self.job('first'))
+        self.scheduler.call_at(now - 1, self.job('due'))
+
+        await asyncio.sleep(0.15)
+
+        self.assertEqual(self.calls, ['due', 'first', 'second'])
+
+    async def test_earlier_job_wakes_up_the_loop(self):
+        self.scheduler.call_at(time.time() + 60, self.job('later'))
+        await asyncio.sleep(0.01)
+        self.scheduler.call_at(time.time(), self.job('now'))
+
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(self.calls, ['now'])
+        self.assertEqual(len(self.scheduler), 1)
+
+    async def test_same_key_is_scheduled_once(self):
+        when = time.time() + 0.02
+        self.scheduler.call_at(when, self.job('drain'), key='drain')
+        self.scheduler.call_at(when, self.job('drain'), key='drain')
+
+        await asyncio.sleep(0.08)
+
+        self.assertEqual(self.calls, ['drain'])
+
+    async def test_long_job_does_not_hold_the_others_up(self):
+        async def drain():
+            self.calls.append('drain')
+            await asyncio.sleep(60)
+
+        self.scheduler.call_at(time.time(), drain)
+        self.scheduler.call_at(time.time() + 0.02, self.job('sync'))
+
+        await asyncio.sleep(0.08)
+
+        self.assertEqual(self.calls, ['drain', 'sync'])
+
+    async def test_job_runs_once_at_a_time(self):
+        running = []
+
+        async def drain():
+            running.append(1)
+            self.calls.append(len(running))
+            await asyncio.sleep(0.03)
+            running.pop()
+
+        self.scheduler.call_every(0.01, drain, first=time.time())
+        self.scheduler.call_at(time.time() + 0.01, drain, key=('drain', 1))
+        self.scheduler.call_at(time.time() + 0.02, drain, key=('drain', 2))
+
+        await asyncio.sleep(0.15)
+
+        self.assertGreater(len(self.calls), 3)
+        self.assertEqual(set(self.calls), {1})
+
+    async def test_failed_periodic_job_is_scheduled_again(self):
+        async def failing():
+            self.calls.append('run')
+            raise RuntimeError
+
+        self.scheduler.call_every(0.02, failing, first=time.time())
+
+        await asyncio.sleep(0.1)
+
+        self.assertGreater(len(self.calls), 2)
+
+    async def test_interval_is_asked_after_every_run(self):
+        intervals = iter([0.01, 0.01, 60])
+        self.scheduler.call_every(lambda: next(intervals), self.job('poll'), first=time.time())
+
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(self.calls, ['poll'] * 3)
+
+
+class AdaptiveIntervalTest(TestCase):
+
+    def test_busy_source_is_polled_more_often(self):
+        interval = AdaptiveInterval(minimum=30, maximum=1800, initial=300)
+
+        self.assertEqual(interval.update(1, now=300), 300)
+        self.assertLess(interval.update(10, now=600), 100)
+        self.assertEqual(interval.empty_streak, 0)
+
+    def test_empty_polls_back_off_up_to_maximum(self):
+        interval = AdaptiveInterval(minimum=30, maximum=1800, initial=300)
+        now, intervals = 0, []
+        for _ in range(5):
+            now += interval()
+            intervals.append(interval.update(0, now))
+
+        self.assertEqual(intervals, sorted(intervals))
+        self.assertEqual(intervals[-1], 1800)
+        self.assertEqual(interval.empty_streak, 5)
+
+    def test_interval_stays_above_minimum(self):
+        interval = AdaptiveInterval(minimum=30, maximum=1800, initial=300)
+
+        self.assertEqual(interval.update(1000, now=300), 30)
+
+
+class DeliveryWindowsTest(TestCase):
+
+    def timestamp(self, hour: int, minute: int) -> float:
+        return datetime(2024, 6, 1, hour, minute, tzinfo=ZoneInfo('Europe/Kyiv')).timestamp()
+
+    def test_user_without_window(self):
+        windows = DeliveryWindows([], 'Europe/Kyiv')
+
+        self.assertEqual(windows.next_delivery(1, self.timestamp(3, 0)), (0.0, 0))
+
+    def test_quiet_hours_over_midnight(self):
+        windows = DeliveryWindows([(1, None, parse_time('23:00'), parse_time('07:00'), None)], 'Europe/Kyiv')
+
+        self.assertEqual(windows.next_delivery(1, self.timestamp(3, 0)), (self.timestamp(7, 0), 1))
+        self.assertEqual(windows.next_delivery(1, self.timestamp(12, 0)), (0.0, 0))
+
+    def test_daily_delivery_in_user_time_zone(self):
+        windows = DeliveryWindows([(1, 'UTC', None, None, parse_time('09:00'))], 'Europe/Kyiv')
+
+        not_before, pack = windows.next_delivery(1, self.timestamp(13, 0))
+
+        self.assertEqual(not_before, datetime(2024, 6, 2, 9, 0, tzinfo=ZoneInfo('UTC')).timestamp())
+        self.assertEqual(pack, 1)
+
+
+class PackMessagesTest(TestCase):
+
+    def test_held_back_messages_are_merged(self):
+        rows = [(1, 10, 'a', 0.0, 0), (2, 20, 'b', 5.0, 1), (3, 20, 'c', 5.0, 1), (4, 10, 'd', 0.0, 0)]
+
+        self.assertEqual(pack_messages(rows), [((1,), 10, 'a'), ((4,), 10, 'd'), ((2, 3), 20, 'b\nc')])
+
+
+class WaitForBlogTest(IsolatedAsyncioTestCase):
+
+    async def test_backoff_until_blog_answers(self):
+        with patch('scheduled_tasks.api_client.is_ready', side_effect=[False] * 5 + [True]), \
+                patch('scheduled_tasks.asyncio.sleep', new_callable=AsyncMock) as sleep:
+            await wait_for_blog(max_delay=4)
+
+        self.assertEqual([call.args[0] for call in sleep.await_args_list], [0.5, 1, 2, 4, 4])
@@ -0,0 +1,85 @@
+from collections import Counter
+
+from database import create_databases
+from shards import ShardLeases, shard_of
+from tests.test_database import DatabaseTestCase
+
+
+class ShardOfTest(DatabaseTestCase):
+
+    def test_consecutive_ids_spread_over_all_shards(self):
+        counts = Counter(shard_of(telegram_id, 16) for telegram_id in range(100000, 116000))
+
+        self.assertEqual(set(counts), set(range(16)))
+        self.assertLess(max(counts.values()) - min(counts.values()), 200)
+        self.assertEqual(shard_of(123456789, 16), shard_of(123456789, 16))
+
+
+class ShardLeasesTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        create_databases()
+        self.first = ShardLeases('first', 16, ttl=30)
+        self.second = ShardLeases('second', 16, ttl=30)
+
+    def test_single_worker_holds_everything(self):
+        self.first.refresh(now=100)
+
+        self.assertEqual(self.first.owned, frozenset(range(16)))
+        self.assertTrue(self.first.sync)
+
+    def test_joining_worker_gets_a_fair_share(self):
+        self.first.refresh(now=100)
+        self.second.refresh(now=101)
+        self.assertEqual(self.second.owned, frozenset())
+
+        # the first one sees two workers and gives half back, the second one takes it
+        self.first.refresh(now=110)
+        self.second.refresh(now=111)
+
+        self.assertEqual(len(self.first.owned), 8)
+        self.assertEqual(len(self.second.owned), 8)
+        self.assertFalse(self.first.owned & self.second.owned)
+        self.assertTrue(self.first.sync)
+        self.assertFalse(self.second.sync)
+
+    def test_delivery_worker_never_checks_for_articles(self):
+        delivery = ShardLeases('delivery', 16, ttl=30, can_sync=False)
+
+        delivery.refresh(now=100)
+        self.first.refresh(now=101)
+
+        self.assertFalse(delivery.sync)
+        self.assertTrue(self.first.sync)
+        self.assertEqual(len(delivery.owned), 16)
+
+    def test_busy_shard_is_not_given_back(self):
+        self.first.refresh(now=100)
+        self.second.refresh(now=101)
+        self.first.busy = 15
+
+        self.first.refresh(now=110)
+
+        self.assertIn(15, self.first.owned)
+
+    def test_shards_of_a_crashed_worker_are_taken_over(self):
+        self.first.refresh(now=100)
+        self.second.refresh(now=101)
+        self.first.refresh(now=110)
+        self.second.refresh(now=111)
+
+        # the first one stopped renewing, its leases ran out
+        self.second.refresh(now=145)
+
+        self.assertEqual(self.second.owned, frozenset(range(16)))
+        self.assertTrue(self.second.sync)
+
+    def test_released_leases_are_taken_at_once(self):
+        self.first.refresh(now=100)
+        self.first.release()
+
+        self.second.refresh(now=101)
+
+        self.assertEqual(self.second.owned, frozenset(range(16)))
+        self.assertTrue(self.second.sync)
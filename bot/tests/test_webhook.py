@@ -0,0 +1,86 @@
+import asyncio
+from pathlib import Path
+from unittest import IsolatedAsyncioTestCase
+
+import aiohttp
+from telebot.async_telebot import AsyncTeleBot
+
+from webhook import WebhookServer
+
+UPDATES_DIR = Path(__file__).parent / 'updates'
+
+
+class WebhookServerTest(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.bot = AsyncTeleBot('123456:test-token')
+        self.handled = []
+        self.done = asyncio.Event()
+
+        @self.bot.message_handler(commands=['start', 'latest'])
+        async def command_handler(message):
+            self.handled.append(message.text)
+            self.done.set()
+
+        self.server = WebhookServer(self.bot, path='/webhook/', secret_token='secret')
+        port = await self.server.start('127.0.0.1', 0)
+        self.url = f'http://127.0.0.1:{port}/webhook/'
+        self.session = aiohttp.ClientSession()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.server.stop()
+
+    async def post(self, body: bytes, url: str | None = None, secret: str = 'secret') -> int:
+        headers = {'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret}
+        async with self.session.post(url or self.url, data=body, headers=headers) as response:
+            return response.status
+
+    async def post_update(self, name: str, **kwargs) -> int:
+        return await self.post((UPDATES_DIR / name).read_bytes(), **kwargs)
+
+    async def test_start_command_reaches_handler(self):
+        status = await self.post_update('start_command.json')
+
+        self.assertEqual(status, 200)
+        await asyncio.wait_for(self.done.wait(), 5)
+        self.assertEqual(self.handled, ['/start'])
+
+    async def test_latest_command_reaches_handler(self):
+        status = await self.post_update('latest_command.json')
+
+        self.assertEqual(status, 200)
+        await asyncio.wait_for(self.done.wait(), 5)
+        self.assertEqual(self.handled, ['/latest'])
+
+    async def test_update_without_handler_is_accepted(self):
+        status = await self.post_update('plain_text.json')
+
+        self.assertEqual(status, 200)
+        await asyncio.wait_for(self.server.queue.join(), 5)
+        self.assertEqual(self.handled, [])
+
+    async def test_wrong_secret_token(self):
+        status = await self.post_update('start_command.json', secret='wrong')
+
+        self.assertEqual(status, 403)
+        self.assertEqual(self.server.queue.qsize(), 0)
+
+    async def test_wrong_path(self):
+        status = await self.post_update('start_command.json', url=self.url + 'other/')
+
+        self.assertEqual(status, 404)
+
+    async def test_invalid_json(self):
+        status = await self.post(b'{not json')
+
+        self.assertEqual(status, 400)
+
+    async def test_full_queue_is_rejected(self):
+        self.server.queue = asyncio.Queue(maxsize=1)
+        self.server.queue.put_nowait({})
+
+        status = await self.post_update('start_command.json')
+
+        self.assertEqual(status, 503)
+        self.assertEqual(self.handled, [])
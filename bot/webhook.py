@@ -0,0 +1,76 @@
+import asyncio
+
+from aiohttp import web
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Update
+
+from botlog import logger
+
+
+class WebhookServer:
+    """
+    HTTP server receiving Telegram updates. Updates are handed to the bot
+    handlers by `workers` tasks, at most `queue_size` more updates wait for
+    a free worker, the rest are answered with 503.
+    """
+
+    def __init__(
+            self,
+            telegram_bot: AsyncTeleBot,
+            path: str = '/',
+            secret_token: str | None = None,
+            workers: int = 8,
+            queue_size: int = 100
+    ):
+        self.bot = telegram_bot
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle_update)
+        self._runner = None
+        self._tasks = []
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret_token:
+            return web.Response(status=403)
+
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Telegram sends the update again later if it does not get 200
+            logger.warning('Webhook queue is full, update rejected')
+            return web.Response(status=503)
+        return web.Response()
+
+    async def process_updates(self) -> None:
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.bot.process_new_updates([Update.de_json(update)])
+            except Exception:
+                logger.exception('Update processing error')
+            finally:
+                self.queue.task_done()
+
+    async def start(self, host: str, port: int) -> int:
+        """Start listening, returns the port actually bound."""
+        self._tasks = [asyncio.create_task(self.process_updates()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
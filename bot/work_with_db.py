@@ -1,53 +1,386 @@
-import operator
-from functools import reduce
+from typing import Callable, Iterable, Iterator
 
-from database import execute_query, connection
+from database import execute_query, execute_many, get_connection, transaction
 
 
 def create_user(telegram_id: int) -> None:
+    """Add the user, or subscribe again a user that was deactivated"""
     execute_query(
-        connection,
-        'INSERT INTO users (telegram_id) VALUES (?);',
+        get_connection(),
+        'INSERT INTO users (telegram_id) VALUES (?) ON CONFLICT(telegram_id) DO UPDATE SET active = 1;',
         (telegram_id,))
 
 
+def create_users(telegram_ids: Iterable[int]) -> None:
+    execute_many(
+        get_connection(),
+        'INSERT OR IGNORE INTO users (telegram_id) VALUES (?);',
+        ((telegram_id,) for telegram_id in telegram_ids))
+
+
 def get_all_users() -> tuple:
     """Get tuple of telegram_id"""
-    data = execute_query(
-        connection,
-        'SELECT telegram_id FROM users;'
+    return tuple(telegram_id for batch in iter_user_batches() for telegram_id in batch)
+
+
+def iter_user_batches(batch_size: int = 1000) -> Iterator[list[int]]:
+    """Yield telegram_id of all active users in batches, paging by id so every page is one index range scan"""
+    last_id = 0
+    while True:
+        rows = execute_query(
+            get_connection(),
+            'SELECT id, telegram_id FROM users WHERE id > ? AND active = 1 ORDER BY id LIMIT ?;',
+            (last_id, batch_size)
         ).fetchall()
-    return reduce(operator.add, data, tuple())
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield [telegram_id for _, telegram_id in rows]
 
 
 def is_user_exist(telegram_id: int):
     """Check if user exist"""
     data = execute_query(
-        connection,
-        'SELECT * FROM users WHERE telegram_id=?;',
+        get_connection(),
+        'SELECT 1 FROM users WHERE telegram_id=?;',
         (telegram_id,)
     )
     return data.fetchone()
 
 
-def create_article_ids(source: str, last_article_id: int) -> None:
-    data = execute_query(connection, 'INSERT INTO article_ids (source, last_article_id) VALUES (?, ?);',
-                         (source, last_article_id))
+def get_cursors() -> dict[str, str]:
+    """Get source -> changes feed cursor of the sources the bot has a position in"""
+    data = execute_query(
+        get_connection(),
+        'SELECT source, cursor FROM article_ids WHERE cursor IS NOT NULL;'
+    )
+    return dict(data.fetchall())
+
 
+def save_cursors(cursors: dict[str, str], connection=None) -> None:
+    """Save source -> cursor, within the open transaction of the connection when one is given"""
+    query = ('INSERT INTO article_ids (source, last_article_id, cursor) VALUES (?, 0, ?) '
+             'ON CONFLICT(source) DO UPDATE SET cursor = excluded.cursor;')
+    if connection is None:
+        execute_many(get_connection(), query, list(cursors.items()))
+    else:
+        connection.executemany(query, list(cursors.items()))
 
-def get_article_ids(source: str) -> int | None:
+
+def get_api_token(base_url: str) -> str | None:
     data = execute_query(
-        connection,
-        'SELECT last_article_id FROM article_ids WHERE source=?;',
-        (source,)
+        get_connection(),
+        'SELECT token FROM api_tokens WHERE base_url=?;',
+        (base_url,)
     ).fetchone()
     if data:
         return data[0]
 
 
-def update_article_ids(source: str, last_article_id: int) -> None:
+def save_api_token(base_url: str, token: str) -> None:
+    execute_query(
+        get_connection(),
+        'INSERT INTO api_tokens (base_url, token) VALUES (?, ?) '
+        'ON CONFLICT(base_url) DO UPDATE SET token = excluded.token;',
+        (base_url, token)
+    )
+
+
+def delete_api_token(base_url: str) -> None:
+    execute_query(
+        get_connection(),
+        'DELETE FROM api_tokens WHERE base_url=?;',
+        (base_url,)
+    )
+
+
+def enqueue_messages(
+        batches: Iterable[list[tuple[str, int, str, float, int, int, bytes | None]]],
+        cursors: dict[str, str]
+) -> None:
+    """
+    Put the (idempotency_key, telegram_id, text, not_before, pack, shard, links) messages of
+    every batch into the outbox in a short transaction of its own, so the handlers can write
+    in between. The cursors move in the last transaction: a run that stopped halfway is built
+    again by the next one and INSERT OR IGNORE skips the messages that are already in.
+    """
+    for messages in batches:
+        with transaction() as connection:
+            connection.executemany(
+                'INSERT OR IGNORE INTO outbox (idempotency_key, telegram_id, text, not_before, pack, shard, links) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?);',
+                messages
+            )
+    with transaction() as connection:
+        save_cursors(cursors, connection)
+
+
+def get_due_messages(
+        due_by: float, shard: int, after: tuple[float, int], limit: int, lease: tuple[str, str], now: float
+) -> list[tuple[int, int, str, float, int]]:
+    """
+    Get (id, telegram_id, text, not_before, pack) of pending messages of the shard due by `due_by`,
+    in due order, and none once the (name, owner) lease ran out: the shard is someone else's then.
+    """
+    return get_connection().execute(
+        "SELECT id, telegram_id, text, not_before, pack FROM outbox "
+        "WHERE status = 'pending' AND shard = ? AND not_before <= ? AND (not_before, id) > (?, ?) "
+        "AND EXISTS (SELECT 1 FROM leases WHERE name = ? AND owner = ? AND expires_at > ?) "
+        "ORDER BY not_before, id LIMIT ?;",
+        (shard, due_by, *after, *lease, now, limit)
+    ).fetchall()
+
+
+def get_next_delivery_time(shards: Iterable[int], after: float) -> float | None:
+    """When the first pending message of the shards held back past `after` gets due, one index seek a shard"""
+    connection = get_connection()
+    times = [connection.execute(
+        "SELECT MIN(not_before) FROM outbox WHERE status = 'pending' AND shard = ? AND not_before > ?;",
+        (shard, after)
+    ).fetchone()[0] for shard in shards]
+    return min((when for when in times if when is not None), default=None)
+
+
+def count_pending_messages() -> int:
+    return get_connection().execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending';").fetchone()[0]
+
+
+def settle_messages(
+        sent: list[int],
+        failed: list[int],
+        rejected: list[int],
+        dead: list[int],
+        dead_chats: Iterable[int],
+        max_attempts: int,
+        lease: tuple[str, str],
+        now: float,
+        on_sent: Callable[[list[int]], None] | None = None
+) -> bool:
+    """
+    Record in one transaction what became of outbox messages: sent, failed once more (out of
+    attempts they are not retried), rejected by Telegram (never retried) or to chats that are gone,
+    those chats are deactivated. `on_sent` saves what belongs to the sent ones in the same transaction.
+    Returns whether the (name, owner) lease is still held.
+    A lock error is raised, the messages must not look unsent.
+    """
+    with transaction() as connection:
+        connection.executemany(
+            "UPDATE outbox SET status = 'sent' WHERE id = ?;",
+            [(message_id,) for message_id in sent]
+        )
+        if sent and on_sent:
+            on_sent(sent)
+        connection.executemany(
+            "UPDATE outbox SET attempts = attempts + 1, "
+            "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END WHERE id = ?;",
+            [(max_attempts, message_id) for message_id in failed]
+        )
+        connection.executemany(
+            "UPDATE outbox SET attempts = attempts + 1, status = 'failed' WHERE id = ?;",
+            [(message_id,) for message_id in rejected]
+        )
+        connection.executemany(
+            "UPDATE outbox SET status = 'failed' WHERE id = ?;",
+            [(message_id,) for message_id in dead]
+        )
+        connection.executemany(
+            'UPDATE users SET active = 0 WHERE telegram_id = ?;',
+            [(telegram_id,) for telegram_id in dead_chats]
+        )
+        return connection.execute(
+            'SELECT 1 FROM leases WHERE name = ? AND owner = ? AND expires_at > ?;', (*lease, now)
+        ).fetchone() is not None
+
+
+def delete_old_messages(days: int) -> None:
+    execute_query(
+        get_connection(),
+        "DELETE FROM outbox WHERE status != 'pending' AND created_at < datetime('now', ?);",
+        (f'-{days} days',)
+    )
+
+
+def save_recent_articles(articles: Iterable[tuple[str, int, str, str, float]], keep: int) -> None:
+    """
+    Save (source, id, title, url, created_at) articles and drop all but the `keep` newest
+    of every source, an article saved again keeps its first created_at.
+    """
+    with transaction() as connection:
+        connection.executemany(
+            'INSERT INTO recent_articles (source, id, title, url, created_at) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(source, id) DO UPDATE SET title = excluded.title, url = excluded.url;',
+            articles
+        )
+        # per source: one crawl of the parser must not push the blog articles out
+        connection.execute(
+            'DELETE FROM recent_articles WHERE (source, id) IN (SELECT source, id FROM ('
+            'SELECT source, id, ROW_NUMBER() OVER (PARTITION BY source ORDER BY created_at DESC) AS number '
+            'FROM recent_articles) WHERE number > ?);',
+            (keep,)
+        )
+
+
+def get_recent_articles(limit: int) -> list[tuple[str, int, str, str, float]]:
+    """Get (source, id, title, url, created_at) of the `limit` newest articles of every source, newest first"""
+    return execute_query(
+        get_connection(),
+        'SELECT source, id, title, url, created_at FROM ('
+        'SELECT *, ROW_NUMBER() OVER (PARTITION BY source ORDER BY created_at DESC) AS number '
+        'FROM recent_articles) WHERE number <= ? ORDER BY created_at DESC;',
+        (limit,)
+    ).fetchall()
+
+
+def get_delivered_links(telegram_ids: list[int]) -> list[tuple[int, int, bytes, bytes]]:
+    """Get (telegram_id, generation, current, previous) of the users that have a row"""
+    return execute_query(
+        get_connection(),
+        'SELECT telegram_id, generation, current, previous FROM delivered_links '
+        f'WHERE telegram_id IN ({", ".join("?" * len(telegram_ids))});',
+        telegram_ids
+    ).fetchall()
+
+
+def get_pending_links(telegram_ids: list[int]) -> list[tuple[int, bytes]]:
+    """Get (telegram_id, links) of the pending outbox messages of the users that have links"""
+    return get_connection().execute(
+        "SELECT telegram_id, links FROM outbox WHERE status = 'pending' AND links IS NOT NULL "
+        f'AND telegram_id IN ({", ".join("?" * len(telegram_ids))});',
+        telegram_ids
+    ).fetchall()
+
+
+def get_message_links(message_ids: list[int]) -> list[tuple[int, bytes]]:
+    """Get (telegram_id, links) of the outbox messages that have links"""
+    return get_connection().execute(
+        'SELECT telegram_id, links FROM outbox '
+        f'WHERE links IS NOT NULL AND id IN ({", ".join("?" * len(message_ids))});',
+        message_ids
+    ).fetchall()
+
+
+def save_delivered_links(rows: Iterable[tuple[int, int, bytes, bytes]]) -> None:
+    """Save (telegram_id, generation, current, previous), within the open transaction of the thread if any"""
+    get_connection().executemany(
+        'INSERT INTO delivered_links (telegram_id, generation, current, previous) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT(telegram_id) DO UPDATE SET generation = excluded.generation, '
+        'current = excluded.current, previous = excluded.previous;',
+        rows
+    )
+
+
+def delete_expired_links(generation: int) -> None:
+    """Drop the rows of users that got nothing since before the given generation"""
     execute_query(
-        connection,
-        "UPDATE article_ids SET last_article_id = ? WHERE source = ?",
-        (last_article_id, source)
+        get_connection(),
+        'DELETE FROM delivered_links WHERE generation < ?;',
+        (generation,)
+    )
+
+
+def get_leases(now: float) -> dict[str, str]:
+    """Get name -> owner of the leases that have not run out"""
+    return dict(execute_query(
+        get_connection(),
+        'SELECT name, owner FROM leases WHERE expires_at > ?;',
+        (now,)
+    ).fetchall())
+
+
+def acquire_leases(names: Iterable[str], owner: str, expires_at: float, now: float) -> set[str]:
+    """
+    Take the leases that are free or ran out and renew the ones the owner holds, in one transaction.
+    Returns the names of all leases the owner holds afterwards.
+    """
+    with transaction() as connection:
+        connection.executemany(
+            'INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+            'WHERE leases.owner = excluded.owner OR leases.expires_at <= ?;',
+            [(name, owner, expires_at, now) for name in names]
+        )
+        return {name for name, in connection.execute(
+            'SELECT name FROM leases WHERE owner = ? AND expires_at > ?;', (owner, now))}
+
+
+def release_leases(names: Iterable[str], owner: str) -> None:
+    execute_many(
+        get_connection(),
+        'DELETE FROM leases WHERE name = ? AND owner = ?;',
+        [(name, owner) for name in names]
+    )
+
+
+def get_preference_rules() -> list[tuple[int, str, str]]:
+    """Get (telegram_id, kind, value) of all subscription rules, read out so another thread can use them"""
+    return get_connection().execute('SELECT telegram_id, kind, value FROM preference_rules;').fetchall()
+
+
+def get_user_preference_rules(telegram_id: int) -> list[tuple[str, str]]:
+    return execute_query(
+        get_connection(),
+        'SELECT kind, value FROM preference_rules WHERE telegram_id = ? ORDER BY kind, value;',
+        (telegram_id,)
+    ).fetchall()
+
+
+def add_preference_rules(telegram_id: int, kind: str, values: Iterable[str]) -> None:
+    execute_many(
+        get_connection(),
+        'INSERT OR IGNORE INTO preference_rules (telegram_id, kind, value) VALUES (?, ?, ?);',
+        [(telegram_id, kind, value) for value in values]
+    )
+
+
+def delete_preference_rules(telegram_id: int, kind: str | None = None, values: Iterable[str] | None = None) -> None:
+    """Delete the given rules, all rules of the kind or all rules of the user"""
+    if values is not None:
+        execute_many(
+            get_connection(),
+            'DELETE FROM preference_rules WHERE telegram_id = ? AND kind = ? AND value = ?;',
+            [(telegram_id, kind, value) for value in values]
+        )
+    elif kind is not None:
+        execute_query(
+            get_connection(),
+            'DELETE FROM preference_rules WHERE telegram_id = ? AND kind = ?;',
+            (telegram_id, kind)
+        )
+    else:
+        execute_query(
+            get_connection(),
+            'DELETE FROM preference_rules WHERE telegram_id = ?;',
+            (telegram_id,)
+        )
+
+
+def get_delivery_windows() -> list[tuple[int, str | None, int | None, int | None, int | None]]:
+    return get_connection().execute(
+        'SELECT telegram_id, timezone, quiet_start, quiet_end, deliver_at FROM delivery_windows;'
+    ).fetchall()
+
+
+def get_delivery_window(telegram_id: int) -> tuple[str | None, int | None, int | None, int | None] | None:
+    return execute_query(
+        get_connection(),
+        'SELECT timezone, quiet_start, quiet_end, deliver_at FROM delivery_windows WHERE telegram_id = ?;',
+        (telegram_id,)
+    ).fetchone()
+
+
+def set_delivery_window(telegram_id: int, **fields) -> None:
+    """Update timezone, quiet_start, quiet_end or deliver_at of the user"""
+    columns = [column for column in ('timezone', 'quiet_start', 'quiet_end', 'deliver_at') if column in fields]
+    execute_query(
+        get_connection(),
+        f'INSERT INTO delivery_windows (telegram_id, {", ".join(columns)}) '
+        f'VALUES (?{", ?" * len(columns)}) ON CONFLICT(telegram_id) DO UPDATE SET '
+        + ', '.join(f'{column} = excluded.{column}' for column in columns) + ';',
+        (telegram_id, *(fields[column] for column in columns))
+    )
+    execute_query(
+        get_connection(),
+        'DELETE FROM delivery_windows WHERE telegram_id = ? AND timezone IS NULL '
+        'AND quiet_start IS NULL AND deliver_at IS NULL;',
+        (telegram_id,)
     )